@@ -0,0 +1,186 @@
+""" Boosting baseline of the colored MNIST experiment
+
+`run_boosting` fits the repetitions of the baseline of Boosting.py: a
+classifier trained on the two train environments (color flip
+probabilities train_flip_probs) and scored on a test environment (flip
+probability test_flip_prob), the environments being drawn again for
+each repetition.
+
+The environments of every repetition are built at once, as uint8, and
+placed in shared memory; the repetitions are fitted by a pool of worker
+processes that map the arrays instead of receiving a pickled copy.
+Trees only compare feature values, so the uint8 pixels are given to the
+models as they are (the float images of the script are these / 255).
+
+Models:
+
+    adaboost    AdaBoostClassifier(n_estimators=50, learning_rate=1), the
+                model of Boosting.py
+    histgb      HistGradientBoostingClassifier, binning the features once
+                and fitting much faster
+
+The results are written to irm_boosting_results_<time>.csv, one row per
+repetition with its accuracies and the costs of the fit (see
+experiment_synthetic/profiling.py).
+"""
+
+import datetime as dt
+import multiprocessing as mp
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy
+import pandas as pd
+import torch
+
+from ..experiment_synthetic import events
+from ..experiment_synthetic.profiling import COST_COLUMNS, Measurement
+from .data import MNIST_ROOT, color_environments, load_mnist, split_mnist
+
+MODELS = ["adaboost", "histgb"]
+RESULT_COLUMNS = ["Repetition", "Model", "TrainAcc", "TestAcc", *COST_COLUMNS]
+
+
+def make_model(name, random_state=None):
+    """Unfitted classifier of the baseline"""
+    if name == "adaboost":
+        from sklearn.ensemble import AdaBoostClassifier
+
+        return AdaBoostClassifier(
+            n_estimators=50, learning_rate=1, random_state=random_state
+        )
+    if name == "histgb":
+        from sklearn.ensemble import HistGradientBoostingClassifier
+
+        return HistGradientBoostingClassifier(random_state=random_state)
+    raise ValueError(f"Unknown model {name}, choose from {MODELS}")
+
+
+def make_environments(args):
+    """Flattened uint8 images and labels of the train and test sets of
+    every repetition: x_train (n_reps x n x 392), y_train (n_reps x n),
+    x_test and y_test"""
+    if args.get("seed", -1) >= 0:
+        torch.manual_seed(args["seed"])
+        numpy.random.seed(args["seed"])
+    n_reps = args["n_reps"]
+    train_flips = [float(e) for e in str(args["train_flip_probs"]).split(",")]
+    (train_x, train_y), (val_x, val_y) = split_mnist(
+        *load_mnist(args.get("mnist_root") or MNIST_ROOT)
+    )
+
+    n_train = len(train_flips)
+    train = [
+        color_environments(train_x[j::n_train], train_y[j::n_train], [e] * n_reps)
+        for j, e in enumerate(train_flips)
+    ]
+    test = color_environments(val_x, val_y, [args["test_flip_prob"]] * n_reps)
+    return {
+        "x_train": torch.cat([x for x, _ in train], dim=1).flatten(start_dim=2).numpy(),
+        "y_train": torch.cat([y for _, y in train], dim=1)[..., 0].byte().numpy(),
+        "x_test": test[0].flatten(start_dim=2).numpy(),
+        "y_test": test[1][..., 0].byte().numpy(),
+    }
+
+
+def _share(arrays):
+    """Copy arrays to shared memory. Return the blocks and their specs."""
+    blocks, specs = [], {}
+    for name, array in arrays.items():
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        numpy.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+        blocks.append(block)
+        specs[name] = (block.name, array.shape, array.dtype.str)
+    return blocks, specs
+
+
+def _attach(specs):
+    """Map the shared arrays. Return the blocks (to keep open) and the arrays."""
+    blocks, arrays = [], {}
+    for name, (block_name, shape, dtype) in specs.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        blocks.append(block)
+        arrays[name] = numpy.ndarray(shape, numpy.dtype(dtype), buffer=block.buf)
+    return blocks, arrays
+
+
+def fit_repetition(arrays, rep_i, model_name, seed=-1, n_threads=None):
+    """Fit and score the model on the environments of repetition rep_i.
+    Return a row of the results."""
+    from threadpoolctl import threadpool_limits
+
+    model = make_model(model_name, random_state=seed + rep_i if seed >= 0 else None)
+    with threadpool_limits(limits=n_threads), Measurement() as cost:
+        model.fit(arrays["x_train"][rep_i], arrays["y_train"][rep_i])
+    train_acc = model.score(arrays["x_train"][rep_i], arrays["y_train"][rep_i])
+    test_acc = model.score(arrays["x_test"][rep_i], arrays["y_test"][rep_i])
+    n_iterations = getattr(model, "n_iter_", None) or len(
+        getattr(model, "estimators_", [])
+    )
+    return (rep_i, model_name, train_acc, test_acc, *cost.values(n_iterations))
+
+
+def _fit_shared(specs, rep_i, model_name, seed, n_threads):
+    """fit_repetition in a worker process, on the shared arrays"""
+    blocks, arrays = _attach(specs)
+    try:
+        return fit_repetition(arrays, rep_i, model_name, seed, n_threads)
+    finally:
+        del arrays
+        for block in blocks:
+            block.close()
+
+
+def run_boosting(args):
+    """Fit every repetition, in parallel. Return the results."""
+    n_reps, model_name = args["n_reps"], args.get("model", "adaboost")
+    seed = args.get("seed", -1)
+    n_workers = min(args.get("n_workers") or os.cpu_count(), n_reps)
+    # the cores are shared between the workers
+    n_threads = args.get("n_threads") or max(1, os.cpu_count() // n_workers)
+    events.open_stream(args.get("events"))
+    events.emit("run_start", info={"n_reps": n_reps, "methods": [model_name]})
+
+    arrays = make_environments(args)
+    rows = []
+    try:
+        if n_workers == 1:
+            for rep_i in range(n_reps):
+                events.emit("method_start", rep=rep_i, method=model_name)
+                rows.append(fit_repetition(arrays, rep_i, model_name, seed, n_threads))
+                events.emit("method_end", rep=rep_i, method=model_name)
+                events.emit("rep_end", rep=rep_i)
+        else:
+            blocks, specs = _share(arrays)
+            del arrays
+            try:
+                # spawn: do not fork a parent that has already initialised torch
+                with ProcessPoolExecutor(
+                    max_workers=n_workers, mp_context=mp.get_context("spawn")
+                ) as pool:
+                    futures = {}
+                    for rep_i in range(n_reps):
+                        futures[
+                            pool.submit(
+                                _fit_shared, specs, rep_i, model_name, seed, n_threads
+                            )
+                        ] = rep_i
+                        events.emit("method_start", rep=rep_i, method=model_name)
+                    for future in as_completed(futures):
+                        rows.append(future.result())
+                        events.emit(
+                            "method_end", rep=futures[future], method=model_name
+                        )
+                        events.emit("rep_end", rep=futures[future])
+            finally:
+                for block in blocks:
+                    block.close()
+                    block.unlink()
+    finally:
+        results_df = pd.DataFrame(sorted(rows), columns=RESULT_COLUMNS)
+        _results_dest = f"irm_boosting_results_{str(dt.datetime.now()).split('.', maxsplit=1)[0].replace(' ', '_')}.csv"
+        results_df.to_csv(_results_dest, index=False)
+        events.emit("run_end", results=_results_dest)
+        events.close_stream()
+    return results_df
@@ -0,0 +1,300 @@
+""" Colored MNIST of the CNN experiment, as memory-mapped uint8 tensors
+
+The CNN experiment (irm/image/CNN.py) colors the full 28 x 28 MNIST
+train images in red or green, and splits them in three environments by
+index: train1 (the first 20000 images, color flipped with probability
+0.2), train2 (the next 20000, 0.1) and test (the last 20000, 0.9).
+
+`prepare_colored_mnist` builds every environment in one vectorized pass
+from a seeded generator and stores them under
+<root>/ColoredMNIST/tensors_seed=<seed>/:
+
+    images.npy      uint8, 60000 x 3 x 28 x 28, the environments in order
+    labels.npy      int64, the binary labels (0 for digits < 5), possibly
+                    flipped
+
+`ColoredMNISTTensors` serves an environment (or all_train, the two train
+ones) as views of the memory-mapped arrays: nothing is decoded or copied
+per sample. Indexed by a tensor of indices, it returns the whole batch
+with a single gather; `make_loader` wraps it in a DataLoader drawing the
+batches from a `TensorBatchSampler`, so there is no per-sample fetch or
+collate:
+
+    loader = make_loader(ColoredMNISTTensors(env="test"), 1000, shuffle=True)
+    for images, labels in loader:
+        images = normalize_batch(images, device)
+
+`make_environments_loader` fuses the batches of several environments in
+one (with the offsets of each environment), for a single forward per
+training step.
+
+Batches are converted and normalized at once by `normalize_batch`, as
+ToTensor and Normalize did per image.
+"""
+
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy
+import torch
+from torch.utils.data import DataLoader, Dataset, Sampler
+
+from .data import load_mnist
+
+ENVIRONMENTS = {
+    "train1": (0, 20000, 0.2),
+    "train2": (20000, 40000, 0.1),
+    "test": (40000, 60000, 0.9),
+}
+SPLITS = {"all_train": (0, 40000), **{k: v[:2] for k, v in ENVIRONMENTS.items()}}
+MEAN = (0.1307, 0.1307, 0.0)
+STD = (0.3081, 0.3081, 0.3081)
+
+
+def tensors_dir(root, seed=0):
+    """Directory of the prepared tensors"""
+    return Path(root).expanduser() / "ColoredMNIST" / f"tensors_seed={seed}"
+
+
+def color_images(images, digits, color_flip_probs, rng, label_noise=0.25):
+    """Red or green 3 x 28 x 28 images and binary labels, the color of
+    image i being flipped with probability color_flip_probs[i]"""
+    labels = (digits >= 5) ^ (rng.random(len(digits)) < label_noise)
+    red = ~labels ^ (rng.random(len(digits)) < color_flip_probs)
+    colored = numpy.zeros((len(images), 3, 28, 28), dtype=numpy.uint8)
+    colored[red, 0] = images[red]
+    colored[~red, 1] = images[~red]
+    return colored, labels.astype(numpy.int64)
+
+
+def prepare_colored_mnist(root="./data", seed=0):
+    """Build and store the environments, unless they already are.
+    Return their directory."""
+    directory = tensors_dir(root, seed)
+    if (directory / "labels.npy").exists():
+        return directory
+
+    images, digits = load_mnist(root)
+    images, digits = images[: SPLITS["test"][1]].numpy(), digits.numpy()
+    color_flip_probs = numpy.zeros(len(images))
+    for start, end, flip_prob in ENVIRONMENTS.values():
+        color_flip_probs[start:end] = flip_prob
+    colored, labels = color_images(
+        images, digits[: len(images)], color_flip_probs, numpy.random.default_rng(seed)
+    )
+
+    directory.parent.mkdir(parents=True, exist_ok=True)
+    tmp_dir = Path(tempfile.mkdtemp(dir=directory.parent, prefix=".tmp_"))
+    try:
+        numpy.save(tmp_dir / "images.npy", colored)
+        # written last: its presence marks complete tensors
+        numpy.save(tmp_dir / "labels.npy", labels)
+        os.rename(tmp_dir, directory)
+    except OSError:
+        # another process prepared them first
+        if not (directory / "labels.npy").exists():
+            raise
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return directory
+
+
+class ColoredMNISTTensors(Dataset):
+    """An environment of the CNN experiment: 'train1', 'train2', 'test' or
+    'all_train'. Items are uint8 3 x 28 x 28 images and int64 labels,
+    batches when indexed by a tensor of indices, to be normalized with
+    normalize_batch."""
+
+    def __init__(self, root="./data", env="train1", seed=0):
+        if env not in SPLITS:
+            raise RuntimeError(
+                f"{env} env unknown. Valid envs are train1, train2, test, and all_train"
+            )
+        self.directory = prepare_colored_mnist(root, seed)
+        self.env = env
+        self._map()
+
+    def _map(self):
+        start, end = SPLITS[self.env]
+        # copy-on-write maps: read lazily, never written back
+        self.images = torch.from_numpy(
+            numpy.load(self.directory / "images.npy", mmap_mode="c")[start:end]
+        )
+        self.labels = torch.from_numpy(
+            numpy.load(self.directory / "labels.npy", mmap_mode="c")[start:end]
+        )
+
+    def __getstate__(self):
+        # the worker processes of a DataLoader map the files again instead
+        # of receiving a copy of the arrays
+        return {"directory": self.directory, "env": self.env}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._map()
+
+    def __getitem__(self, index):
+        return self.images[index], self.labels[index]
+
+    def __len__(self):
+        return len(self.labels)
+
+
+class TensorBatchSampler(Sampler):
+    """Tensors of the indices of the batches of an epoch"""
+
+    def __init__(
+        self, n_samples, batch_size, shuffle=False, drop_last=False, generator=None
+    ):
+        self.n_samples = n_samples
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.generator = generator
+
+    def __iter__(self):
+        if self.shuffle:
+            order = torch.randperm(self.n_samples, generator=self.generator)
+        else:
+            order = torch.arange(self.n_samples)
+        for batch in order.split(self.batch_size):
+            if self.drop_last and len(batch) < self.batch_size:
+                return
+            yield batch
+
+    def __len__(self):
+        if self.drop_last:
+            return self.n_samples // self.batch_size
+        return -(-self.n_samples // self.batch_size)
+
+
+def _batch_loader(
+    dataset,
+    sampler,
+    num_workers=0,
+    persistent_workers=False,
+    prefetch_factor=None,
+    pin_memory=False,
+):
+    kwargs = {
+        "num_workers": num_workers,
+        "persistent_workers": persistent_workers and num_workers > 0,
+        "pin_memory": pin_memory,
+    }
+    # torch 1.x rejects any prefetch_factor, even None, without workers:
+    # leave the DataLoader default unless one is given
+    if num_workers > 0 and prefetch_factor is not None:
+        kwargs["prefetch_factor"] = prefetch_factor
+    return DataLoader(
+        dataset,
+        # each index of the sampler is a batch: no automatic batching
+        sampler=sampler,
+        batch_size=None,
+        **kwargs,
+    )
+
+
+def make_loader(
+    dataset, batch_size, shuffle=False, drop_last=False, generator=None, **kwargs
+):
+    """DataLoader of whole batches of a dataset indexed by tensors of
+    indices. The other keyword arguments are num_workers,
+    persistent_workers, prefetch_factor (batches loaded in advance by each
+    worker) and pin_memory; the second and third only apply with
+    num_workers > 0."""
+    sampler = TensorBatchSampler(
+        len(dataset), batch_size, shuffle, drop_last, generator
+    )
+    return _batch_loader(dataset, sampler, **kwargs)
+
+
+class FusedEnvironments(Dataset):
+    """Environments batched together: indexed by a list of index tensors,
+    one per environment, returns the concatenated images and labels and
+    the offsets of each environment in them (n_envs + 1 values)"""
+
+    def __init__(self, environments):
+        self.environments = list(environments)
+
+    def __getitem__(self, indices):
+        images, labels = zip(
+            *[env[idx] for env, idx in zip(self.environments, indices)]
+        )
+        offsets = torch.tensor([0] + [len(idx) for idx in indices]).cumsum(0)
+        return torch.cat(images), torch.cat(labels), offsets
+
+    def __len__(self):
+        return sum(len(env) for env in self.environments)
+
+
+class MultiEnvironmentSampler(Sampler):
+    """Batches of several environments of unequal sizes, as lists of index
+    tensors (one per environment). No sample is left out of an epoch:
+
+        balanced    batch_size samples of every environment per step, until
+                    the largest one is exhausted; the others are cycled
+                    through, reshuffled at each pass
+        weighted    every sample once, the batch of n_envs * batch_size
+                    samples being split in proportion of the sizes of the
+                    environments
+    """
+
+    def __init__(self, sizes, batch_size, mode="balanced", generator=None):
+        if mode not in ("balanced", "weighted"):
+            raise ValueError(f"Unknown mode {mode}, choose balanced or weighted")
+        self.sizes = list(sizes)
+        self.batch_size = batch_size
+        self.mode = mode
+        self.generator = generator
+        if mode == "weighted" and min(self.sizes) < len(self):
+            raise ValueError(
+                f"Environments of sizes {self.sizes} are too small for "
+                f"{len(self)} weighted batches"
+            )
+
+    def __len__(self):
+        if self.mode == "balanced":
+            return -(-max(self.sizes) // self.batch_size)
+        return -(-sum(self.sizes) // (self.batch_size * len(self.sizes)))
+
+    def _cycled(self, size, n_samples):
+        n_passes = -(-n_samples // size)
+        return torch.cat(
+            [torch.randperm(size, generator=self.generator) for _ in range(n_passes)]
+        )[:n_samples]
+
+    def __iter__(self):
+        n_steps = len(self)
+        if self.mode == "balanced":
+            per_env = [
+                self._cycled(size, n_steps * self.batch_size).split(self.batch_size)
+                for size in self.sizes
+            ]
+        else:
+            per_env = [
+                torch.randperm(size, generator=self.generator).tensor_split(n_steps)
+                for size in self.sizes
+            ]
+        yield from (list(batch) for batch in zip(*per_env))
+
+
+def make_environments_loader(
+    environments, batch_size, mode="balanced", generator=None, **kwargs
+):
+    """DataLoader of the fused batches of environments (see
+    MultiEnvironmentSampler), for a single forward per step. The keyword
+    arguments are those of make_loader."""
+    sampler = MultiEnvironmentSampler(
+        [len(env) for env in environments], batch_size, mode, generator
+    )
+    return _batch_loader(FusedEnvironments(environments), sampler, **kwargs)
+
+
+def normalize_batch(images, device=None):
+    """Float images of a uint8 batch, scaled to [0, 1] and normalized"""
+    images = images.to(device, non_blocking=True).float().div_(255.0)
+    mean = torch.tensor(MEAN, device=images.device).view(1, 3, 1, 1)
+    std = torch.tensor(STD, device=images.device).view(1, 3, 1, 1)
+    return images.sub_(mean).div_(std)
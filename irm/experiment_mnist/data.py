@@ -0,0 +1,91 @@
+""" Colored MNIST environments
+
+The MNIST train set is decoded once by torchvision and cached as uint8
+tensors in <root>/mnist_train_uint8.pt; later loads read that file only.
+
+An environment is built from MNIST images as in the IRM paper:
+
+    1. the images are subsampled 2x (14 x 14)
+    2. the label is 1 for digits < 5, flipped with probability 0.25
+    3. the image is put in the red or the green channel according to the
+       label, the color being flipped with probability e
+
+`color_environments` builds the environments of the same images for a
+list of color flip probabilities e in one vectorized pass, kept as uint8
+until `as_environment` converts one of them for training:
+
+    images, labels = load_mnist()
+    (train_x, train_y), (val_x, val_y) = split_mnist(images, labels)
+    test_images, test_labels = color_environments(val_x, val_y, [0.1, 0.5, 0.9])
+    test_env = as_environment(test_images[2], test_labels[2])
+"""
+
+import inspect
+import os
+from pathlib import Path
+
+import numpy as np
+import torch
+
+MNIST_ROOT = "~/datasets/mnist"
+N_TRAIN = 50000
+_CACHE_NAME = "mnist_train_uint8.pt"
+
+
+def torch_load(path, **kwargs):
+    """torch.load, dropping the keyword arguments the installed torch does
+    not take (weights_only only exists since torch 1.13)"""
+    parameters = inspect.signature(torch.load).parameters
+    return torch.load(path, **{k: v for k, v in kwargs.items() if k in parameters})
+
+
+def load_mnist(root=MNIST_ROOT):
+    """Images (uint8, n x 28 x 28) and digits of the MNIST train set"""
+    root = Path(root).expanduser()
+    cache = root / _CACHE_NAME
+    if cache.exists():
+        mnist = torch_load(cache, weights_only=True)
+        return mnist["images"], mnist["targets"]
+
+    from torchvision import datasets
+
+    mnist = datasets.MNIST(str(root), train=True, download=True)
+    images, targets = mnist.data.contiguous(), mnist.targets.contiguous()
+    # written then renamed, for the scripts started at the same time
+    tmp_cache = root / f".{_CACHE_NAME}.{os.getpid()}"
+    torch.save({"images": images, "targets": targets}, tmp_cache)
+    os.replace(tmp_cache, cache)
+    return images, targets
+
+
+def split_mnist(images, targets, n_train=N_TRAIN):
+    """Train and validation splits, the train set being shuffled with the
+    numpy global RNG (as np.random.shuffle did on both tensors)"""
+    order = torch.from_numpy(np.random.permutation(n_train))
+    return (images[order], targets[order]), (images[n_train:], targets[n_train:])
+
+
+def color_environments(images, digits, flip_probs, label_noise=0.25, generator=None):
+    """Colored environments of the same images, one per color flip
+    probability. Return images (k x n x 2 x 14 x 14, uint8) and labels
+    (k x n x 1, float)."""
+    flip_probs = torch.as_tensor(flip_probs, dtype=torch.float32)[:, None]
+    n_envs, n_images = len(flip_probs), len(digits)
+    # 2x subsample for computational convenience
+    small = images.reshape((-1, 28, 28))[:, ::2, ::2]
+
+    labels = (digits < 5).expand(n_envs, n_images)
+    labels = labels ^ (torch.rand(n_envs, n_images, generator=generator) < label_noise)
+    colors = labels ^ (torch.rand(n_envs, n_images, generator=generator) < flip_probs)
+    # the image is kept in channel `color`, the other one is zeroed out
+    channels = torch.stack([~colors, colors], dim=2).to(torch.uint8)
+    colored = small[None, :, None] * channels[..., None, None]
+    return colored, labels.float()[..., None]
+
+
+def as_environment(images, labels, device="cpu"):
+    """Environment dict of the training scripts from colored uint8 images"""
+    return {
+        "images": images.to(device).float().div_(255.0),
+        "labels": labels.to(device),
+    }
@@ -0,0 +1,54 @@
+""" Training steps of the colored MNIST experiments
+
+The train environments are concatenated once by `fuse_environments`, so
+that each step runs a single forward pass over all of them; the logits
+are split back per environment for the risks and the penalties.
+
+Test environments do not affect training: `evaluate` runs them under
+torch.inference_mode (no graph, no penalty), and only every eval_every
+steps (see `is_eval_step`).
+"""
+
+import torch
+
+from .models import mean_accuracy, mean_nll, penalty
+
+
+def fuse_environments(envs):
+    """Concatenate the images and labels of environments, keeping their sizes"""
+    return {
+        "images": torch.cat([env["images"] for env in envs]),
+        "labels": torch.cat([env["labels"] for env in envs]),
+        "sizes": [len(env["labels"]) for env in envs],
+    }
+
+
+def train_metrics(model, fused, penalty_fn=penalty):
+    """Mean over the fused environments of their nll, accuracy and
+    penalty (one per model for a batched model). A penalty_fn of None
+    skips the penalty, which is then 0."""
+    logits = model(fused["images"])
+    metrics = {"nll": [], "acc": [], "penalty": []}
+    for env_logits, env_labels in zip(
+        logits.split(fused["sizes"], dim=-2), fused["labels"].split(fused["sizes"])
+    ):
+        nll = mean_nll(env_logits, env_labels)
+        metrics["nll"].append(nll)
+        metrics["acc"].append(mean_accuracy(env_logits, env_labels))
+        metrics["penalty"].append(
+            torch.zeros_like(nll)
+            if penalty_fn is None
+            else penalty_fn(env_logits, env_labels)
+        )
+    return {name: torch.stack(values).mean(dim=0) for name, values in metrics.items()}
+
+
+def evaluate(model, envs):
+    """Accuracy on each environment, without autograd"""
+    with torch.inference_mode():
+        return [mean_accuracy(model(env["images"]), env["labels"]) for env in envs]
+
+
+def is_eval_step(step, n_steps, eval_every):
+    """Whether to evaluate at step: every eval_every steps and at the last"""
+    return step % eval_every == 0 or step == n_steps - 1
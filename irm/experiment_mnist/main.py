@@ -0,0 +1,239 @@
+""" Colored MNIST experiment
+
+`run_experiment` trains the restarts of the experiment of
+ERM_colored_mnist.py with a Trainer. The model of a restart is trained
+for each test color flip probability in turn, on new train environments
+(color flip probabilities train_flip_probs), and evaluated on a test
+environment with that flip probability.
+
+With batched_restarts, the restarts are the models of a single
+BatchedMLP trained at once, on the environments of the first restart.
+
+Outputs:
+    the log of ERM_colored_mnist.py, printed and appended to log_file
+    irm_mnist_results_<time>.csv, one row per restart, test flip
+    probability and evaluation step
+    <checkpoint_dir>/restart=<r>_e=<i>.pt, if a checkpoint_dir is given,
+    from which an interrupted seeded run resumes
+    progress events (see experiment_synthetic/events.py)
+"""
+
+import datetime as dt
+from pathlib import Path
+
+import numpy
+import pandas as pd
+import torch
+from torch import optim
+
+from ..experiment_synthetic import events
+from .data import (
+    MNIST_ROOT,
+    as_environment,
+    color_environments,
+    load_mnist,
+    split_mnist,
+)
+from .models import MLP, BatchedMLP, penalty
+from .trainer import Trainer, anneal_schedule
+
+RESULT_COLUMNS = [
+    "Restart",
+    "TestFlip",
+    "Step",
+    "TrainNLL",
+    "TrainAcc",
+    "TrainPenalty",
+    "TestAcc",
+]
+
+
+def _flip_probs(args, key, default):
+    value = args.get(key)
+    return default if not value else [float(e) for e in str(value).split(",")]
+
+
+def make_environments(args, restart):
+    """Colored environments of a restart, for every test flip probability:
+    the uint8 images and labels of each train environment and of the
+    test environment"""
+    if args.get("seed", -1) >= 0:
+        torch.manual_seed(args["seed"] + restart)
+        numpy.random.seed(args["seed"] + restart)
+
+    test_flips = _flip_probs(args, "test_flip_probs", [0.1 * i for i in range(10)])
+    train_flips = _flip_probs(args, "train_flip_probs", [0.2, 0.1])
+    (train_x, train_y), (val_x, val_y) = split_mnist(
+        *load_mnist(args.get("mnist_root") or MNIST_ROOT)
+    )
+    n_train = len(train_flips)
+    train_envs = [
+        color_environments(
+            train_x[j::n_train], train_y[j::n_train], [e] * len(test_flips)
+        )
+        for j, e in enumerate(train_flips)
+    ]
+    return test_flips, train_envs, color_environments(val_x, val_y, test_flips)
+
+
+def _trainer(args, model, hooks):
+    return Trainer(
+        model,
+        optim.Adam(model.parameters(), lr=args["lr"]),
+        penalty=penalty if args.get("penalty", "irm") == "irm" else None,
+        schedule=anneal_schedule(args["penalty_weight"], args["penalty_anneal_iters"]),
+        l2_regularizer_weight=args["l2_regularizer_weight"],
+        eval_every=args.get("eval_every", 100),
+        hooks=hooks,
+        checkpoint_every=args.get("checkpoint_every", 0),
+    )
+
+
+def _emit_record(test_flip, record):
+    if events.enabled():
+        events.emit(
+            "mnist_eval",
+            test_flip=test_flip,
+            step=record["step"],
+            train_acc=numpy.asarray(record["acc"]).tolist(),
+            test_acc=numpy.asarray(record["test_acc"][0]).tolist(),
+        )
+
+
+def train_restart(args, model, environments, restart):
+    """Train a model (or the restarts of a BatchedMLP) on every test flip
+    probability in turn. Return the history of each."""
+    test_flips, train_envs, test_envs = environments
+    checkpoint_dir = args.get("checkpoint_dir")
+    if checkpoint_dir:
+        Path(checkpoint_dir).mkdir(parents=True, exist_ok=True)
+
+    # a single optimizer for every test flip probability, as in the script
+    current = {}
+    trainer = _trainer(args, model, [lambda record: _emit_record(current["e"], record)])
+    histories = []
+    for i, e in enumerate(test_flips):
+        current["e"] = e
+        checkpoint = (
+            Path(checkpoint_dir) / f"restart={restart}_e={i}.pt"
+            if checkpoint_dir
+            else None
+        )
+        histories.append(
+            trainer.fit(
+                [as_environment(x[i], y[i]) for x, y in train_envs],
+                [as_environment(test_envs[0][i], test_envs[1][i])],
+                args["steps"],
+                checkpoint=checkpoint,
+            )
+        )
+    return histories
+
+
+def _pretty_print(log, *values):
+    col_width = 13
+
+    def format_val(v):
+        if not isinstance(v, str):
+            v = numpy.array2string(v, precision=5, floatmode="fixed")
+        return v.ljust(col_width)
+
+    str_values = [format_val(v) for v in values]
+    print("   ".join(str_values))
+    if log is not None:
+        log.write("   ".join(str_values) + " \n")
+
+
+def _model_values(record, model_i):
+    values = [record["nll"], record["acc"], record["penalty"], record["test_acc"][0]]
+    return [v if model_i is None else numpy.asarray(v[model_i]) for v in values]
+
+
+def log_restart(log, test_flips, histories, finals, eval_every, model_i=None):
+    """Print the log of ERM_colored_mnist.py for a restart, model_i being
+    its index in a BatchedMLP. finals holds the final train and test
+    accuracies of the restarts so far."""
+    print("Restart")
+    for e, history in zip(test_flips, histories):
+        if log is not None:
+            log.write("e= " + str(e) + " \n")
+        _pretty_print(
+            log, "step", "train nll", "train acc", "train penalty", "test acc"
+        )
+        for record in history:
+            if record["step"] % eval_every:
+                # the extra evaluation of the last step is not printed
+                continue
+            _pretty_print(
+                log, numpy.int32(record["step"]), *_model_values(record, model_i)
+            )
+
+        _, train_acc, _, test_acc = _model_values(history[-1], model_i)
+        finals["train"].append(train_acc)
+        finals["test"].append(test_acc)
+        print("Final train acc (mean/std across restarts so far):")
+        print(numpy.mean(finals["train"]), numpy.std(finals["train"]))
+        print("Final test acc (mean/std across restarts so far):")
+        print(numpy.mean(finals["test"]), numpy.std(finals["test"]))
+
+
+def _result_rows(restart, test_flips, histories, model_i=None):
+    for e, history in zip(test_flips, histories):
+        for record in history:
+            values = _model_values(record, model_i)
+            yield (restart, e, record["step"], *[float(v) for v in values])
+
+
+def run_experiment(args):
+    """Train the restarts, write the log and the results"""
+    if args.get("checkpoint_dir") and args.get("seed", -1) < 0:
+        raise ValueError("checkpoint_dir needs a seed: unseeded runs cannot resume")
+    if args.get("seed", -1) >= 0 and args.get("n_threads"):
+        torch.set_num_threads(args["n_threads"])
+    method = "IRM" if args.get("penalty", "irm") == "irm" else "ERM"
+    events.open_stream(args.get("events"))
+    events.emit("run_start", info={"n_reps": args["n_restarts"], "methods": [method]})
+
+    log_file = args.get("log_file")
+    log = open(log_file, "a", encoding="utf-8") if log_file else None
+    finals = {"train": [], "test": []}
+    eval_every = args.get("eval_every", 100)
+    rows = []
+    try:
+        if args.get("batched_restarts"):
+            environments = make_environments(args, 0)
+            model = BatchedMLP(
+                args["n_restarts"], args["hidden_dim"], args["grayscale_model"]
+            )
+            events.emit("method_start", method=method)
+            histories = train_restart(args, model, environments, "batched")
+            events.emit("method_end", method=method)
+            for restart in range(args["n_restarts"]):
+                events.emit("rep_end", rep=restart)
+            for restart in range(args["n_restarts"]):
+                log_restart(
+                    log, environments[0], histories, finals, eval_every, model_i=restart
+                )
+                rows += _result_rows(restart, environments[0], histories, restart)
+            return pd.DataFrame(rows, columns=RESULT_COLUMNS)
+
+        for restart in range(args["n_restarts"]):
+            events.set_context(rep=restart)
+            events.emit("rep_start")
+            environments = make_environments(args, restart)
+            model = MLP(args["hidden_dim"], args["grayscale_model"])
+            events.emit("method_start", method=method)
+            histories = train_restart(args, model, environments, restart)
+            events.emit("method_end", method=method)
+            log_restart(log, environments[0], histories, finals, eval_every)
+            rows += _result_rows(restart, environments[0], histories)
+            events.emit("rep_end")
+        return pd.DataFrame(rows, columns=RESULT_COLUMNS)
+    finally:
+        if log is not None:
+            log.close()
+        _results_dest = f"irm_mnist_results_{str(dt.datetime.now()).split('.', maxsplit=1)[0].replace(' ', '_')}.csv"
+        pd.DataFrame(rows, columns=RESULT_COLUMNS).to_csv(_results_dest, index=False)
+        events.set_context(rep=None)
+        events.emit("run_end", results=_results_dest)
+        events.close_stream()
@@ -0,0 +1,118 @@
+""" Models of the colored MNIST experiments
+
+`MLP` is the model of ERM_colored_mnist.py. `BatchedMLP` holds the
+weights of n_models independent MLPs stacked along a first dimension, so
+that the restarts of an experiment are trained together: every layer is
+a single batched matmul, and the loss helpers below return one value per
+model (a scalar for the logits of a single model). Since Adam is
+elementwise, a single optimizer over the stacked weights updates each
+model as its own optimizer would, provided the per-model losses are
+summed.
+"""
+
+import torch
+from torch import autograd, nn
+from torch.nn import functional as F
+
+
+class MLP(nn.Module):
+    """MLP of the colored MNIST experiments (2 x 14 x 14 inputs)"""
+
+    def __init__(self, hidden_dim=256, grayscale_model=False):
+        super().__init__()
+        self.grayscale_model = grayscale_model
+        lin1 = nn.Linear(14 * 14 if grayscale_model else 2 * 14 * 14, hidden_dim)
+        lin2 = nn.Linear(hidden_dim, hidden_dim)
+        lin3 = nn.Linear(hidden_dim, 1)
+        for lin in [lin1, lin2, lin3]:
+            nn.init.xavier_uniform_(lin.weight)
+            nn.init.zeros_(lin.bias)
+        self._main = nn.Sequential(lin1, nn.ReLU(True), lin2, nn.ReLU(True), lin3)
+
+    def forward(self, images):
+        """Logits (n x 1) of images (n x 2 x 14 x 14)"""
+        if self.grayscale_model:
+            out = images.view(images.shape[0], 2, 14 * 14).sum(dim=1)
+        else:
+            out = images.view(images.shape[0], 2 * 14 * 14)
+        return self._main(out)
+
+    def weight_norm(self):
+        """Squared norm of the parameters"""
+        return sum(p.pow(2).sum() for p in self.parameters())
+
+
+class BatchedLinear(nn.Module):
+    """n_models independent linear layers"""
+
+    def __init__(self, n_models, in_features, out_features):
+        super().__init__()
+        self.weight = nn.Parameter(torch.empty(n_models, in_features, out_features))
+        self.bias = nn.Parameter(torch.zeros(n_models, 1, out_features))
+        with torch.no_grad():
+            for weight in self.weight:
+                nn.init.xavier_uniform_(weight)
+
+    def forward(self, x):
+        """x is n x in_features (shared by the models) or
+        n_models x n x in_features. Return n_models x n x out_features."""
+        if x.dim() == 2:
+            # a single GEMM against the weights of every model side by side
+            n_models, in_features, out_features = self.weight.shape
+            weight = self.weight.transpose(0, 1).reshape(in_features, -1)
+            out = (x @ weight).view(len(x), n_models, out_features).transpose(0, 1)
+            return out + self.bias
+        return torch.baddbmm(self.bias, x, self.weight)
+
+
+class BatchedMLP(nn.Module):
+    """n_models MLPs of the colored MNIST experiments (2 x 14 x 14 inputs)"""
+
+    def __init__(self, n_models, hidden_dim=256, grayscale_model=False):
+        super().__init__()
+        self.grayscale_model = grayscale_model
+        in_features = 14 * 14 if grayscale_model else 2 * 14 * 14
+        self._main = nn.Sequential(
+            BatchedLinear(n_models, in_features, hidden_dim),
+            nn.ReLU(True),
+            BatchedLinear(n_models, hidden_dim, hidden_dim),
+            nn.ReLU(True),
+            BatchedLinear(n_models, hidden_dim, 1),
+        )
+
+    def forward(self, images):
+        """Logits (n_models x n x 1) of images (n x 2 x 14 x 14)"""
+        if self.grayscale_model:
+            out = images.view(images.shape[0], 2, 14 * 14).sum(dim=1)
+        else:
+            out = images.view(images.shape[0], 2 * 14 * 14)
+        return self._main(out)
+
+    def weight_norm(self):
+        """Squared norm of the parameters of each model"""
+        return sum(p.pow(2).flatten(start_dim=1).sum(dim=1) for p in self.parameters())
+
+
+def mean_nll(logits, y):
+    """Mean negative log-likelihood, of each model for batched logits
+    (n_models x n x 1)"""
+    nll = F.binary_cross_entropy_with_logits(
+        logits, y.expand_as(logits), reduction="none"
+    )
+    return nll.mean(dim=(-2, -1))
+
+
+def mean_accuracy(logits, y):
+    """Accuracy, of each model for batched logits"""
+    preds = (logits > 0.0).float()
+    return ((preds - y).abs() < 1e-2).float().mean(dim=(-2, -1))
+
+
+def penalty(logits, y):
+    """IRMv1 penalty, of each model for batched logits: squared gradient
+    of the risk with respect to a dummy scale of the logits"""
+    batch_shape = logits.shape[:-2]
+    scale = torch.ones(*batch_shape, 1, 1, device=logits.device, requires_grad=True)
+    loss = mean_nll(logits * scale, y).sum()
+    grad = autograd.grad(loss, [scale], create_graph=True)[0]
+    return grad.view(batch_shape) ** 2
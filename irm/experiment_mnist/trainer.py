@@ -0,0 +1,149 @@
+""" Reusable training loop of the colored MNIST experiments
+
+`Trainer` runs the IRM training loop of ERM_colored_mnist.py on any
+model (an MLP or the restarts of a BatchedMLP) and environments:
+
+    trainer = Trainer(
+        model,
+        optim.Adam(model.parameters(), lr=1e-3),
+        schedule=anneal_schedule(10000.0, anneal_iters=100),
+        hooks=[print],
+    )
+    history = trainer.fit(train_envs, test_envs, n_steps=501)
+
+Its parts are pluggable:
+
+    penalty         function of (logits, labels) returning the penalty of
+                    an environment, None for ERM
+    schedule        function of the step returning the penalty weight
+    eval_every      the test environments are evaluated (without autograd)
+                    and a record is made every eval_every steps and at the
+                    last step
+    hooks           functions called with each record, e.g. to print it
+                    or to emit it as an event
+    checkpoint      `fit` saves the model, the optimizer and the history to
+                    this file every checkpoint_every steps and at the end,
+                    and resumes from it when it exists
+
+A record is a dict of the step, the train nll, acc and penalty and the
+test_acc of each test environment, as numpy values (arrays over the
+models of a BatchedMLP).
+"""
+
+import os
+from pathlib import Path
+
+import torch
+
+from .data import torch_load
+from .engine import evaluate, fuse_environments, is_eval_step, train_metrics
+from .models import penalty as irm_penalty
+
+
+def anneal_schedule(penalty_weight, anneal_iters=0):
+    """Penalty weight of 1 for the first anneal_iters steps, then penalty_weight"""
+
+    def schedule(step):
+        return penalty_weight if step >= anneal_iters else 1.0
+
+    return schedule
+
+
+class Trainer(object):
+    """Train a model on environments, see the module docstring"""
+
+    def __init__(
+        self,
+        model,
+        optimizer,
+        penalty=irm_penalty,
+        schedule=None,
+        l2_regularizer_weight=0.0,
+        eval_every=100,
+        hooks=(),
+        checkpoint_every=0,
+    ):
+        self.model = model
+        self.optimizer = optimizer
+        self.penalty = penalty
+        self.schedule = schedule or anneal_schedule(1.0)
+        self.l2_regularizer_weight = l2_regularizer_weight
+        self.eval_every = eval_every
+        self.hooks = list(hooks)
+        self.checkpoint_every = checkpoint_every
+
+    def step(self, train_env, step):
+        """One optimization step on the fused train environments.
+        Return the metrics of the weights before the update."""
+        metrics = train_metrics(self.model, train_env, self.penalty)
+        loss = metrics["nll"] + self.l2_regularizer_weight * self.model.weight_norm()
+        penalty_weight = self.schedule(step) if self.penalty is not None else 0.0
+        loss = loss + penalty_weight * metrics["penalty"]
+        if penalty_weight > 1.0:
+            # Rescale the entire loss to keep gradients in a reasonable range
+            loss = loss / penalty_weight
+
+        self.optimizer.zero_grad()
+        # summed over the models of a batched model, which share no weights
+        loss.sum().backward()
+        self.optimizer.step()
+        return metrics
+
+    def fit(self, train_envs, test_envs, n_steps, checkpoint=None):
+        """Train for n_steps (counting those of a resumed checkpoint).
+        Return the records of the evaluation steps."""
+        start, history = 0, []
+        if checkpoint is not None and Path(checkpoint).exists():
+            start, history = self.load(checkpoint)
+
+        train_env = fuse_environments(train_envs)
+        for step in range(start, n_steps):
+            evaluated = is_eval_step(step, n_steps, self.eval_every)
+            if evaluated:
+                # the test accuracy of the weights before the update, as the
+                # train metrics
+                test_accs = evaluate(self.model, test_envs)
+            metrics = self.step(train_env, step)
+
+            if evaluated:
+                record = {
+                    "step": step,
+                    **{k: v.detach().cpu().numpy() for k, v in metrics.items()},
+                    "test_acc": [acc.cpu().numpy() for acc in test_accs],
+                }
+                history.append(record)
+                for hook in self.hooks:
+                    hook(record)
+            if (
+                checkpoint is not None
+                and self.checkpoint_every
+                and (step + 1) % self.checkpoint_every == 0
+            ):
+                self.save(checkpoint, step + 1, history)
+
+        if checkpoint is not None:
+            self.save(checkpoint, n_steps, history)
+        return history
+
+    def save(self, path, n_steps_done, history):
+        """Write a checkpoint, atomically"""
+        tmp_path = Path(f"{path}.tmp")
+        torch.save(
+            {
+                "model": self.model.state_dict(),
+                "optimizer": self.optimizer.state_dict(),
+                "step": n_steps_done,
+                "history": history,
+            },
+            tmp_path,
+        )
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        """Restore a checkpoint. Return the number of steps it had done and
+        its history."""
+        # the history holds numpy arrays, which weights-only loading rejects
+        state = torch_load(path, weights_only=False)
+        self.model.load_state_dict(state["model"])
+        self.optimizer.load_state_dict(state["optimizer"])
+        return state["step"], state["history"]
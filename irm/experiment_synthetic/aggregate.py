@@ -0,0 +1,114 @@
+""" Vectorized aggregation of result files
+
+Reads the results written by `irm from_params`/`from_file`
+(irm_results_<time>.csv), by a sweep or a queue (results.csv) or any
+CSV/Parquet file with the same columns, and summarizes the errors per
+setup and method:
+
+    summary = summarize(load_results(["runs/", "sweep/results.csv"]))
+
+Only the columns needed are read from each file, and files are read one
+at a time by `iter_results`. The summary is the table `plot.plot_bars`
+draws: indexed by (Acronym, Method), with the mean, std and count of
+ErrCausal and ErrNonCausal.
+"""
+
+import glob
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+SETUP_COLUMNS = ["Coefficients", "GraphObservation", "Dispersion", "Scramble"]
+ERROR_COLUMNS = ["ErrCausal", "ErrNonCausal"]
+SUMMARY_COLUMNS = [*SETUP_COLUMNS, "Method", *ERROR_COLUMNS]
+
+# file names searched for in directories
+_RESULT_PATTERNS = ["irm_results_*.csv", "results.csv", "*.parquet"]
+
+
+def result_files(paths):
+    """Expand files, directories (searched recursively) and glob patterns
+    into a sorted list of result files"""
+    files = set()
+    for path in paths:
+        path = Path(path)
+        if path.is_dir():
+            for pattern in _RESULT_PATTERNS:
+                files.update(path.rglob(pattern))
+        elif path.exists():
+            files.add(path)
+        else:
+            files.update(Path(p) for p in glob.glob(str(path), recursive=True))
+    return sorted(files)
+
+
+def read_result_file(path, columns=None):
+    """Read the given columns (all if None) of a CSV or Parquet file.
+    Columns missing from the file (e.g. grid keys of another sweep) are
+    skipped."""
+    path = Path(path)
+    if path.suffix == ".parquet":
+        if columns is None:
+            return pd.read_parquet(path)
+        import pyarrow.parquet as pq
+
+        available = set(pq.read_schema(path).names)
+        return pd.read_parquet(path, columns=[c for c in columns if c in available])
+
+    usecols = None if columns is None else (lambda c: c in columns)
+    return pd.read_csv(path, usecols=usecols)
+
+
+def iter_results(paths, columns=SUMMARY_COLUMNS):
+    """Yield the results of each file, tagged with its Source"""
+    for path in result_files(paths):
+        df = read_result_file(path, columns)
+        df["Source"] = str(path)
+        yield df
+
+
+def load_results(paths, columns=SUMMARY_COLUMNS):
+    """Concatenate the results of every file"""
+    dfs = list(iter_results(paths, columns))
+    if not dfs:
+        raise FileNotFoundError(f"No result files in {paths}")
+    df = pd.concat(dfs, axis="rows", ignore_index=True)
+    for column in ["Method", "Source"]:
+        df[column] = df[column].astype("category")
+    return df
+
+
+def add_acronym(results_df):
+    """Add the Acronym of the setup, e.g. PES for a partially observed,
+    heteroscedastic, scrambled SEM (see main.format_results_df)"""
+    letters = [
+        np.where(results_df[column].astype(int) == 1, one, zero)
+        for column, one, zero in [
+            ("GraphObservation", "P", "F"),
+            ("Dispersion", "E", "O"),
+            ("Scramble", "S", "U"),
+        ]
+    ]
+    results_df["Acronym"] = np.char.add(np.char.add(letters[0], letters[1]), letters[2])
+    return results_df
+
+
+def summarize(results_df, by=("Acronym", "Method")):
+    """Mean, std and count of the errors of each group of rows.
+    The std is the population std (ddof=0), as plot_bars always drew.
+    by may include any other column, e.g. the grid keys of a sweep."""
+    if "Acronym" in by and "Acronym" not in results_df:
+        results_df = add_acronym(results_df.copy())
+    methods = results_df[results_df.Method != "SEM"]
+    grouped = methods.groupby(list(by), observed=True)[ERROR_COLUMNS]
+    summary = pd.concat(
+        {
+            "mean": grouped.mean(),
+            "std": grouped.std(ddof=0),
+            "count": grouped.count(),
+        },
+        axis="columns",
+    )
+    # (error, statistic) columns, e.g. summary["ErrCausal", "mean"]
+    return summary.swaplevel(axis="columns").sort_index(axis="columns")
@@ -0,0 +1,200 @@
+""" Benchmarks of the hot paths of the synthetic experiments
+
+Each case times one call of:
+
+    sem         ChainEquationModel.__call__
+    erm         EmpiricalRiskMinimizer
+    icp         InvariantCausalPrediction
+    irm         InvariantRiskMinimization, reported in training
+                iterations per second
+
+across dim (and n_samples for IRM). Results are saved as JSON and can be
+compared against a baseline file to flag regressions:
+
+    irm bench --output new.json --baseline old.json
+"""
+
+import math
+import os
+import platform
+import statistics
+import time
+import datetime as dt
+import json
+
+import torch
+
+from .sem import ChainEquationModel
+from .models import (
+    EmpiricalRiskMinimizer,
+    InvariantCausalPrediction,
+    InvariantRiskMinimization,
+)
+
+# higher is better for these metrics, lower is better for the others
+_HIGHER_IS_BETTER = {"iterations_per_second"}
+
+
+def _method_args(**overrides):
+    """Default simulation parameters, with IRM writing its curves nowhere"""
+    from .cli import params_parser
+
+    args = dict(vars(params_parser().parse_args([])))
+    args.update(irm_training_file=os.devnull, **overrides)
+    return args
+
+
+def _environments(dim, n_samples, env_list=(0.2, 2.0, 5.0)):
+    sem = ChainEquationModel(dim, ones=True, hidden=True, scramble=True, hetero=True)
+    return [sem(n_samples, e) for e in env_list]
+
+
+def sem_case(dim, n_samples):
+    """Generate one environment"""
+    sem = ChainEquationModel(dim, ones=True, hidden=True, scramble=True, hetero=True)
+    return lambda: sem(n_samples, 2.0)
+
+
+def erm_case(dim, n_samples):
+    """Fit ERM on three environments"""
+    environments = _environments(dim, n_samples)
+    args = _method_args()
+    return lambda: EmpiricalRiskMinimizer(environments, args)
+
+
+def icp_case(dim, n_samples):
+    """Fit ICP on three environments, 2^dim subsets"""
+    environments = _environments(dim, n_samples)
+    args = _method_args()
+    return lambda: InvariantCausalPrediction(environments, args)
+
+
+def irm_case(dim, n_samples, n_iterations=100):
+    """Fit IRM on three environments, all regs"""
+    environments = _environments(dim, n_samples)
+    args = _method_args(n_iterations=n_iterations, irm_epoch_size=n_iterations)
+    return lambda: InvariantRiskMinimization(environments, args)
+
+
+def bench_cases(quick=False):
+    """List the (name, metric, case constructor, kwargs) to run"""
+    if quick:
+        dims, icp_dims, irm_grid = [10, 50], [4, 8], [(10, 1000)]
+    else:
+        dims = [10, 50, 200, 1000]
+        icp_dims = [4, 6, 8, 10]
+        irm_grid = [(dim, n) for dim in [10, 50, 200] for n in [1000, 10000]]
+
+    cases = []
+    for dim in dims:
+        cases.append(
+            (f"sem[dim={dim}]", "seconds", sem_case, dict(dim=dim, n_samples=1000))
+        )
+    for dim in dims:
+        cases.append(
+            (f"erm[dim={dim}]", "seconds", erm_case, dict(dim=dim, n_samples=1000))
+        )
+    for dim in icp_dims:
+        cases.append(
+            (f"icp[dim={dim}]", "seconds", icp_case, dict(dim=dim, n_samples=1000))
+        )
+    for dim, n_samples in irm_grid:
+        cases.append(
+            (
+                f"irm[dim={dim},n_samples={n_samples}]",
+                "iterations_per_second",
+                irm_case,
+                dict(dim=dim, n_samples=n_samples),
+            )
+        )
+    return cases
+
+
+def time_case(fn, repeat=5, min_time=0.2):
+    """Wall time per call of fn, for repeat samples. Each sample loops
+    over enough calls to last about min_time, like timeit.autorange.
+    The first call is a warm-up that sets the number of calls."""
+    start = time.perf_counter()
+    fn()
+    number = max(1, math.ceil(min_time / (time.perf_counter() - start)))
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            result = fn()
+        times.append((time.perf_counter() - start) / number)
+    return times, result
+
+
+def run_benchmarks(quick=False, repeat=5, pattern=None):
+    """Run the benchmark cases whose name contains pattern"""
+    results = {}
+    for name, metric, case, kwargs in bench_cases(quick):
+        if pattern is not None and pattern not in name:
+            continue
+        torch.manual_seed(0)
+        times, result = time_case(case(**kwargs), repeat=repeat)
+        if metric == "iterations_per_second":
+            values = [result.n_iterations_run / t for t in times]
+        else:
+            values = times
+        results[name] = {
+            "metric": metric,
+            "best": max(values) if metric in _HIGHER_IS_BETTER else min(values),
+            "median": statistics.median(values),
+            "min": min(values),
+            "max": max(values),
+            "repeat": repeat,
+            "samples": values,
+        }
+        print(
+            f"{name:<36} {metric:<22} best {results[name]['best']:.6g}"
+            f"  median {results[name]['median']:.6g}"
+        )
+
+    return {
+        "meta": {
+            "time": dt.datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+            "torch_threads": torch.get_num_threads(),
+        },
+        "results": results,
+    }
+
+
+def compare(current, baseline, tolerance=0.1):
+    """Compare two benchmark results (as returned by run_benchmarks).
+    Return the (name, baseline, current, relative change) of the cases
+    that got worse by more than tolerance. The relative change is
+    positive when the case got worse. The best samples are compared,
+    they are less sensitive to the load of the machine than the medians."""
+    regressions = []
+    for name, result in current["results"].items():
+        if name not in baseline["results"]:
+            continue
+        old = baseline["results"][name]["best"]
+        new = result["best"]
+        if result["metric"] in _HIGHER_IS_BETTER:
+            change = (old - new) / old
+        else:
+            change = (new - old) / old
+        if change > tolerance:
+            regressions.append((name, old, new, change))
+    return regressions
+
+
+def save(results, path):
+    """Save benchmark results as JSON"""
+    with open(path, "w", encoding="utf-8") as _b_f:
+        json.dump(results, _b_f, indent=2)
+
+
+def load(path):
+    """Read benchmark results saved as JSON"""
+    with open(path, "r", encoding="utf-8") as _b_f:
+        return json.load(_b_f)
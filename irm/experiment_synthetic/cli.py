@@ -8,7 +8,160 @@ import multiprocessing as mp
 
 import toml
 
-from .main import run_experiment
+from . import events
+
+# The experiment modules import torch, pandas, sklearn and scipy, which
+# takes seconds: each subcommand imports what it needs, so that
+# `irm --help` or a typo in the arguments fail fast.
+
+
+def params_parser():
+    """Parser of the simulation parameters, shared by every subcommand
+    that needs their defaults."""
+    parser = argparse.ArgumentParser(
+        description="""Invariant regression. Parameters {Description (type: default_value)}""",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--dim",
+        type=int,
+        default=10,
+        help="Dimension (number of variables in X) (int: %(default)d)",
+    )
+    parser.add_argument(
+        "--n_samples", type=int, default=1000, help=" (int: %(default)s)"
+    )
+    parser.add_argument("--n_reps", type=int, default=10)
+    parser.add_argument("--skip_reps", type=int, default=0)
+    parser.add_argument(
+        "--seed", type=int, default=0, help="Negative is random (int: %(default)d)"
+    )  # Negative is random
+    parser.add_argument(
+        "--print_vectors", type=int, default=1, help="(int: %(default)d)"
+    )
+    parser.add_argument(
+        "--n_iterations", type=int, default=100000, help="(int: %(default)d)"
+    )
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--verbose", type=int, default=0, help="(int: %(default)d)")
+    parser.add_argument(
+        "--methods",
+        type=str,
+        default="ERM,ICP,IRM",
+        help="One or more algorithms (choice from default: str: %(default)s)",
+    )
+    parser.add_argument(
+        "--alpha", type=float, default=0.05, help="(float: %(default)f)"
+    )
+    parser.add_argument(
+        "--env_list", type=str, default=".2,2.,5.", help="(str: %(default)s)"
+    )
+    parser.add_argument(
+        "--setup_sem", type=str, default="chain", help="(str: %(default)s)"
+    )
+    parser.add_argument("--setup_ones", type=int, default=1, help="(int: %(default)d)")
+    parser.add_argument(
+        "--setup_hidden", type=int, default=0, help="(int: %(default)d)"
+    )
+    parser.add_argument(
+        "--setup_hetero", type=int, default=0, help="(int: %(default)d)"
+    )
+    parser.add_argument(
+        "--setup_scramble", type=int, default=0, help="(int: %(default)d)"
+    )
+    parser.add_argument(
+        "--setup_scramble_kind",
+        type=str,
+        default="dense",
+        choices=["dense", "hadamard"],
+        help="Storage of the scramble, hadamard scales to large power of two dims (str: %(default)s)",
+    )
+    parser.add_argument(
+        "--method_workers",
+        type=int,
+        default=1,
+        help="Threads fitting the methods of a repetition concurrently (int: %(default)d)",
+    )
+    parser.add_argument(
+        "--dtype",
+        type=str,
+        default="float32",
+        choices=["float32", "float64"],
+        help="Precision of the data, the methods and the errors (str: %(default)s)",
+    )
+    parser.add_argument(
+        "--n_threads", type=int, default=mp.cpu_count(), help="(int: %(default)d)"
+    )
+    parser.add_argument(
+        "--irm_epoch_size",
+        type=int,
+        default=1000,
+        help="Number of iterations between each csv train save (int: %(default)d)",
+    )
+    parser.add_argument(
+        "--irm_curve_format",
+        type=str,
+        default="csv",
+        choices=["csv", "npz"],
+        help="IRM training curves: a csv per instantiation, or one compressed npz per run (str: %(default)s)",
+    )
+    parser.add_argument(
+        "--irm_curve_tolerance",
+        type=float,
+        default=0.0,
+        help="Downsample the npz curves, dropping points within this tolerance of a line (float: %(default)s)",
+    )
+    parser.add_argument(
+        "--irm_batch_size",
+        type=int,
+        default=0,
+        help="Rows sampled per environment and IRM iteration, 0 is full batch (int: %(default)d)",
+    )
+    parser.add_argument(
+        "--irm_search",
+        type=str,
+        default="grid",
+        choices=["grid", "halving"],
+        help="Selection of the IRM reg (and lr): full training of every reg, or successive halving (str: %(default)s)",
+    )
+    parser.add_argument(
+        "--irm_lrs",
+        type=str,
+        default=None,
+        help="Comma separated learning rates searched by --irm_search halving (str: --lr)",
+    )
+    parser.add_argument(
+        "--irm_halving_eta",
+        type=int,
+        default=2,
+        help="Only the best 1/eta of the candidates survive each halving rung (int: %(default)d)",
+    )
+    parser.add_argument(
+        "--irm_cuda",
+        default=False,
+        action="store_true",
+        help="Wether IRM should be performed on the GPU (bool: %(default)d)",
+    )
+    parser.add_argument(
+        "--trace_memory",
+        default=False,
+        action="store_true",
+        help="Record the tracemalloc peak of each method, slows allocations down (bool: %(default)d)",
+    )
+    parser.add_argument(
+        "--events",
+        type=str,
+        default=None,
+        help="Write progress events as JSON lines to this file, or to unix:<socket path> (str: disabled)",
+    )
+    parser.add_argument(
+        "--env_store",
+        type=str,
+        default=None,
+        help="Directory caching the generated environments of seeded runs (str: disabled)",
+    )
+    parser.add_argument("--dump_config", default=False, action="store_true")
+    return parser
 
 
 class IRMRunner(object):
@@ -22,6 +175,15 @@ class IRMRunner(object):
 Available commands:
    from_params    Parse arguments from the command line.
    from_file      Read a toml config file.
+   sweep          Run a grid of configurations read from a toml file.
+   queue          Share the work of a grid between machines (init/work/status/merge).
+   results        Ingest run outputs in an indexed store and query them.
+   render         Render the result figures of many runs in parallel.
+   mnist          Train the colored MNIST MLPs (IRM or ERM).
+   boosting       Fit the colored MNIST boosting baseline in parallel.
+   status         Summarize the progress events of a run.
+   bench          Benchmark the hot paths, optionally against a baseline.
+   estimate       Estimate the time and memory of a config or grid file.
 """,
         )
         parser.add_argument("command", help="Subcommand to run")
@@ -37,114 +199,614 @@ Available commands:
 
     def from_params(self):
         """Using the original command line args."""
+        parser = params_parser()
+        # now that we're inside a subcommand, ignore the first
+        # TWO argv s, ie the command and the subcommand
+        args = dict(vars(parser.parse_args(sys.argv[2:])))
+
+        if args["dump_config"]:
+            _config_dest = f"irm_config_{str(dt.datetime.now()).split('.')[0].replace(' ', '_')}.toml"
+            if Path(_config_dest).resolve().exists():
+                # avoid overwritting existing config files
+                raise FileExistsError("Config file already exists, aborting")
+            with open(_config_dest, "w", encoding="utf-8") as _c_f:
+                toml.dump(args, _c_f)
+
+        print(f"Running IRM simulation from params: {args}")
+        from .main import run_experiment
+
+        run_experiment(args)
+
+    def from_file(self):
+        """Read the configuration params from a config parser."""
         parser = argparse.ArgumentParser(
-            description="""Invariant regression. Parameters {Description (type: default_value)}""",
-            formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+            description="Read a toml configuration file to parse arguments for simulations"
         )
+        # NOT prefixing the argument with -- means it's not optional
         parser.add_argument(
-            "--dim",
-            type=int,
-            default=10,
-            help="Dimension (number of variables in X) (int: %(default)d)",
+            "config_file",
+            type=lambda p: Path(p).resolve(),
+            help="""
+            A toml configuration file. See https://toml.io/en/
+
+            For the parameters' keys and values, run:
+                irm from_params --help
+""",
+        )
+        args = parser.parse_args(sys.argv[2:])
+        with open(args.config_file, "r", encoding="utf-8") as config:
+            params = toml.load(config)
+
+        print(
+            f"Running IRM simulation from config file {args.config_file} \nwith params:\n {params}"
+        )
+        from .main import run_experiment
+
+        run_experiment(params)
+
+    def sweep(self):
+        """Run every cell of a parameter grid on a shared pool of workers."""
+        parser = argparse.ArgumentParser(
+            description="Expand a toml parameter grid and run all its cells in-process"
         )
         parser.add_argument(
-            "--n_samples", type=int, default=1000, help=" (int: %(default)s)"
+            "grid_file",
+            type=lambda p: Path(p).resolve(),
+            help="""
+            A toml file with a [params] table holding the fixed parameters
+            (same keys as irm from_params) and a [grid] table mapping
+            parameter names to lists of values. The cartesian product of
+            the [grid] lists is run. An optional [sweep] table can hold
+            n_workers and output.
+""",
         )
-        parser.add_argument("--n_reps", type=int, default=10)
-        parser.add_argument("--skip_reps", type=int, default=0)
         parser.add_argument(
-            "--seed", type=int, default=0, help="Negative is random (int: %(default)d)"
-        )  # Negative is random
+            "--n_workers",
+            type=int,
+            default=None,
+            help="Number of worker processes (int: [sweep] n_workers or cpu count)",
+        )
+        parser.add_argument(
+            "--output",
+            type=str,
+            default=None,
+            help="Result store directory (str: [sweep] output or sweep_<timestamp>)",
+        )
+        args = parser.parse_args(sys.argv[2:])
+        from .sweep import load_grid, run_sweep
+
+        defaults = dict(vars(params_parser().parse_args([])))
+        grid = load_grid(args.grid_file, defaults)
+        if args.n_workers is not None:
+            grid["sweep"]["n_workers"] = args.n_workers
+        if args.output is not None:
+            grid["sweep"]["output"] = args.output
+
+        print(f"Running IRM sweep from grid file {args.grid_file}")
+        run_sweep(grid)
+
+    def queue(self):
+        """Share the work items of a grid between workers through a directory."""
+        parser = argparse.ArgumentParser(
+            description="Directory based work queue for multi-node sweeps",
+            usage="irm queue {init,work,status,merge} [<args>]",
+        )
+        actions = parser.add_subparsers(dest="action", required=True)
+
+        init = actions.add_parser("init", help="Create the queue of a grid file")
+        init.add_argument("grid_file", type=lambda p: Path(p).resolve())
+        init.add_argument("queue_dir", type=lambda p: Path(p).resolve())
+
+        worker = actions.add_parser("work", help="Run items until the queue is empty")
+        worker.add_argument("queue_dir", type=lambda p: Path(p).resolve())
+        worker.add_argument(
+            "--max_items", type=int, default=None, help="Stop after this many items"
+        )
+        worker.add_argument(
+            "--stale_after",
+            type=float,
+            default=None,
+            help="Take over claims not touched for this many seconds, their "
+            "worker is presumed dead (float: never)",
+        )
+        worker.add_argument(
+            "--heartbeat",
+            type=float,
+            default=60.0,
+            help="Seconds between touches of the lock of the running item (float: %(default)s)",
+        )
+
+        report = actions.add_parser("status", help="Report the queue progress")
+        report.add_argument("queue_dir", type=lambda p: Path(p).resolve())
+        report.add_argument("--stale_after", type=float, default=None)
+
+        merger = actions.add_parser("merge", help="Write the consolidated results")
+        merger.add_argument("queue_dir", type=lambda p: Path(p).resolve())
+
+        args = parser.parse_args(sys.argv[2:])
+        from . import workqueue
+        from .sweep import load_grid
+
+        if args.action == "init":
+            defaults = dict(vars(params_parser().parse_args([])))
+            n_items = workqueue.init_queue(
+                load_grid(args.grid_file, defaults), args.queue_dir
+            )
+            print(f"Queued {n_items} work items in {args.queue_dir}")
+        elif args.action == "work":
+            n_items = workqueue.work(
+                args.queue_dir,
+                max_items=args.max_items,
+                stale_after=args.stale_after,
+                heartbeat_every=args.heartbeat,
+            )
+            print(f"Worker ran {n_items} work items")
+        elif args.action == "status":
+            report = workqueue.status(args.queue_dir, stale_after=args.stale_after)
+            print(
+                "{done}/{total} done, {running} running, {pending} pending, "
+                "{n_failed} failed".format(n_failed=len(report["failed"]), **report)
+            )
+            for worker_id, n_running in sorted(report["workers"].items()):
+                print(f"  {worker_id}: {n_running} running")
+            for item in report["failed"]:
+                print(f"  failed: {item}")
+            for item in report["stale"]:
+                print(f"  stale claim: {item}")
+        else:
+            results_df = workqueue.merge(args.queue_dir)
+            n_rows = 0 if results_df is None else len(results_df)
+            print(f"Merged {n_rows} rows into {args.queue_dir / 'results.csv'}")
+
+    def results(self):
+        """Ingest run outputs in a SQLite store and query them."""
+        parser = argparse.ArgumentParser(
+            description="Indexed store of the outputs of many runs",
+            usage="irm results {ingest,query} [<args>]",
+        )
+        actions = parser.add_subparsers(dest="action", required=True)
+
+        ingester = actions.add_parser(
+            "ingest", help="Load new or modified run outputs found under paths"
+        )
+        ingester.add_argument("paths", nargs="+", type=Path)
+
+        querier = actions.add_parser(
+            "query", help="Write the rows matching column=value filters as CSV"
+        )
+        querier.add_argument(
+            "filters",
+            nargs="*",
+            help="column=value, e.g. Method=IRM setup_hidden=1 n_envs=6",
+        )
+        querier.add_argument(
+            "--table", choices=["results", "training"], default="results"
+        )
+        querier.add_argument(
+            "--columns", type=str, default=None, help="Comma separated columns"
+        )
+        querier.add_argument("--limit", type=int, default=None)
+        querier.add_argument(
+            "--output", type=Path, default=None, help="CSV file (default: stdout)"
+        )
+        for action in [ingester, querier]:
+            action.add_argument(
+                "--db",
+                type=Path,
+                default=Path("irm_results.sqlite"),
+                help="Store file (default: %(default)s)",
+            )
+
+        args = parser.parse_args(sys.argv[2:])
+        from . import results_store
+
+        if args.action == "ingest":
+            counts = results_store.ingest(args.db, args.paths)
+            print(
+                f"Loaded {counts['loaded']} files, skipped {counts['skipped']} "
+                f"unchanged files, into {args.db}"
+            )
+            return
+
+        filters = dict(f.split("=", maxsplit=1) for f in args.filters)
+        columns = args.columns.split(",") if args.columns else None
+        try:
+            header, rows = results_store.query(
+                args.db, args.table, filters, columns, args.limit
+            )
+        except ValueError as error:
+            parser.error(str(error))
+        import csv
+
+        _q_f = open(args.output, "w", newline="") if args.output else sys.stdout
+        writer = csv.writer(_q_f)
+        writer.writerow(header)
+        writer.writerows(rows)
+        if args.output:
+            _q_f.close()
+            print(f"Wrote {len(rows)} rows to {args.output}")
+
+    def render(self):
+        """Render the result figures of many runs in parallel."""
+        parser = argparse.ArgumentParser(
+            description="Render the figures of plot.py per group of results, skipping unchanged ones",
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        )
         parser.add_argument(
-            "--print_vectors", type=int, default=1, help="(int: %(default)d)"
+            "paths",
+            nargs="+",
+            help="Result files, directories, glob patterns or a results store (.sqlite)",
         )
         parser.add_argument(
-            "--n_iterations", type=int, default=100000, help="(int: %(default)d)"
+            "--output", type=lambda p: Path(p).resolve(), default=Path("figures")
         )
-        parser.add_argument("--lr", type=float, default=1e-3)
-        parser.add_argument("--verbose", type=int, default=0, help="(int: %(default)d)")
         parser.add_argument(
-            "--methods",
+            "--by",
             type=str,
-            default="ERM,ICP,IRM",
-            help="One or more algorithms (choice from default: str: %(default)s)",
+            default="",
+            help="Comma separated columns, one figure per group (e.g. n_envs or Source)",
         )
         parser.add_argument(
-            "--alpha", type=float, default=0.05, help="(float: %(default)f)"
+            "--categories", type=str, default="F,P", help="Setup categories to draw"
         )
+        parser.add_argument("--format", type=str, default="pdf")
         parser.add_argument(
-            "--env_list", type=str, default=".2,2.,5.", help="(str: %(default)s)"
+            "--n_workers", type=int, default=None, help="Worker processes (all CPUs)"
         )
         parser.add_argument(
-            "--setup_sem", type=str, default="chain", help="(str: %(default)s)"
+            "--force", default=False, action="store_true", help="Render every figure"
         )
+        args = parser.parse_args(sys.argv[2:])
+        from . import render
+
+        by = [column for column in args.by.split(",") if column]
+        try:
+            results_df = render.load_for_render(args.paths, by)
+        except (ValueError, FileNotFoundError) as error:
+            parser.error(str(error))
+        jobs = render.figure_jobs(
+            results_df,
+            args.output,
+            by=by,
+            categories=args.categories.split(","),
+            fmt=args.format,
+        )
+        rendered, skipped = render.render(
+            jobs, args.output, n_workers=args.n_workers, force=args.force
+        )
+        print(
+            f"Rendered {len(rendered)} figures, skipped {len(skipped)} unchanged, "
+            f"in {args.output}"
+        )
+
+    def mnist(self):
+        """Train the MLPs of the colored MNIST experiment."""
+        parser = argparse.ArgumentParser(
+            description="Colored MNIST experiment of ERM_colored_mnist.py",
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        )
+        parser.add_argument("--hidden_dim", type=int, default=256)
+        parser.add_argument("--l2_regularizer_weight", type=float, default=0.001)
+        parser.add_argument("--lr", type=float, default=0.001)
+        parser.add_argument("--n_restarts", type=int, default=10)
         parser.add_argument(
-            "--setup_ones", type=int, default=1, help="(int: %(default)d)"
+            "--penalty", type=str, default="irm", choices=["irm", "erm"]
         )
+        parser.add_argument("--penalty_anneal_iters", type=int, default=0)
+        parser.add_argument("--penalty_weight", type=float, default=10000.0)
+        parser.add_argument("--steps", type=int, default=501)
+        parser.add_argument("--grayscale_model", default=False, action="store_true")
         parser.add_argument(
-            "--setup_hidden", type=int, default=0, help="(int: %(default)d)"
+            "--batched_restarts",
+            default=False,
+            action="store_true",
+            help="Train the restarts at once as one batched model, on the same environments",
         )
         parser.add_argument(
-            "--setup_hetero", type=int, default=0, help="(int: %(default)d)"
+            "--eval_every",
+            type=int,
+            default=100,
+            help="Steps between evaluations of the test environment",
         )
         parser.add_argument(
-            "--setup_scramble", type=int, default=0, help="(int: %(default)d)"
+            "--train_flip_probs",
+            type=str,
+            default="0.2,0.1",
+            help="Color flip probability of each train environment",
         )
         parser.add_argument(
-            "--n_threads", type=int, default=mp.cpu_count(), help="(int: %(default)d)"
+            "--test_flip_probs",
+            type=str,
+            default=None,
+            help="Color flip probabilities of the test environment, in turn (0, 0.1, ..., 0.9)",
+        )
+        parser.add_argument("--seed", type=int, default=-1, help="Negative is random")
+        parser.add_argument("--n_threads", type=int, default=mp.cpu_count())
+        parser.add_argument(
+            "--mnist_root",
+            type=str,
+            default=None,
+            help="Directory of MNIST and of its decoded cache (~/datasets/mnist)",
         )
         parser.add_argument(
-            "--irm_epoch_size",
+            "--checkpoint_dir",
+            type=str,
+            default=None,
+            help="Save checkpoints there, and resume from them (needs a seed)",
+        )
+        parser.add_argument(
+            "--checkpoint_every",
             type=int,
-            default=1000,
-            help="Number of iterations between each csv train save (int: %(default)d)",
+            default=0,
+            help="Steps between checkpoints, 0 saves them at the end of each test flip probability only",
         )
         parser.add_argument(
-            "--irm_cuda",
-            default=False,
-            action="store_true",
-            help="Wether IRM should be performed on the GPU (bool: %(default)d)",
+            "--log_file", type=str, default=None, help="Append the printed log there"
+        )
+        parser.add_argument(
+            "--events",
+            type=str,
+            default=None,
+            help="Write progress events as JSON lines to this file, or to unix:<socket path>",
         )
-        parser.add_argument("--dump_config", default=False, action="store_true")
-        # now that we're inside a subcommand, ignore the first
-        # TWO argv s, ie the command and the subcommand
         args = dict(vars(parser.parse_args(sys.argv[2:])))
+        if args["checkpoint_dir"] and args["seed"] < 0:
+            parser.error("--checkpoint_dir needs a non-negative --seed")
 
-        if args["dump_config"]:
-            _config_dest = f"irm_config_{str(dt.datetime.now()).split('.')[0].replace(' ', '_')}.toml"
-            if Path(_config_dest).resolve().exists():
-                # avoid overwritting existing config files
-                raise FileExistsError("Config file already exists, aborting")
-            with open(_config_dest, "w", encoding="utf-8") as _c_f:
-                toml.dump(args, _c_f)
+        print(f"Running colored MNIST experiment with params: {args}")
+        from ..experiment_mnist.main import run_experiment
 
-        print(f"Running IRM simulation from params: {args}")
         run_experiment(args)
 
-    def from_file(self):
-        """Read the configuration params from a config parser."""
+    def boosting(self):
+        """Fit the boosting baseline of the colored MNIST experiment."""
         parser = argparse.ArgumentParser(
-            description="Read a toml configuration file to parse arguments for simulations"
+            description="Colored MNIST boosting baseline of Boosting.py",
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter,
         )
-        # NOT prefixing the argument with -- means it's not optional
         parser.add_argument(
-            "config_file",
+            "--model",
+            type=str,
+            default="adaboost",
+            choices=["adaboost", "histgb"],
+            help="AdaBoost of Boosting.py, or histogram-based gradient boosting",
+        )
+        parser.add_argument("--n_reps", type=int, default=10)
+        parser.add_argument(
+            "--train_flip_probs",
+            type=str,
+            default="0.1,0.2",
+            help="Color flip probability of each train environment",
+        )
+        parser.add_argument("--test_flip_prob", type=float, default=0.9)
+        parser.add_argument("--seed", type=int, default=-1, help="Negative is random")
+        parser.add_argument(
+            "--n_workers", type=int, default=None, help="Worker processes (all CPUs)"
+        )
+        parser.add_argument(
+            "--n_threads",
+            type=int,
+            default=None,
+            help="Threads per worker (CPUs / workers)",
+        )
+        parser.add_argument(
+            "--mnist_root",
+            type=str,
+            default=None,
+            help="Directory of MNIST and of its decoded cache (~/datasets/mnist)",
+        )
+        parser.add_argument(
+            "--events",
+            type=str,
+            default=None,
+            help="Write progress events as JSON lines to this file, or to unix:<socket path>",
+        )
+        args = dict(vars(parser.parse_args(sys.argv[2:])))
+
+        print(f"Running colored MNIST boosting baseline with params: {args}")
+        from ..experiment_mnist.boosting import run_boosting
+
+        results_df = run_boosting(args)
+        print(results_df[["Repetition", "TrainAcc", "TestAcc", "WallTime"]])
+        print(
+            f"Test accuracy: {results_df.TestAcc.mean():.5f} "
+            f"+- {results_df.TestAcc.std():.5f}"
+        )
+
+    def status(self):
+        """Summarize the event stream of a (possibly running) run."""
+        parser = argparse.ArgumentParser(
+            description="Summarize the progress events written with --events"
+        )
+        parser.add_argument(
+            "run",
             type=lambda p: Path(p).resolve(),
             help="""
-            A toml configuration file. See https://toml.io/en/
-
-            For the parameters' keys and values, run:
-                irm from_params --help
+            An events file, or a directory holding an events.jsonl file
+            (e.g. a sweep output or a queue directory). With --listen,
+            the unix socket path to listen on.
 """,
         )
+        parser.add_argument(
+            "--listen",
+            default=False,
+            action="store_true",
+            help="Print the events sent to the unix socket as they arrive",
+        )
+        parser.add_argument(
+            "--top", type=int, default=10, help="Number of stragglers to show"
+        )
         args = parser.parse_args(sys.argv[2:])
-        with open(args.config_file, "r", encoding="utf-8") as config:
-            params = toml.load(config)
 
-        print(
-            f"Running IRM simulation from config file {args.config_file} \nwith params:\n {params}"
+        if args.listen:
+            for event in events.listen(args.run):
+                print(event)
+            return
+
+        events_file = args.run / "events.jsonl" if args.run.is_dir() else args.run
+        if not events_file.exists():
+            parser.error(f"No events file at {events_file}")
+        summary = events.summarize(events.read_events(events_file))
+        now = dt.datetime.now().timestamp()
+        for (host, pid), run in summary["runs"].items():
+            state = "finished" if run["end"] is not None else "running"
+            elapsed = (run["end"] or now) - run["start"]
+            print(
+                f"run {host}:{pid} {state}, {dt.timedelta(seconds=int(elapsed))} elapsed,"
+                f" {run.get('n_reps', '?')} repetitions"
+            )
+        print(f"{summary['reps_done']} repetitions done")
+        for method, duration in sorted(summary["mean_durations"].items()):
+            print(f"  {method}: {duration:.1f}s per fit on average")
+        if summary["last_event"] is not None:
+            print(f"last event {now - summary['last_event']:.0f}s ago")
+
+        print(f"{len(summary['in_flight'])} methods running, longest first:")
+        for job in summary["in_flight"][: args.top]:
+            line = f"  {job['host']}:{job['pid']}"
+            if job["cell"] is not None:
+                line += f" cell={job['cell']}"
+            line += f" rep={job['rep']} {job['method']} {job['elapsed']:.0f}s"
+            if job["mean_duration"]:
+                line += f" ({job['elapsed'] / job['mean_duration']:.1f}x the mean)"
+            if job["progress"] is not None:
+                progress = job["progress"]
+                line += (
+                    f" reg={progress['reg']} {progress['iteration']}/{progress['n_iterations']}"
+                    f" at {progress['iterations_per_second']:.0f} it/s"
+                )
+            print(line)
+
+    def bench(self):
+        """Time the hot paths and flag regressions against a baseline."""
+        parser = argparse.ArgumentParser(
+            description="Benchmark the SEM, ERM, ICP and IRM hot paths",
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter,
         )
-        run_experiment(params)
+        parser.add_argument(
+            "--output",
+            type=lambda p: Path(p).resolve(),
+            default=f"irm_bench_{str(dt.datetime.now()).split('.')[0].replace(' ', '_')}.json",
+            help="Where to save the results (JSON)",
+        )
+        parser.add_argument(
+            "--baseline",
+            type=lambda p: Path(p).resolve(),
+            default=None,
+            help="Results of a previous irm bench to compare against",
+        )
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.1,
+            help="Relative slowdown above which a case is a regression",
+        )
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument(
+            "--quick", default=False, action="store_true", help="Only the small cases"
+        )
+        parser.add_argument(
+            "--only", type=str, default=None, help="Only cases whose name contains this"
+        )
+        args = parser.parse_args(sys.argv[2:])
+        from . import bench
+
+        results = bench.run_benchmarks(
+            quick=args.quick, repeat=args.repeat, pattern=args.only
+        )
+        bench.save(results, args.output)
+        print(f"Saved benchmark results to {args.output}")
+
+        if args.baseline is not None:
+            regressions = bench.compare(
+                results, bench.load(args.baseline), tolerance=args.tolerance
+            )
+            for name, old, new, change in regressions:
+                print(f"REGRESSION {name}: {old:.6g} -> {new:.6g} ({change:+.1%})")
+            if regressions:
+                sys.exit(1)
+            print(f"No regression above {args.tolerance:.0%} against {args.baseline}")
+
+    def estimate(self):
+        """Calibrate the methods and extrapolate the cost of a run or a sweep."""
+        parser = argparse.ArgumentParser(
+            description="Estimate the wall time and peak memory of a run",
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        )
+        parser.add_argument(
+            "config_file",
+            type=lambda p: Path(p).resolve(),
+            help="A from_file config, or a sweep grid file (with [params]/[grid] tables)",
+        )
+        parser.add_argument(
+            "--n_workers",
+            type=int,
+            default=None,
+            help="Workers of the sweep (default: [sweep] n_workers or cpu count)",
+        )
+        parser.add_argument(
+            "--irm_iterations",
+            type=int,
+            default=50,
+            help="IRM iterations per reg timed to calibrate",
+        )
+        parser.add_argument(
+            "--max_hours",
+            type=float,
+            default=None,
+            help="Exit with an error if the estimated wall time is larger",
+        )
+        parser.add_argument(
+            "--max_memory_mb",
+            type=float,
+            default=None,
+            help="Exit with an error if the estimated peak memory is larger",
+        )
+        args = parser.parse_args(sys.argv[2:])
+        with open(args.config_file, "r", encoding="utf-8") as config:
+            raw = toml.load(config)
+        defaults = dict(vars(params_parser().parse_args([])))
+        from . import estimate
+
+        if "params" in raw or "grid" in raw:
+            from .sweep import load_grid, expand_grid
+
+            grid = load_grid(args.config_file, defaults)
+            n_workers = args.n_workers or grid["sweep"]["n_workers"]
+            cells = expand_grid(grid)
+            for params in cells:
+                if params["n_threads"] is None:
+                    params["n_threads"] = max(1, mp.cpu_count() // n_workers)
+            result = estimate.estimate_sweep(
+                cells, n_workers, irm_iterations=args.irm_iterations
+            )
+            for cell_id, cell in enumerate(result["cells"]):
+                steps = ", ".join(f"{k} {v:.3g}s" for k, v in cell["seconds"].items())
+                print(
+                    f"cell={cell_id:04d}: {cell['n_reps']} x {cell['rep_seconds']:.3g}s"
+                    f" ({steps}), {cell['peak_rss_mb']:.0f} MB"
+                )
+            wall_seconds, peak_mb = result["wall_seconds"], result["peak_mb"]
+            print(
+                f"{len(cells)} cells, {dt.timedelta(seconds=int(result['total_seconds']))}"
+                f" of work on {n_workers} workers"
+            )
+        else:
+            params = {**defaults, **raw}
+            result = estimate.estimate_run(params, irm_iterations=args.irm_iterations)
+            for step, seconds in result["seconds"].items():
+                print(f"{step}: {seconds:.3g}s per repetition")
+            wall_seconds, peak_mb = result["total_seconds"], result["total_peak_mb"]
+            print(f"{result['n_reps']} repetitions")
+
+        print(f"Estimated wall time: {dt.timedelta(seconds=int(wall_seconds))}")
+        print(f"Estimated peak memory: {peak_mb:.0f} MB")
+
+        too_long = args.max_hours is not None and wall_seconds > args.max_hours * 3600
+        too_big = args.max_memory_mb is not None and peak_mb > args.max_memory_mb
+        if too_long or too_big:
+            print("The configuration does not fit the given budget")
+            sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,216 @@
+""" Compact storage of the IRM training curves
+
+With irm_curve_format = "npz", IRM keeps its training rows in memory
+(a CurveRecorder in place of the csv writer) instead of writing one
+irm_training_<time>.csv per instantiation. The curves of every
+repetition of a run are then saved in a single compressed .npz file,
+one array per column:
+
+    repetition, reg, lr, iteration, error, penalty
+
+Curves can be downsampled before saving (irm_curve_tolerance > 0): a
+point is dropped when the curve between the points kept around it is a
+line, within the tolerance, on the log of error and penalty normalized
+to [0, 1]. Flat regions shrink to a few points while bends are kept.
+
+A sweep saves the curves of each (cell, repetition) in its partition,
+and `merge_curve_files` gathers them in a single irm_curves.npz, with an
+extra cell column, when the sweep is consolidated.
+
+`load_curves` reads any number of these files back as a single tidy
+DataFrame.
+"""
+
+import os
+from pathlib import Path
+
+import numpy as np
+
+CURVE_COLUMNS = ["repetition", "reg", "lr", "iteration", "error", "penalty"]
+_DTYPES = {
+    "repetition": np.int32,
+    "reg": np.float64,
+    "lr": np.float64,
+    "iteration": np.int64,
+    "error": np.float32,
+    "penalty": np.float32,
+    "cell": np.int32,
+}
+
+
+class CurveRecorder(object):
+    """Stand-in for the csv writer of IRM keeping the rows in memory.
+    The first row written is the header."""
+
+    def __init__(self, lr):
+        self.lr = lr
+        self.header = None
+        self.rows = []
+
+    def writerow(self, row):
+        """Record a row, like csv.writer.writerow"""
+        if self.header is None:
+            self.header = [column.strip() for column in row]
+        else:
+            self.rows.append(row)
+
+    def columns(self):
+        """The recorded rows as arrays, lr filled in if it was not a column"""
+        table = np.array(self.rows, dtype=np.float64).reshape(-1, len(self.header))
+        columns = dict(zip(self.header, table.T))
+        if "lr" not in columns:
+            columns["lr"] = np.full(len(table), self.lr, dtype=np.float64)
+        return columns
+
+
+def downsample(x, ys, tolerance):
+    """Mask of the points of the curves ys (n x k) over x to keep.
+    Iterative Ramer-Douglas-Peucker with the vertical distance, all
+    curves sharing the kept points."""
+    n = len(x)
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, n - 1]] = True
+    segments = [(0, n - 1)]
+    while segments:
+        start, end = segments.pop()
+        if end - start < 2:
+            continue
+        inside = slice(start + 1, end)
+        t = ((x[inside] - x[start]) / (x[end] - x[start]))[:, None]
+        chord = ys[start] + t * (ys[end] - ys[start])
+        distance = np.abs(ys[inside] - chord).max(axis=1)
+        i_max = int(np.argmax(distance))
+        if distance[i_max] > tolerance:
+            split = start + 1 + i_max
+            keep[split] = True
+            segments += [(start, split), (split, end)]
+    return keep
+
+
+def _normalized_log(values):
+    logs = np.log(np.maximum(values, np.finfo(np.float64).tiny))
+    span = logs.max() - logs.min()
+    return (logs - logs.min()) / span if span > 0 else np.zeros_like(logs)
+
+
+def _downsample_columns(columns, tolerance):
+    """Downsample each (reg, lr) curve of the columns of a recorder"""
+    masks = np.zeros(len(columns["iteration"]), dtype=bool)
+    curve_keys = np.stack([columns["reg"], columns["lr"]], axis=1)
+    for key in np.unique(curve_keys, axis=0):
+        index = np.flatnonzero((curve_keys == key).all(axis=1))
+        if len(index) <= 2:
+            masks[index] = True
+            continue
+        ys = np.stack(
+            [_normalized_log(columns[c][index]) for c in ["error", "penalty"]], axis=1
+        )
+        masks[index[downsample(columns["iteration"][index], ys, tolerance)]] = True
+    return {name: values[masks] for name, values in columns.items()}
+
+
+def save_curves(path, recorders, tolerance=0.0):
+    """Save the curves of (repetition, CurveRecorder) pairs in one file"""
+    parts = {column: [] for column in CURVE_COLUMNS}
+    for repetition, recorder in recorders:
+        columns = recorder.columns()
+        if tolerance > 0:
+            columns = _downsample_columns(columns, tolerance)
+        columns["repetition"] = np.full(len(columns["iteration"]), repetition)
+        for column in CURVE_COLUMNS:
+            parts[column].append(columns[column])
+
+    np.savez_compressed(
+        path,
+        **{
+            column: (
+                np.concatenate(arrays).astype(_DTYPES[column])
+                if arrays
+                else np.empty(0, dtype=_DTYPES[column])
+            )
+            for column, arrays in parts.items()
+        },
+    )
+
+
+def _read_columns(path):
+    with np.load(path) as arrays:
+        return {column: arrays[column] for column in arrays.files}
+
+
+def merge_curve_files(path, parts):
+    """Merge the curve files of the cells of a sweep, parts mapping a cell
+    id to the files of its repetitions, into path with a cell column.
+    The rows already in path are kept, except those of a (cell,
+    repetition) found again in the parts. The parts are removed once
+    merged."""
+    path = Path(path)
+    tables = []
+    for cell_id, part_paths in parts.items():
+        for part_path in part_paths:
+            table = _read_columns(part_path)
+            table["cell"] = np.full(len(table["iteration"]), cell_id)
+            tables.append(table)
+
+    if path.exists():
+        merged = _read_columns(path)
+        replaced = {
+            (cell_id, int(repetition))
+            for cell_id, part_paths in parts.items()
+            for part_path in part_paths
+            for repetition in [Path(part_path).stem.split("=")[-1]]
+        }
+        keep = np.array(
+            [
+                (int(c), int(r)) not in replaced
+                for c, r in zip(merged["cell"], merged["repetition"])
+            ],
+            dtype=bool,
+        )
+        tables.insert(0, {column: values[keep] for column, values in merged.items()})
+
+    # written then renamed, the merged file is never left half written
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}")
+    with open(tmp_path, "wb") as _c_f:
+        np.savez_compressed(
+            _c_f,
+            **{
+                column: np.concatenate(
+                    [np.empty(0, dtype=_DTYPES[column])]
+                    + [t[column].astype(_DTYPES[column]) for t in tables]
+                )
+                for column in [*CURVE_COLUMNS, "cell"]
+            },
+        )
+    os.replace(tmp_path, path)
+    for part_paths in parts.values():
+        for part_path in part_paths:
+            Path(part_path).unlink()
+
+
+def curve_files(paths):
+    """Expand files and directories (searched recursively) into .npz files"""
+    files = []
+    for path in map(Path, paths):
+        files += sorted(path.rglob("irm_curves*.npz")) if path.is_dir() else [path]
+    return files
+
+
+def load_curves(paths):
+    """Read curve files as a single DataFrame, tagged with their Source
+    (and their cell for the merged curves of a sweep)"""
+    import pandas as pd
+
+    dfs = []
+    for path in curve_files(paths):
+        with np.load(path) as arrays:
+            df = pd.DataFrame(
+                {c: arrays[c] for c in [*CURVE_COLUMNS, "cell"] if c in arrays.files}
+            )
+        df["Source"] = str(path)
+        dfs.append(df)
+    if not dfs:
+        raise FileNotFoundError(f"No curve files in {paths}")
+    df = pd.concat(dfs, axis="rows", ignore_index=True)
+    df["Source"] = df.Source.astype("category")
+    return df
@@ -0,0 +1,148 @@
+""" On-disk store of generated environments
+
+Generating the environments of a repetition only depends on the SEM
+parameters, n_samples, env_list, the seed and the repetition. The store
+saves them once as .npy files that later runs read back memory-mapped:
+
+    <store>/<key>/params.toml       the parameters the data depends on
+    <store>/<key>/x_<e>.npy         inputs of environment e
+    <store>/<key>/y_<e>.npy         targets of environment e
+    <store>/<key>/solution.npy      the SEM solution
+    <store>/<key>/scramble.npy      the SEM scramble, or scramble.npz
+                                    holding the state of a structured one
+    <store>/<key>/rng_state.npy     torch RNG state after the generation
+
+The RNG state is restored on load, so that the methods draw the same
+random numbers (e.g. the IRM initialization) whether the data was
+generated or read back. Only seeded runs (seed >= 0) are stored.
+
+Arrays are loaded with mmap_mode="c" and wrapped with torch.from_numpy:
+nothing is read until a method touches the data, and writes (there are
+none in the methods) would stay private to the process.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy
+import toml
+import torch
+
+from .sem import STRUCTURED_SCRAMBLES
+
+# parameters the generated environments depend on, besides the seed
+_DATA_KEYS = [
+    "setup_sem",
+    "dim",
+    "setup_ones",
+    "setup_hidden",
+    "setup_scramble",
+    "setup_hetero",
+    "n_samples",
+    "env_list",
+]
+
+
+class StoredSEM(object):
+    """Stand-in for a SEM whose environments were read from the store"""
+
+    def __init__(self, solution, scramble):
+        self._solution = solution
+        self._scramble = scramble
+
+    def solution(self):
+        """Return the actual solution"""
+        return self._solution, self._scramble
+
+
+def data_params(args, rep_i):
+    """Parameters the environments of repetition rep_i depend on"""
+    params = {key: args[key] for key in _DATA_KEYS}
+    params["setup_scramble_kind"] = args.get("setup_scramble_kind", "dense")
+    params["dtype"] = args.get("dtype", "float32")
+    params["seed"] = args["seed"]
+    params["repetition"] = rep_i
+    return params
+
+
+def store_key(args, rep_i):
+    """Directory name of the environments of repetition rep_i"""
+    encoded = json.dumps(data_params(args, rep_i), sort_keys=True)
+    return hashlib.sha1(encoded.encode("utf-8")).hexdigest()[:16]
+
+
+def _load_tensor(path):
+    return torch.from_numpy(numpy.load(path, mmap_mode="c"))
+
+
+def _load_scramble(entry):
+    if (entry / "scramble.npy").exists():
+        return _load_tensor(entry / "scramble.npy")
+    with numpy.load(entry / "scramble.npz") as state:
+        kind = str(state["kind"])
+        tensors = {k: torch.from_numpy(state[k]) for k in state.files if k != "kind"}
+    dim = next(iter(tensors.values())).shape[1]
+    return STRUCTURED_SCRAMBLES[kind](dim, **tensors)
+
+
+def _save_scramble(entry, scramble):
+    if isinstance(scramble, torch.Tensor):
+        numpy.save(entry / "scramble.npy", scramble.numpy())
+    else:
+        state = {k: v.numpy() for k, v in scramble.state().items()}
+        numpy.savez(entry / "scramble.npz", kind=scramble.kind, **state)
+
+
+def load(store_dir, args, rep_i):
+    """Return the (sem, environments) of repetition rep_i, or None if
+    they are not in the store"""
+    entry = Path(store_dir) / store_key(args, rep_i)
+    if not (entry / "params.toml").exists():
+        return None
+
+    n_envs = len(args["env_list"].split(","))
+    environments = [
+        (_load_tensor(entry / f"x_{e}.npy"), _load_tensor(entry / f"y_{e}.npy"))
+        for e in range(n_envs)
+    ]
+    sem = StoredSEM(_load_tensor(entry / "solution.npy"), _load_scramble(entry))
+    torch.set_rng_state(torch.from_numpy(numpy.load(entry / "rng_state.npy")))
+    return sem, environments
+
+
+def save(store_dir, args, rep_i, sem, environments):
+    """Write the environments of repetition rep_i to the store.
+    Must be called right after generating them (see rng_state.npy).
+
+    The entry is written in a temporary directory and renamed, so that
+    concurrent writers (e.g. sweep workers) never expose a partial entry."""
+    store_dir = Path(store_dir)
+    store_dir.mkdir(parents=True, exist_ok=True)
+    entry = store_dir / store_key(args, rep_i)
+    if entry.exists():
+        return entry
+
+    tmp_entry = Path(tempfile.mkdtemp(dir=store_dir, prefix=".tmp_"))
+    try:
+        for e, (x, y) in enumerate(environments):
+            numpy.save(tmp_entry / f"x_{e}.npy", x.numpy())
+            numpy.save(tmp_entry / f"y_{e}.npy", y.numpy())
+        solution, scramble = sem.solution()
+        numpy.save(tmp_entry / "solution.npy", solution.numpy())
+        _save_scramble(tmp_entry, scramble)
+        numpy.save(tmp_entry / "rng_state.npy", torch.get_rng_state().numpy())
+        # written last: its presence marks a complete entry
+        with open(tmp_entry / "params.toml", "w", encoding="utf-8") as _p_f:
+            toml.dump(data_params(args, rep_i), _p_f)
+        os.rename(tmp_entry, entry)
+    except OSError:
+        # another process stored the same entry first
+        if not (entry / "params.toml").exists():
+            raise
+    finally:
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+    return entry
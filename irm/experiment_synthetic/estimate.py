@@ -0,0 +1,178 @@
+""" Estimate the wall time and memory of a configuration before running it
+
+Each method is calibrated on the current machine, on data of the size
+of the configuration, and the timings are extrapolated:
+
+    data    generating the environments of one repetition, timed as is
+    ERM     timed as is
+    ICP     timed as is up to _ICP_MAX_CALIBRATION_DIM, above that the
+            time per subset is measured at two smaller dims, extrapolated
+            to dim with a power law and multiplied by the 2^dim subsets
+    IRM     the search is timed with a few iterations and scaled to
+            n_iterations
+
+Peak memory is the RSS high-water mark reached during the calibration
+of the configuration (since the start of the process where the mark
+cannot be reset, outside Linux), plus the environments of the other
+repetitions that run_experiment keeps in memory.
+"""
+
+import math
+import os
+
+import torch
+
+from .sem import ChainEquationModel
+from .models import InvariantCausalPrediction
+from .main import select_methods
+from .profiling import Measurement, peak_rss_mb, reset_peak_rss
+
+# ICP is run as is on the current machine up to this dim
+_ICP_MAX_CALIBRATION_DIM = 8
+_ICP_CALIBRATION_DIMS = (6, 8)
+
+
+def _make_environments(params, dim):
+    sem = ChainEquationModel(
+        dim,
+        ones=params["setup_ones"],
+        hidden=params["setup_hidden"],
+        scramble=params["setup_scramble"],
+        hetero=params["setup_hetero"],
+        scramble_kind=params.get("setup_scramble_kind", "dense"),
+        dtype=getattr(torch, params.get("dtype", "float32")),
+    )
+    env_list = [float(e) for e in params["env_list"].split(",")]
+    return [sem(params["n_samples"], e) for e in env_list]
+
+
+def _calibration_args(params, irm_iterations):
+    return {
+        **params,
+        "n_iterations": irm_iterations,
+        "irm_epoch_size": irm_iterations,
+        "irm_training_file": os.devnull,
+        "verbose": 0,
+        "events": None,
+    }
+
+
+def _icp_seconds(params, environments, args):
+    """Time ICP, extrapolating from smaller dims if dim is large"""
+    if params["dim"] <= _ICP_MAX_CALIBRATION_DIM:
+        with Measurement() as cost:
+            InvariantCausalPrediction(environments, args)
+        return cost.wall_time
+
+    per_subset = []
+    for dim in _ICP_CALIBRATION_DIMS:
+        small_environments = _make_environments(params, dim)
+        with Measurement() as cost:
+            InvariantCausalPrediction(small_environments, args)
+        per_subset.append(cost.wall_time / (2**dim - 1))
+
+    (dim_1, dim_2), (time_1, time_2) = _ICP_CALIBRATION_DIMS, per_subset
+    exponent = max(0.0, math.log(time_2 / time_1) / math.log(dim_2 / dim_1))
+    return time_2 * (params["dim"] / dim_2) ** exponent * (2 ** params["dim"] - 1)
+
+
+def calibrate(params, irm_iterations=50):
+    """Estimate the cost of a single repetition of a configuration.
+    Return the seconds spent in each step (data and each method) and the
+    memory of the repetition in MB."""
+    if params["seed"] >= 0:
+        torch.manual_seed(params["seed"])
+    torch.set_num_threads(params["n_threads"])
+    args = _calibration_args(params, irm_iterations)
+    # the peak of this configuration, not of those calibrated before it
+    reset_peak_rss()
+
+    seconds = {}
+    with Measurement() as cost:
+        environments = _make_environments(params, params["dim"])
+    seconds["data"] = cost.wall_time
+    environments_mb = (
+        sum(
+            x.element_size() * x.nelement() + y.element_size() * y.nelement()
+            for x, y in environments
+        )
+        / 1024**2
+    )
+
+    for method_name, method_constructor in select_methods(params).items():
+        if method_name == "ICP":
+            seconds["ICP"] = _icp_seconds(params, environments, args)
+        elif method_name == "IRM":
+            # untimed warm-up, the first autograd calls are much slower
+            method_constructor(
+                environments, {**args, "n_iterations": 1, "irm_epoch_size": 1}
+            )
+            with Measurement() as cost:
+                method_constructor(environments, args)
+            # the iterations of the grid and of the halving search both
+            # scale linearly with n_iterations
+            seconds["IRM"] = cost.wall_time * params["n_iterations"] / irm_iterations
+        else:
+            with Measurement() as cost:
+                method_constructor(environments, args)
+            seconds[method_name] = cost.wall_time
+
+    return {
+        "seconds": seconds,
+        "rep_seconds": sum(seconds.values()),
+        "peak_rss_mb": peak_rss_mb(),
+        "environments_mb": environments_mb,
+    }
+
+
+def _calibration_key(params):
+    """Parameters the cost of a repetition depends on"""
+    keys = ["dim", "n_samples", "env_list", "methods", "n_threads", "n_iterations"]
+    keys += ["setup_ones", "setup_hidden", "setup_scramble", "setup_hetero"]
+    optional_keys = ["setup_scramble_kind", "dtype"]
+    optional_keys += ["irm_search", "irm_lrs", "irm_halving_eta"]
+    optional_keys += ["irm_batch_size"]
+    return tuple(params[k] for k in keys) + tuple(params.get(k) for k in optional_keys)
+
+
+def estimate_run(params, irm_iterations=50, calibration=None):
+    """Estimate a whole `irm from_file` run: all repetitions in sequence,
+    with the environments of every repetition kept in memory."""
+    calibration = calibration or calibrate(params, irm_iterations)
+    return {
+        **calibration,
+        "n_reps": params["n_reps"],
+        "total_seconds": calibration["rep_seconds"] * params["n_reps"],
+        "total_peak_mb": calibration["peak_rss_mb"]
+        + (params["n_reps"] - 1) * calibration["environments_mb"],
+    }
+
+
+def estimate_sweep(cells, n_workers, irm_iterations=50):
+    """Estimate an `irm sweep` of the cells on n_workers processes.
+    Repetitions of identical cost are calibrated once."""
+    calibrations = {}
+    cell_estimates = []
+    for params in cells:
+        key = _calibration_key(params)
+        if key not in calibrations:
+            calibrations[key] = calibrate(params, irm_iterations)
+        cell_estimates.append(
+            {
+                **calibrations[key],
+                "n_reps": params["n_reps"],
+                "total_seconds": calibrations[key]["rep_seconds"] * params["n_reps"],
+            }
+        )
+
+    total_seconds = sum(c["total_seconds"] for c in cell_estimates)
+    longest_rep = max(c["rep_seconds"] for c in cell_estimates)
+    return {
+        "cells": cell_estimates,
+        "total_seconds": total_seconds,
+        # longest job first scheduling is within 4/3 of the optimum, the
+        # lower bound is good enough for sizing
+        "wall_seconds": max(total_seconds / n_workers, longest_rep),
+        # each worker holds a single repetition
+        "peak_mb": n_workers * max(c["peak_rss_mb"] for c in cell_estimates),
+    }
@@ -0,0 +1,210 @@
+""" Structured progress events, as JSON lines
+
+Like the logging module, the stream is process wide: `open_stream` is
+called once by the entry point and any code can then `emit` events.
+Each event is one JSON object per line holding at least:
+
+    time    seconds since the epoch
+    event   run_start, run_end, rep_start, rep_end, method_start,
+            method_end, irm_progress or irm_reg_end
+    host, pid
+
+plus the fields set with `set_context` (e.g. cell and rep) and the
+fields given to `emit`.
+
+The destination is either a file, opened in append mode so that several
+processes can share it, or a unix datagram socket given as
+"unix:/path/to.sock" (see `listen`). Events sent to a socket nobody
+listens on are dropped.
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+from pathlib import Path
+
+_stream = None
+_context = {}
+
+
+class EventStream(object):
+    """Write events to a JSON lines file or a unix datagram socket"""
+
+    def __init__(self, dest):
+        self.dest = str(dest)
+        self._identity = {"host": socket.gethostname(), "pid": os.getpid()}
+        # methods of a repetition may emit from several threads
+        self._lock = threading.Lock()
+        if self.dest.startswith("unix:"):
+            self._socket_path = self.dest[len("unix:") :]
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._file = None
+        else:
+            self._socket = None
+            # line buffered: each event reaches the file as a single write
+            self._file = open(self.dest, "a", buffering=1, encoding="utf-8")
+
+    def emit(self, event, **fields):
+        """Write a single event"""
+        line = json.dumps(
+            {
+                "time": time.time(),
+                "event": event,
+                **self._identity,
+                **_context,
+                **fields,
+            },
+            default=str,
+        )
+        if self._file is not None:
+            with self._lock:
+                self._file.write(line + "\n")
+        else:
+            try:
+                self._socket.sendto(line.encode("utf-8"), self._socket_path)
+            except (FileNotFoundError, ConnectionRefusedError):
+                pass
+
+    def close(self):
+        """Close the underlying file or socket"""
+        if self._file is not None:
+            self._file.close()
+        else:
+            self._socket.close()
+
+
+def open_stream(dest):
+    """Send the events of this process to dest (None disables them)"""
+    global _stream
+    close_stream()
+    if dest:
+        _stream = EventStream(dest)
+    return _stream
+
+
+def close_stream():
+    """Stop sending events"""
+    global _stream
+    if _stream is not None:
+        _stream.close()
+        _stream = None
+
+
+def enabled():
+    """Whether events are being recorded, to skip computing their fields"""
+    return _stream is not None
+
+
+def set_context(**fields):
+    """Fields added to every following event, None removes a field"""
+    for key, value in fields.items():
+        if value is None:
+            _context.pop(key, None)
+        else:
+            _context[key] = value
+
+
+def emit(event, **fields):
+    """Record an event if a stream is open"""
+    if _stream is not None:
+        _stream.emit(event, **fields)
+
+
+def read_events(path):
+    """Parse a JSON lines event file, skipping a truncated last line"""
+    events_ls = []
+    with open(path, "r", encoding="utf-8") as _e_f:
+        for line in _e_f:
+            try:
+                events_ls.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return events_ls
+
+
+def _method_key(event):
+    return (
+        event["host"],
+        event["pid"],
+        event.get("cell"),
+        event.get("rep"),
+        event["method"],
+    )
+
+
+def summarize(events_ls, now=None):
+    """Summarize the state of the runs that wrote the events"""
+    now = time.time() if now is None else now
+    runs = {}
+    running = {}
+    durations = {}
+    last_progress = {}
+    reps_done = 0
+    for event in events_ls:
+        process = (event["host"], event["pid"])
+        if event["event"] == "run_start":
+            runs[process] = {
+                "start": event["time"],
+                "end": None,
+                **event.get("info", {}),
+            }
+        elif event["event"] == "run_end" and process in runs:
+            runs[process]["end"] = event["time"]
+        elif event["event"] == "rep_end":
+            reps_done += 1
+        elif event["event"] == "method_start":
+            running[_method_key(event)] = event["time"]
+        elif event["event"] == "method_end":
+            started = running.pop(_method_key(event), event["time"])
+            durations.setdefault(event["method"], []).append(event["time"] - started)
+        elif event["event"] == "irm_progress":
+            last_progress[_method_key({**event, "method": "IRM"})] = event
+
+    in_flight = []
+    for key, started in running.items():
+        mean_duration = (
+            sum(durations[key[-1]]) / len(durations[key[-1]])
+            if key[-1] in durations
+            else None
+        )
+        in_flight.append(
+            {
+                "host": key[0],
+                "pid": key[1],
+                "cell": key[2],
+                "rep": key[3],
+                "method": key[4],
+                "elapsed": now - started,
+                "mean_duration": mean_duration,
+                "progress": last_progress.get(key),
+            }
+        )
+    # stragglers first
+    in_flight.sort(key=lambda x: x["elapsed"], reverse=True)
+
+    return {
+        "runs": runs,
+        "reps_done": reps_done,
+        "in_flight": in_flight,
+        "mean_durations": {
+            method: sum(times) / len(times) for method, times in durations.items()
+        },
+        "last_event": max((e["time"] for e in events_ls), default=None),
+    }
+
+
+def listen(socket_path):
+    """Yield the events sent to a unix datagram socket"""
+    socket_path = Path(socket_path)
+    if socket_path.exists():
+        socket_path.unlink()
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    server.bind(str(socket_path))
+    try:
+        while True:
+            yield json.loads(server.recv(65536).decode("utf-8"))
+    finally:
+        server.close()
+        socket_path.unlink()
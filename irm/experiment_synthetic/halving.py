@@ -0,0 +1,42 @@
+""" Schedule of the successive-halving search of the IRM hyperparameters
+
+The rungs of a search over n_candidates (reg, lr) pairs end at
+n_iterations * eta^-k, ..., n_iterations / eta, n_iterations: the
+candidates of a rung are trained up to its end, then only the best
+1/eta of them are kept for the next one.
+
+This module has no dependency, so that the cost of a configuration can
+be computed (e.g. by sweep.relative_cost) without importing torch.
+"""
+
+import math
+
+
+def halving_rungs(n_candidates, eta):
+    """Number of halving rungs needed to keep a single candidate"""
+    n_rungs = 0
+    while n_candidates > 1:
+        n_candidates = math.ceil(n_candidates / eta)
+        n_rungs += 1
+    return n_rungs
+
+
+def halving_schedule(n_candidates, eta, n_iterations):
+    """Number of candidates trained in each rung and the iteration each
+    rung ends at"""
+    n_rungs = halving_rungs(n_candidates, eta)
+    schedule = []
+    for rung in range(n_rungs + 1):
+        stop = max(1, round(n_iterations * eta ** (rung - n_rungs)))
+        schedule.append((n_candidates, stop))
+        n_candidates = math.ceil(n_candidates / eta)
+    return schedule
+
+
+def halving_iterations(n_candidates, eta, n_iterations):
+    """Total number of training iterations of a search"""
+    total, done = 0, 0
+    for n_trained, stop in halving_schedule(n_candidates, eta, n_iterations):
+        total += n_trained * (stop - done)
+        done = stop
+    return total
@@ -6,6 +6,7 @@
 #
 
 import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
 
 import torch
 import numpy
@@ -15,6 +16,9 @@ from tqdm import tqdm
 
 from .sem import ChainEquationModel
 from .models import *
+from .profiling import COST_COLUMNS, Measurement
+from . import events, envstore
+from .curves import save_curves
 
 _SETUP_STR_SEPARATOR = "|"
 
@@ -48,15 +52,8 @@ def errors(w, w_hat):
     return error_causal, error_noncausal
 
 
-def run_experiment(args):
-    """run the experiment"""
-    # Set up the random number generator and threads
-    if args["seed"] >= 0:
-        torch.manual_seed(args["seed"])
-        numpy.random.seed(args["seed"])
-        torch.set_num_threads(args["n_threads"])
-
-    # Create a setup string (TODO: modify this)
+def setup_string(args):
+    """Create a setup string describing the SEM (TODO: modify this)"""
     if args["setup_sem"] == "chain":
         _setup_ls = ["chain_ones={}", "hidden={}", "hetero={}", "scramble={}"]
         setup_str = _SETUP_STR_SEPARATOR.join(_setup_ls).format(
@@ -71,6 +68,11 @@ def run_experiment(args):
     else:
         raise NotImplementedError
 
+    return setup_str
+
+
+def select_methods(args):
+    """Map the requested method names to their constructors"""
     all_methods = {
         "ERM": EmpiricalRiskMinimizer,
         "ICP": InvariantCausalPrediction,
@@ -78,96 +80,247 @@ def run_experiment(args):
     }
 
     if args["methods"] == "all":
-        methods = all_methods
+        return all_methods
+
+    return {m: all_methods[m] for m in args["methods"].split(",")}
+
+
+def results_columns(args):
+    """Columns of the results table.
+    For an explanation of the names given to columns, see the article
+    section 5.1 Synthetic Data"""
+    return [
+        *"Coefficients,GraphObservation,Dispersion,Scramble,Method,ErrCausal,ErrNonCausal".split(
+            ","
+        ),
+        *COST_COLUMNS,
+        *[f"X{ii+1}" for ii in range(args["dim"])],
+    ]
+
+
+def repetition_seed(seed, rep_i):
+    """Seed of repetition rep_i of a run seeded with seed, spawned from
+    numpy's SeedSequence: unlike seed + rep_i, runs with nearby seeds do
+    not share repetitions"""
+    child = numpy.random.SeedSequence(seed, spawn_key=(rep_i,))
+    return int(child.generate_state(1)[0])
+
+
+def make_repetition(args, rep_i):
+    """Create the SEM and the environments of repetition rep_i.
+
+    When a non-negative seed is given, every repetition is seeded with
+    repetition_seed(seed, rep_i) so that repetitions can be generated
+    independently (e.g. by different processes) and still be
+    reproducible. Seeded environments are read from, or saved to,
+    args["env_store"] if given (see envstore.py)."""
+    if args["seed"] >= 0:
+        seed = repetition_seed(args["seed"], rep_i)
+        torch.manual_seed(seed)
+        numpy.random.seed(seed)
+
+    store_dir = args.get("env_store") if args["seed"] >= 0 else None
+    if store_dir:
+        stored = envstore.load(store_dir, args, rep_i)
+        if stored is not None:
+            return stored
+
+    if args["setup_sem"] == "chain":
+        sem = ChainEquationModel(
+            args["dim"],
+            ones=args["setup_ones"],
+            hidden=args["setup_hidden"],
+            scramble=args["setup_scramble"],
+            hetero=args["setup_hetero"],
+            scramble_kind=args.get("setup_scramble_kind", "dense"),
+            dtype=getattr(torch, args.get("dtype", "float32")),
+        )
+
+        env_list = [float(e) for e in args["env_list"].split(",")]
+        environments = [sem(args["n_samples"], e) for e in env_list]
     else:
-        methods = {m: all_methods[m] for m in args["methods"].split(",")}
+        raise NotImplementedError
 
-    all_sems = []
-    all_solutions = []
-    all_environments = []
+    if store_dir:
+        envstore.save(store_dir, args, rep_i, sem, environments)
+    return sem, environments
 
-    for rep_i in tqdm(range(args["n_reps"])):
-        if args["setup_sem"] == "chain":
-            sem = ChainEquationModel(
-                args["dim"],
-                ones=args["setup_ones"],
-                hidden=args["setup_hidden"],
-                scramble=args["setup_scramble"],
-                hetero=args["setup_hetero"],
+
+def _fit_method(
+    method_name, method_constructor, environments, sem, args, concurrent, curves=None
+):
+    """Fit a single method and return its row of the results table.
+    The training curves recorded by the method, if any, are appended to curves."""
+    sem_solution, sem_scramble = sem.solution()
+    events.emit("method_start", method=method_name)
+    # training occurs at instantiation time.
+    with Measurement(
+        trace_memory=args.get("trace_memory", False), per_thread=concurrent
+    ) as cost:
+        method = method_constructor(environments, args)
+    cost_values = cost.values(getattr(method, "n_iterations_run", None))
+    # the method (Optimisation technique) has been applied so the solution is available
+    solution = method.solution()
+    method_solution = sem_scramble @ solution
+    if curves is not None and getattr(method, "curves", None) is not None:
+        curves.append(method.curves)
+    if args["irm_cuda"] and method_name == "IRM":
+        del method
+        torch.cuda.empty_cache()
+    err_causal, err_noncausal = errors(sem_solution, method_solution)
+    events.emit(
+        "method_end",
+        method=method_name,
+        err_causal=err_causal,
+        err_noncausal=err_noncausal,
+        **dict(zip(COST_COLUMNS, cost_values)),
+    )
+
+    # TODO : save parameter estimations
+    return (
+        method_name,
+        err_causal,
+        err_noncausal,
+        *cost_values,
+        *method_solution.view(-1).tolist(),
+    )
+
+
+def run_repetition(
+    sem, environments, methods, args, setup_str=None, progress=True, curves=None
+):
+    """Fit every method on the environments of a single repetition.
+    Yield the rows of the results table: the SEM solution followed
+    by the solution found by each method. With irm_curve_format="npz",
+    the CurveRecorder of IRM is appended to curves (see curves.py).
+
+    With args["method_workers"] > 1 the methods run concurrently on a
+    thread pool sharing the environments (they only read them), and
+    their rows are still yielded in the order of methods. The threads
+    only overlap where the methods are in torch or LAPACK calls that
+    release the GIL, and compete with torch's own threads: compare the
+    wall-clock time of a run with method_workers=1 before relying on it. Their CPU time
+    is then the time of the fitting thread only, their PeakRSS is not
+    measured (NaN), and trace_memory is not supported since tracemalloc
+    is process wide."""
+    setup_str = setup_str or setup_string(args)
+    setup_values = [
+        x.split("=", maxsplit=1)[-1] for x in setup_str.split(_SETUP_STR_SEPARATOR)
+    ]
+    method_workers = min(args.get("method_workers", 1), len(methods))
+    concurrent = method_workers > 1
+    if concurrent and args.get("trace_memory", False):
+        raise ValueError("trace_memory needs method_workers=1")
+
+    sem_solution, _ = sem.solution()
+    # Save the solution before saving the methods
+    yield (
+        *setup_values,
+        "SEM",
+        0.0,
+        0.0,
+        *[float("nan")] * len(COST_COLUMNS),
+        *sem_solution.view(-1).tolist(),
+    )
+
+    if not concurrent:
+        for method_name, method_constructor in tqdm(
+            methods.items(), desc="Methods Loop", unit="method", disable=not progress
+        ):
+            row = _fit_method(
+                method_name, method_constructor, environments, sem, args, False, curves
             )
+            yield (*setup_values, *row)
+        return
+
+    # the events context (e.g. the repetition) is process wide, so the
+    # events of the worker threads keep it
+    with ThreadPoolExecutor(max_workers=method_workers) as pool:
+        futures = [
+            pool.submit(
+                _fit_method,
+                method_name,
+                method_constructor,
+                environments,
+                sem,
+                args,
+                True,
+                curves,
+            )
+            for method_name, method_constructor in methods.items()
+        ]
+        # in the order of methods, whichever finishes first
+        for future in tqdm(
+            futures,
+            desc="Methods Loop",
+            unit="method",
+            disable=not progress,
+        ):
+            yield (*setup_values, *future.result())
 
-            env_list = [float(e) for e in args["env_list"].split(",")]
-            environments = [sem(args["n_samples"], e) for e in env_list]
-        else:
-            raise NotImplementedError
 
+def run_experiment(args):
+    """run the experiment"""
+    # Set up the threads, the random number generator is seeded per repetition
+    if args["seed"] >= 0:
+        torch.set_num_threads(args["n_threads"])
+
+    setup_str = setup_string(args)
+    methods = select_methods(args)
+    events.open_stream(args.get("events"))
+    events.emit(
+        "run_start",
+        info={"n_reps": args["n_reps"], "methods": list(methods), "setup": setup_str},
+    )
+
+    all_sems = []
+    all_environments = []
+    # (repetition, CurveRecorder) of IRM when irm_curve_format="npz"
+    all_curves = []
+
+    for rep_i in tqdm(range(args["n_reps"])):
+        sem, environments = make_repetition(args, rep_i)
         all_sems.append(sem)
         all_environments.append(environments)
 
     # TODO : save parameter estimations
-    # For an explanation of the names given to columns, see the article
-    # section 5.1 Synthetic Data
     results_df = pd.DataFrame(
-        columns=[
-            *"Coefficients,GraphObservation,Dispersion,Scramble,Method,ErrCausal,ErrNonCausal".split(
-                ","
-            ),
-            *[f"X{ii+1}" for ii in range(args["dim"])],
-        ],
+        columns=results_columns(args),
         index=list(range(len(all_sems) * len(methods) + len(all_sems))),
     )
     i = 0
 
     try:
-        for sem, environments in tqdm(
-            zip(all_sems, all_environments),
+        for rep_i, (sem, environments) in tqdm(
+            enumerate(zip(all_sems, all_environments)),
             desc="Repetitions",
             unit="environment",
         ):
-            sem_solution, sem_scramble = sem.solution()
-            # Save the solution before saving the methods
-            results_df.loc[i, :] = (
-                *map(
-                    lambda x: x.split("=", maxsplit=1)[-1],
-                    setup_str.split(_SETUP_STR_SEPARATOR),
-                ),
-                "SEM",
-                0.0,
-                0.0,
-                *sem_solution.view(-1).tolist(),
-            )
-            i += 1
-            for method_name, method_constructor in tqdm(
-                methods.items(), desc="Methods Loop", unit="method"
+            events.set_context(rep=rep_i)
+            events.emit("rep_start")
+            rep_curves = []
+            for row in run_repetition(
+                sem, environments, methods, args, setup_str, curves=rep_curves
             ):
-                # training occurs at instantiation time.
-                method = method_constructor(environments, args)
-                # the method (Optimisation technique) has been applied so the solution is available
-                solution = method.solution()
-                method_solution = sem_scramble @ solution
-                if args["irm_cuda"] and method_name == "IRM":
-                    del method
-                    torch.cuda.empty_cache()
-                err_causal, err_noncausal = errors(sem_solution, method_solution)
-
-                # TODO : save parameter estimations
-                results_df.loc[i, :] = (
-                    *map(
-                        lambda x: x.split("=", maxsplit=1)[-1],
-                        setup_str.split(_SETUP_STR_SEPARATOR),
-                    ),
-                    method_name,
-                    err_causal,
-                    err_noncausal,
-                    *method_solution.view(-1).tolist(),
-                )
+                results_df.loc[i, :] = row
                 i += 1
+            all_curves += [(rep_i, recorder) for recorder in rep_curves]
+            events.emit("rep_end")
 
     except Exception as _e:
         raise _e
     finally:
         _results_dest = f"irm_results_{str(dt.datetime.now()).split('.', maxsplit=1)[0].replace(' ', '_')}.csv"
         results_df.to_csv(_results_dest, index=False)
+        if all_curves:
+            save_curves(
+                _results_dest.replace("irm_results_", "irm_curves_")[: -len(".csv")],
+                all_curves,
+                tolerance=args.get("irm_curve_tolerance", 0.0),
+            )
+        events.set_context(rep=None)
+        events.emit("run_end", results=_results_dest)
+        events.close_stream()
 
     return results_df
 
@@ -8,21 +8,21 @@
 import numpy as np
 import torch
 import math
+import contextlib
 import csv
 import datetime as dt
+import time
 
 from sklearn.linear_model import LinearRegression
 from itertools import chain, combinations
 from scipy.stats import f as fdist
 from scipy.stats import ttest_ind
 
-import torch
 from torch.autograd import grad
 
-import scipy.optimize
-
-import matplotlib
-import matplotlib.pyplot as plt
+from . import events
+from .curves import CurveRecorder
+from .halving import halving_schedule
 
 
 def pretty(vector):
@@ -31,12 +31,45 @@ def pretty(vector):
     return "[" + ", ".join("{:+.4f}".format(vi) for vi in vlist) + "]"
 
 
+def _torch_dtype(x):
+    """dtype of an environment held as a tensor or as a numpy array"""
+    if isinstance(x, torch.Tensor):
+        return x.dtype
+    return torch.from_numpy(np.empty(0, dtype=x.dtype)).dtype
+
+
+def _as_tensor(array, like):
+    """Copy an array (e.g. rows read from a np.memmap) to a tensor with
+    the dtype and device of like"""
+    return torch.tensor(np.asarray(array), dtype=like.dtype, device=like.device)
+
+
+def sample_batch(x, y, batch_size, like):
+    """Draw batch_size rows, with replacement, of an environment held as
+    tensors or as arrays supporting fancy indexing (e.g. np.memmap).
+    The rows of arrays are read in increasing order, which keeps the reads
+    of memory-mapped files sequential, and returned in the sampled order."""
+    idx = torch.randint(len(x), (batch_size,))
+    if isinstance(x, torch.Tensor):
+        idx = idx.to(x.device)
+        return x[idx], y[idx]
+
+    idx = idx.numpy()
+    order = np.argsort(idx)
+    inverse = np.argsort(order)
+    sorted_idx = idx[order]
+    return _as_tensor(x[sorted_idx][inverse], like), _as_tensor(
+        y[sorted_idx][inverse], like
+    )
+
+
 class InvariantRiskMinimization(object):
     """Object to perform IRM"""
 
     def __init__(self, environments, args):
         best_reg = 0
         best_err = 1e6
+        self.n_iterations_run = 0
 
         # print(f"CUDA reserved memory (MB) before instantiation : {torch.cuda.memory_reserved() / 1024**2}")
         # print(f"CUDA allocated memory (MB) before instantiation : {torch.cuda.memory_allocated() / 1024**2}")
@@ -48,31 +81,49 @@ class InvariantRiskMinimization(object):
                     print("IRM using cuda")
                 else:
                     print("IRM on the CPU")
-            # if cuda is enabled pass data from all environments to cuda only once
+            self._batch_size = args.get("irm_batch_size", 0)
+            if self._batch_size == 1:
+                raise ValueError("irm_batch_size should be 0 (full batch) or >= 2")
+            # if cuda is enabled pass data from all environments to cuda only once,
+            # environments that are not tensors (e.g. memory-mapped arrays) are
+            # only read by minibatches which are moved to the device
             self.environments = (
-                [(x.data.to("cuda"), y.data.to("cuda")) for x, y in environments]
+                [
+                    (
+                        (x.data.to("cuda"), y.data.to("cuda"))
+                        if isinstance(x, torch.Tensor)
+                        else (x, y)
+                    )
+                    for x, y in environments
+                ]
                 if self._uses_cuda
                 else environments
             )
+            # parameters follow the dtype of the data
+            self._dtype = _torch_dtype(self.environments[0][0])
+            if not self._batch_size and not all(
+                isinstance(x, torch.Tensor) for x, _ in self.environments
+            ):
+                raise TypeError("Environments that are not tensors need irm_batch_size")
             # print(torch.cuda.memory_summary())
 
-            x_val = self.environments[-1][0]
-            y_val = self.environments[-1][1]
-
-            # TODO : make this a param
-            _config_dest = f"irm_training_{str(dt.datetime.now()).split('.')[0].replace(' ', '_')}.csv"
-            with open(_config_dest, "w", encoding="utf-8") as _irm_record:
-                csv_writer = csv.writer(_irm_record, delimiter=",")
+            with self._training_record(args) as csv_writer:
                 header = "iteration, reg, error, penalty".split(", ")
-                csv_writer.writerow(header)
 
                 # Regularise using the last environment, train with all others
                 regs_ls = [0, 1e-5, 1e-4, 1e-3, 1e-2, 1e-1]
+                if args.get("irm_search", "grid") == "halving":
+                    csv_writer.writerow(header + ["lr"])
+                    self._successive_halving(args, csv_writer, regs_ls)
+                    return
+
+                csv_writer.writerow(header)
                 for reg in regs_ls:
                     self.train(
                         self.environments[:-1], args, csv_writer=csv_writer, reg=reg
                     )
-                    err = (x_val @ self._raw_solution() - y_val).pow(2).mean().item()
+                    err = self._validation_error()
+                    events.emit("irm_reg_end", reg=reg, validation_error=err)
 
                     if err < best_err:
                         best_err = err
@@ -85,6 +136,7 @@ class InvariantRiskMinimization(object):
                             )
                         )
                 self.phi = best_phi
+                self.best_reg, self.best_lr = best_reg, args["lr"]
         except Exception as e:
             raise e
         finally:
@@ -93,6 +145,22 @@ class InvariantRiskMinimization(object):
             # print(f"CUDA reserved memory (MB) after instantiation : {torch.cuda.memory_reserved() / 1024**2}")
             # print(f"CUDA allocated memory (MB) after instantiation : {torch.cuda.memory_allocated() / 1024**2}\n\n")
 
+    @contextlib.contextmanager
+    def _training_record(self, args):
+        """Writer of the training curves: a csv file, or with
+        irm_curve_format="npz" a CurveRecorder kept in self.curves"""
+        if args.get("irm_curve_format", "csv") == "npz":
+            self.curves = CurveRecorder(args["lr"])
+            yield self.curves
+            return
+
+        _config_dest = args.get(
+            "irm_training_file",
+            f"irm_training_{str(dt.datetime.now()).split('.')[0].replace(' ', '_')}.csv",
+        )
+        with open(_config_dest, "w", encoding="utf-8") as _irm_record:
+            yield csv.writer(_irm_record, delimiter=",")
+
     def train(
         self,
         environments,
@@ -101,23 +169,43 @@ class InvariantRiskMinimization(object):
         reg=0,
     ):
         """train the IRM model across environments"""
-        dim_x = environments[0][0].size(1)
+        dim_x = environments[0][0].shape[1]
+
+        self.phi, self.w, opt = self._init_parameters(dim_x, args["lr"])
+        self._train_iterations(
+            environments, args, csv_writer, reg, opt, 0, args["n_iterations"]
+        )
 
-        self.phi = torch.nn.Parameter(
-            torch.eye(dim_x, dim_x, device=self._device), requires_grad=True
+    def _init_parameters(self, dim_x, lr):
+        """Fresh phi, w and optimizer"""
+        phi = torch.nn.Parameter(
+            torch.eye(dim_x, dim_x, device=self._device, dtype=self._dtype),
+            requires_grad=True,
         )
-        self.w = torch.ones(dim_x, 1, device=self._device)
-        self.w.requires_grad = True
+        w = torch.ones(dim_x, 1, device=self._device, dtype=self._dtype)
+        w.requires_grad = True
 
-        opt = torch.optim.Adam([self.phi], lr=args["lr"])
+        return phi, w, torch.optim.Adam([phi], lr=lr)
+
+    def _train_iterations(
+        self, environments, args, csv_writer, reg, opt, start, stop, extra_columns=()
+    ):
+        """Run iterations [start, stop) of the training of self.phi"""
         loss = torch.nn.MSELoss()
 
-        for iteration in range(args["n_iterations"]):
+        _progress_time, _progress_iteration = time.perf_counter(), start
+        for iteration in range(start, stop):
             penalty = 0
             error = 0
             for x_e, y_e in environments:
-                error_e = loss(x_e @ self.phi @ self.w, y_e)
-                penalty += grad(error_e, self.w, create_graph=True)[0].pow(2).mean()
+                if self._batch_size:
+                    error_e, penalty_e = self._minibatch_loss(x_e, y_e, loss)
+                else:
+                    error_e = loss(x_e @ self.phi @ self.w, y_e)
+                    penalty_e = (
+                        grad(error_e, self.w, create_graph=True)[0].pow(2).mean()
+                    )
+                penalty += penalty_e
                 error += error_e
 
             opt.zero_grad()
@@ -125,7 +213,116 @@ class InvariantRiskMinimization(object):
             opt.step()
 
             if iteration % args["irm_epoch_size"] == 0:
-                csv_writer.writerow([iteration, reg, error.item(), penalty.item()])
+                csv_writer.writerow(
+                    [iteration, reg, error.item(), penalty.item(), *extra_columns]
+                )
+                if events.enabled():
+                    _now = time.perf_counter()
+                    events.emit(
+                        "irm_progress",
+                        reg=reg,
+                        iteration=iteration,
+                        n_iterations=args["n_iterations"],
+                        error=error.item(),
+                        penalty=penalty.item(),
+                        iterations_per_second=(
+                            (iteration - _progress_iteration) / (_now - _progress_time)
+                        ),
+                    )
+                    _progress_time, _progress_iteration = _now, iteration
+
+        self.n_iterations_run += stop - start
+
+    def _minibatch_loss(self, x_e, y_e, loss):
+        """Error and penalty of an environment, estimated on a random batch.
+
+        The squared gradient of the full batch penalty is estimated by the
+        product of the gradients of two independent half-batches, which is
+        unbiased (see compute_irm_penalty in irm/image/CNN.py)."""
+        x_b, y_b = sample_batch(x_e, y_e, self._batch_size, self.phi)
+        half = self._batch_size // 2
+        error_1 = loss(x_b[:half] @ self.phi @ self.w, y_b[:half])
+        error_2 = loss(x_b[half:] @ self.phi @ self.w, y_b[half:])
+        grad_1 = grad(error_1, self.w, create_graph=True)[0]
+        grad_2 = grad(error_2, self.w, create_graph=True)[0]
+        return (error_1 + error_2) / 2, (grad_1 * grad_2).mean()
+
+    def _validation_error(self, chunk_size=65536):
+        """Error of the current solution on the last environment,
+        read by chunks if it is not a tensor"""
+        x_val, y_val = self.environments[-1]
+        if isinstance(x_val, torch.Tensor):
+            return (x_val @ self._raw_solution() - y_val).pow(2).mean().item()
+
+        with torch.no_grad():
+            solution = self._raw_solution()
+            squared_error = 0.0
+            for start in range(0, len(x_val), chunk_size):
+                x_c, y_c = (
+                    _as_tensor(a[start : start + chunk_size], solution)
+                    for a in (x_val, y_val)
+                )
+                squared_error += (x_c @ solution - y_c).pow(2).sum().item()
+        return squared_error / len(x_val)
+
+    def _successive_halving(self, args, csv_writer, regs_ls):
+        """Search (reg, lr) by successive halving.
+
+        Every candidate starts with a small share of the iterations, then
+        after each rung only the best 1/eta of the candidates on the
+        validation environment keep training. The rungs end at
+        n_iterations * eta^-k, ..., n_iterations / eta, n_iterations, so
+        the winner is trained as long as every reg of the grid search."""
+        eta = args.get("irm_halving_eta", 2)
+        lrs = [float(lr) for lr in str(args.get("irm_lrs") or args["lr"]).split(",")]
+        dim_x = self.environments[0][0].shape[1]
+
+        candidates = []
+        for reg in regs_ls:
+            for lr in lrs:
+                phi, w, opt = self._init_parameters(dim_x, lr)
+                candidates.append(
+                    {"reg": reg, "lr": lr, "phi": phi, "w": w, "opt": opt, "done": 0}
+                )
+
+        schedule = halving_schedule(len(candidates), eta, args["n_iterations"])
+        for n_kept, stop in schedule:
+            # sorted by validation error after the first rung
+            candidates = candidates[:n_kept]
+            for candidate in candidates:
+                self.phi, self.w = candidate["phi"], candidate["w"]
+                self._train_iterations(
+                    self.environments[:-1],
+                    args,
+                    csv_writer,
+                    candidate["reg"],
+                    candidate["opt"],
+                    candidate["done"],
+                    stop,
+                    extra_columns=(candidate["lr"],),
+                )
+                candidate["done"] = stop
+                candidate["err"] = self._validation_error()
+                events.emit(
+                    "irm_reg_end",
+                    reg=candidate["reg"],
+                    lr=candidate["lr"],
+                    iteration=stop,
+                    validation_error=candidate["err"],
+                )
+                if args["verbose"]:
+                    print(
+                        " IRM (reg={:.6f}, lr={:.6f}) has {:.3f} validation error"
+                        " after {} iterations.".format(
+                            candidate["reg"], candidate["lr"], candidate["err"], stop
+                        )
+                    )
+
+            candidates.sort(key=lambda c: c["err"])
+
+        best = candidates[0]
+        self.phi, self.w = best["phi"], best["w"]
+        self.best_reg, self.best_lr = best["reg"], best["lr"]
 
     def solution(self):
         """Get the coefficients, always on cpu"""
@@ -189,16 +386,16 @@ class InvariantCausalPrediction(object):
             accepted_features = list(set.intersection(*accepted_subsets))
             if args["verbose"]:
                 print("Intersection:", accepted_features)
-            self.coefficients = np.zeros(dim)
+            self.coefficients = np.zeros(dim, dtype=x_all.dtype)
 
             if len(accepted_features):
                 x_s = x_all[:, list(accepted_features)]
                 reg = LinearRegression(fit_intercept=False).fit(x_s, y_all)
                 self.coefficients[list(accepted_features)] = reg.coef_
 
-            self.coefficients = torch.Tensor(self.coefficients)
+            self.coefficients = torch.from_numpy(self.coefficients)
         else:
-            self.coefficients = torch.zeros(dim)
+            self.coefficients = torch.zeros(dim, dtype=environments[0][0].dtype)
 
     def mean_var_test(self, x, y):
         """mean-variance test"""
@@ -225,11 +422,12 @@ class EmpiricalRiskMinimizer(object):
     all environments."""
 
     def __init__(self, environments, args):
-        x_all = torch.cat([x for (x, y) in environments]).numpy()
-        y_all = torch.cat([y for (x, y) in environments]).numpy()
+        x_all = torch.cat([x for (x, y) in environments])
+        y_all = torch.cat([y for (x, y) in environments])
 
-        w = LinearRegression(fit_intercept=False).fit(x_all, y_all).coef_
-        self.w = torch.Tensor(w).view(-1, 1)
+        # same fit as LinearRegression(fit_intercept=False), in the dtype
+        # of the data instead of a float64 copy
+        self.w = torch.linalg.lstsq(x_all, y_all).solution.view(-1, 1)
 
     def solution(self):
         """Get the coeficients"""
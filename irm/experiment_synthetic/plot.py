@@ -8,12 +8,14 @@
 import matplotlib.pyplot as plt
 import matplotlib.ticker as mticker
 import numpy as np
-import torch
+import pandas as pd
 import math
 import sys
 
 from matplotlib.patches import Patch
 
+from .aggregate import load_results, summarize
+
 
 def parse_title(title):
     result = ""
@@ -37,59 +39,48 @@ def parse_title(title):
     return result
 
 
-def plot_bars(results, category, which, sep=1.1):
-    models = list(results[list(results.keys())[0]].keys())
-
+def plot_bars(summary, category, which, sep=1.1):
+    """Draw the mean error of each model, per setup, from a summary
+    table (see aggregate.summarize)"""
+    models = sorted(summary.index.get_level_values("Method").unique())
     if "SEM" in models:
         models.remove("SEM")
-    models.sort()
 
-    setups = list(results.keys())
-    setups.sort()
+    setups = sorted(summary.index.get_level_values("Acronym").unique())
 
     if which == "causal":
         hatch = None
         offset = 0
-        idx = 0
+        column = "ErrCausal"
     else:
         hatch = "//"
         offset = 4
-        idx = 1
+        column = "ErrNonCausal"
 
     counter = 1
-    for s, setup in enumerate(setups):
-        title = parse_title(setup)
-
+    for s, title in enumerate(setups):
         if category not in title:
             continue
 
-        boxes = []
-        boxes_means = []
-        boxes_colors = []
-        boxes_vars = []
         ax = plt.subplot(2, 4, counter + offset)
         counter += 1
 
-        for m, model in enumerate(models):
-            boxes.append(np.array(results[setup][model])[:, idx])
-            boxes_means.append(
-                np.mean(np.array(results[setup][model])[:, idx]))
-            boxes_vars.append(np.std(np.array(results[setup][model])[:, idx]))
-            boxes_colors.append("C" + str(m))
+        setup_summary = summary.loc[title].reindex(models)
+        boxes_colors = ["C" + str(m) for m in range(len(models))]
 
-        plt.bar([0, 1, 2],
-                boxes_means,
-                yerr=np.array(boxes_vars),
+        plt.bar(range(len(models)),
+                setup_summary[column, "mean"],
+                yerr=setup_summary[column, "std"],
                 color=boxes_colors,
                 hatch=hatch,
                 alpha=0.7,
                 log=True)
 
         if which == "causal":
-            plt.xticks([1], [title])
+            plt.xticks([(len(models) - 1) / 2], [title])
         else:
             ax.xaxis.set_ticks_position('top')
-            plt.xticks([1], [""])
+            plt.xticks([(len(models) - 1) / 2], [""])
 
         if (counter + offset) == 2 or (counter + offset) == 6:
             if which == "causal":
@@ -109,32 +100,33 @@ def plot_bars(results, category, which, sep=1.1):
             ax.set_yticks([0.1, 0.01])
 
 
-def plot_experiment(all_solutions, category, fname):
+def lines_to_results(all_solutions):
+    """Results table of the whitespace separated text format:
+    setup model ... err_causal err_noncausal"""
+    words = [line.split(" ") for line in all_solutions]
+    results_df = pd.DataFrame({
+        "Setup": [w[0] for w in words],
+        "Method": [w[1] for w in words],
+        "ErrCausal": [float(w[-2]) for w in words],
+        "ErrNonCausal": [float(w[-1]) for w in words],
+    })
+    titles = {setup: parse_title(setup) for setup in results_df.Setup.unique()}
+    results_df["Acronym"] = results_df.Setup.map(titles)
+    return results_df
+
+
+def plot_summary(summary, category, fname, usetex=True):
+    """Draw the causal and non-causal errors of a summary table.
+    Without usetex, text is drawn by matplotlib (mathtext) instead of LaTeX,
+    which is much faster and needs no LaTeX install."""
     plt.rcParams["font.family"] = "serif"
-    plt.rc('text', usetex=True)
+    plt.rc('text', usetex=usetex)
     plt.rc('font', size=10)
 
-    results = {}
-
-    for line in all_solutions:
-        words = line.split(" ")
-        setup = str(words[0])
-        model = str(words[1])
-        err_causal = float(words[-2])
-        err_noncausal = float(words[-1])
-
-        if setup not in results:
-            results[setup] = {}
-
-        if model not in results[setup]:
-            results[setup][model] = []
-
-        results[setup][model].append([err_causal, err_noncausal])
-
     plt.figure(figsize=(7, 2))
-    plot_bars(results, category, "causal")
-    plot_bars(results, category, "noncausal")
-    plt.tight_layout(0, 0, 0.5)
+    plot_bars(summary, category, "causal")
+    plot_bars(summary, category, "noncausal")
+    plt.tight_layout(pad=0, h_pad=0, w_pad=0.5)
 
     if fname is None:
         plt.show()
@@ -142,14 +134,23 @@ def plot_experiment(all_solutions, category, fname):
         plt.savefig(fname)
 
 
+def plot_experiment(all_solutions, category, fname, usetex=True):
+    plot_summary(summarize(lines_to_results(all_solutions)), category, fname,
+                 usetex=usetex)
+
+
 if __name__ == "__main__":
     if len(sys.argv) == 1:
         fname = "synthetic_results.txt"
     else:
         fname = sys.argv[1]
 
-    with open(fname, "r") as f:
-        lines = f.readlines()
+    if fname.endswith(".txt"):
+        with open(fname, "r") as f:
+            summary = summarize(lines_to_results(f.readlines()))
+    else:
+        # result files of irm runs, a directory or a glob pattern
+        summary = summarize(load_results(sys.argv[1:]))
 
-    plot_experiment(lines, "F", "results_f.pdf")
-    plot_experiment(lines, "P", "results_p.pdf")
+    plot_summary(summary, "F", "results_f.pdf")
+    plot_summary(summary, "P", "results_p.pdf")
@@ -0,0 +1,119 @@
+""" Measure the cost of fitting a method"""
+
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# Columns added to the results by run_repetition (seconds and MB),
+# see Measurement.values
+COST_COLUMNS = [
+    "WallTime",
+    "CPUTime",
+    "PeakRSS",
+    "TracemallocPeak",
+    "Iterations",
+    "IterationsPerSecond",
+]
+
+
+def reset_peak_rss():
+    """Reset the high-water mark of the resident set size to the current
+    size. Only possible on Linux, return whether it was reset."""
+    try:
+        with open("/proc/self/clear_refs", "w", encoding="ascii") as _c_f:
+            _c_f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    """High-water mark of the resident set size of this process, in MB:
+    since the last reset_peak_rss on Linux, since the start of the process
+    otherwise"""
+    try:
+        with open("/proc/self/status", "r", encoding="ascii") as _s_f:
+            for line in _s_f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if resource is None:
+        return float("nan")
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return max_rss / 1024**2 if sys.platform == "darwin" else max_rss / 1024
+
+
+class Measurement(object):
+    """Context manager recording wall time, CPU time and memory peaks.
+
+    CPU time is the time of the whole process (all threads), or of the
+    calling thread only with per_thread (for measurements running
+    concurrently in several threads, it then misses the time of the
+    intra-op threads of torch and BLAS).
+    PeakRSS is the high-water mark of the process RSS reached during the
+    block, which it resets on entry. It is NaN where the mark cannot be
+    reset (outside Linux) and with per_thread, since concurrent blocks
+    share the mark of the process. tracemalloc only sees memory allocated
+    through Python and NumPy (not torch tensors) and slows allocations
+    down, so it is opt-in."""
+
+    def __init__(self, trace_memory=False, per_thread=False):
+        self.trace_memory = trace_memory
+        self.per_thread = per_thread
+        self._cpu_clock = time.thread_time if per_thread else time.process_time
+        self.wall_time = None
+        self.cpu_time = None
+        self.peak_rss = None
+        self.tracemalloc_peak = float("nan")
+        self._stop_tracing = False
+        self._peak_rss_reset = False
+
+    def __enter__(self):
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._stop_tracing = True
+            if hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+            else:
+                # Python 3.8: only restarting the tracing resets the peak
+                tracemalloc.clear_traces()
+                tracemalloc.stop()
+                tracemalloc.start()
+        self._peak_rss_reset = not self.per_thread and reset_peak_rss()
+        self._wall_start = time.perf_counter()
+        self._cpu_start = self._cpu_clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.wall_time = time.perf_counter() - self._wall_start
+        self.cpu_time = self._cpu_clock() - self._cpu_start
+        self.peak_rss = peak_rss_mb() if self._peak_rss_reset else float("nan")
+        if self.trace_memory:
+            self.tracemalloc_peak = tracemalloc.get_traced_memory()[1] / 1024**2
+            if self._stop_tracing:
+                tracemalloc.stop()
+        return False
+
+    def values(self, n_iterations=None):
+        """Values of the COST_COLUMNS, given the number of iterations
+        actually run by the method (None if it does not iterate)"""
+        if n_iterations is None:
+            n_iterations = iterations_per_second = float("nan")
+        else:
+            iterations_per_second = n_iterations / self.wall_time
+        return [
+            self.wall_time,
+            self.cpu_time,
+            self.peak_rss,
+            self.tracemalloc_peak,
+            n_iterations,
+            iterations_per_second,
+        ]
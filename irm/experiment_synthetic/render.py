@@ -0,0 +1,150 @@
+""" Batch rendering of the result figures
+
+`irm render` draws the figures of plot.py for many groups of results at
+once (e.g. one per number of environments, per run or per sweep value):
+
+    irm render runs/ sweep/results.csv --by n_envs --output figures/
+
+Figures are rendered with the Agg backend and mathtext (no LaTeX), on a
+pool of worker processes. Each figure is keyed by a hash of the summary
+it draws: the hashes are kept in <output>/render_manifest.json and a
+figure whose summary did not change since it was last rendered is
+skipped.
+
+The results are read with aggregate.load_results, or from the views of
+a results store (see results_store.py) when given a .sqlite file, which
+holds the config fields of every run (n_envs, dim, ...).
+"""
+
+import hashlib
+import json
+import multiprocessing as mp
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+from .aggregate import SUMMARY_COLUMNS, load_results, summarize
+
+CATEGORIES = ["F", "P"]
+_MANIFEST = "render_manifest.json"
+# bump to render every figure again after changing how they are drawn
+_RENDER_VERSION = 1
+
+
+def load_for_render(paths, by=()):
+    """Results with the summary columns and the by columns"""
+    by = list(by)
+    if len(paths) == 1 and Path(paths[0]).suffix == ".sqlite":
+        import sqlite3
+
+        with sqlite3.connect(paths[0]) as con:
+            columns = ", ".join(dict.fromkeys([*SUMMARY_COLUMNS, "source", *by]))
+            results_df = pd.read_sql_query(f"SELECT {columns} FROM results_view", con)
+        return results_df.rename(columns={"source": "Source"})
+
+    results_df = load_results(paths, columns=[*SUMMARY_COLUMNS, *by])
+    if "n_envs" in by and "n_envs" not in results_df and "env_list" in results_df:
+        results_df["n_envs"] = results_df.env_list.str.count(",") + 1
+    missing = [column for column in by if column not in results_df]
+    if missing:
+        raise ValueError(f"Columns {missing} are not in the result files")
+    return results_df
+
+
+def _figure_name(category, key, by, fmt):
+    parts = [category] + [f"{column}={value}" for column, value in zip(by, key)]
+    name = "_".join(str(part) for part in parts)
+    return name.replace(os.sep, "-").replace(" ", "") + f".{fmt}"
+
+
+def figure_jobs(results_df, output, by=(), categories=CATEGORIES, fmt="pdf"):
+    """One job per group of the by columns and category"""
+    by = list(by)
+    groups = results_df.groupby(by, observed=True) if by else [((), results_df)]
+    jobs = []
+    for key, group_df in groups:
+        key = key if isinstance(key, tuple) else (key,)
+        summary = summarize(group_df)
+        for category in categories:
+            # plot_bars only draws the setups of the category
+            if not any(category in acronym for acronym in summary.index.levels[0]):
+                continue
+            jobs.append(
+                {
+                    "fname": str(Path(output) / _figure_name(category, key, by, fmt)),
+                    "category": category,
+                    "summary": summary,
+                    "hash": _summary_hash(summary, category),
+                }
+            )
+    return jobs
+
+
+def _summary_hash(summary, category):
+    data = summary.to_csv().encode("utf-8")
+    return hashlib.sha256(
+        data + f"{category}|{_RENDER_VERSION}".encode("utf-8")
+    ).hexdigest()
+
+
+def _render(job):
+    """Draw a single figure, in a worker process"""
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    from .plot import plot_summary
+
+    plot_summary(job["summary"], job["category"], job["fname"], usetex=False)
+    plt.close("all")
+    return job["fname"]
+
+
+def _read_manifest(output):
+    try:
+        with open(Path(output) / _MANIFEST, "r", encoding="utf-8") as _m_f:
+            return json.load(_m_f)
+    except FileNotFoundError:
+        return {}
+
+
+def _write_manifest(output, manifest):
+    tmp_path = Path(output) / f".{_MANIFEST}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as _m_f:
+        json.dump(manifest, _m_f, indent=2, sort_keys=True)
+    os.replace(tmp_path, Path(output) / _MANIFEST)
+
+
+def render(jobs, output, n_workers=None, force=False):
+    """Render the jobs whose figure is missing or out of date.
+    Return the rendered and the skipped file names."""
+    output = Path(output)
+    output.mkdir(parents=True, exist_ok=True)
+    manifest = _read_manifest(output)
+    todo, skipped = [], []
+    for job in jobs:
+        up_to_date = (
+            manifest.get(Path(job["fname"]).name) == job["hash"]
+            and Path(job["fname"]).exists()
+        )
+        if force or not up_to_date:
+            todo.append(job)
+        else:
+            skipped.append(job["fname"])
+
+    n_workers = min(n_workers or os.cpu_count(), len(todo))
+    if n_workers > 1:
+        with ProcessPoolExecutor(
+            max_workers=n_workers, mp_context=mp.get_context("spawn")
+        ) as pool:
+            rendered = list(pool.map(_render, todo))
+    else:
+        rendered = [_render(job) for job in todo]
+
+    for job in todo:
+        manifest[Path(job["fname"]).name] = job["hash"]
+    _write_manifest(output, manifest)
+    return rendered, skipped
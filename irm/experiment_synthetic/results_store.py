@@ -0,0 +1,398 @@
+""" SQLite store of the outputs of many runs, for cross-run queries
+
+`irm results ingest` walks directories for run outputs and loads them in
+a single SQLite file:
+
+    runs        one row per run: the source, the timestamp, the config
+                (as JSON) and its main fields as indexed columns, plus
+                n_envs, the number of environments
+    results     the rows of the results CSVs, with the Repetition and
+                the solution X1..Xdim as a JSON list
+    training    the rows of the IRM training CSVs or npz curves (see
+                curves.py), with the Repetition
+    files       path, mtime and size of every ingested file
+
+Two layouts are recognized:
+
+    irm from_params/from_file   irm_config_<time>.toml, irm_results_<time>.csv
+                                and irm_training_<time>.csv in a directory.
+                                The training files written before a results
+                                file belong to its run, one per repetition,
+                                or irm_curves_<time>.npz holds them all.
+    irm sweep/queue             cells.toml and cell=<id>/rep=<i>.csv, each
+                                cell being a run, with the rows of the cell
+                                in irm_curves.npz
+
+Ingestion is incremental: files whose mtime and size did not change are
+skipped, and the rows of modified files are replaced.
+`irm results query` filters the results_view and training_view views,
+which join each row with the config fields of its run, e.g.
+
+    irm results query Method=IRM setup_hidden=1 n_envs=6
+
+Only the standard library (and toml) is used, so the store can be
+queried without the experiment dependencies; ingesting npz curves needs
+numpy and pandas.
+"""
+
+import contextlib
+import csv
+import datetime as dt
+import json
+import os
+import sqlite3
+from operator import itemgetter
+from pathlib import Path
+
+import toml
+
+# config fields copied in indexed columns of runs
+CONFIG_COLUMNS = [
+    "dim",
+    "n_samples",
+    "n_reps",
+    "env_list",
+    "methods",
+    "seed",
+    "n_iterations",
+    "lr",
+    "setup_ones",
+    "setup_hidden",
+    "setup_hetero",
+    "setup_scramble",
+    "setup_scramble_kind",
+    "dtype",
+    "irm_search",
+]
+# value of the config fields added after the first runs, for the configs
+# written before them
+_CONFIG_DEFAULTS = {
+    "setup_scramble_kind": "dense",
+    "dtype": "float32",
+    "irm_search": "grid",
+}
+RESULT_COLUMNS = [
+    "Method",
+    "Coefficients",
+    "GraphObservation",
+    "Dispersion",
+    "Scramble",
+    "ErrCausal",
+    "ErrNonCausal",
+    "WallTime",
+    "CPUTime",
+    "PeakRSS",
+    "TracemallocPeak",
+    "Iterations",
+    "IterationsPerSecond",
+]
+TRAINING_COLUMNS = ["iteration", "reg", "lr", "error", "penalty"]
+
+
+def _typed(columns, default="NUMERIC"):
+    """Column definitions, NUMERIC unless listed in _TEXT_COLUMNS.
+    The declared types let SQLite convert the CSV strings on insert."""
+    return ", ".join(
+        f"{c} {'TEXT' if c in _TEXT_COLUMNS else default}" for c in columns
+    )
+
+
+_TEXT_COLUMNS = {
+    "env_list",
+    "methods",
+    "setup_scramble_kind",
+    "dtype",
+    "irm_search",
+    "Method",
+}
+
+_TABLES = f"""
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    source TEXT UNIQUE,
+    timestamp TEXT,
+    config TEXT,
+    n_envs INTEGER,
+    {_typed(CONFIG_COLUMNS)}
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY, mtime REAL, size INTEGER, run_id INTEGER, kind TEXT
+);
+CREATE TABLE IF NOT EXISTS results (
+    run_id INTEGER, file TEXT, Repetition INTEGER,
+    {_typed(RESULT_COLUMNS)}, Solution TEXT
+);
+CREATE TABLE IF NOT EXISTS training (
+    run_id INTEGER, file TEXT, Repetition INTEGER, {_typed(TRAINING_COLUMNS)}
+);
+CREATE INDEX IF NOT EXISTS runs_setup ON runs
+    (n_envs, dim, setup_hidden, setup_hetero, setup_scramble, setup_ones);
+CREATE INDEX IF NOT EXISTS results_run ON results (run_id, Method);
+CREATE INDEX IF NOT EXISTS results_method ON results
+    (Method, GraphObservation, Dispersion, Scramble);
+CREATE INDEX IF NOT EXISTS results_file ON results (file);
+CREATE INDEX IF NOT EXISTS training_run ON training (run_id, Repetition);
+CREATE INDEX IF NOT EXISTS training_file ON training (file);
+"""
+# created again on every connection, to follow the columns of runs
+_VIEWS = f"""
+DROP VIEW IF EXISTS results_view;
+DROP VIEW IF EXISTS training_view;
+CREATE VIEW results_view AS
+    SELECT runs.source, runs.timestamp, runs.n_envs,
+        {", ".join(f"runs.{c}" for c in CONFIG_COLUMNS)}, results.*
+    FROM results JOIN runs USING (run_id);
+CREATE VIEW training_view AS
+    SELECT runs.source, runs.timestamp, runs.n_envs,
+        {", ".join(f"runs.{c}" for c in CONFIG_COLUMNS if c != "lr")},
+        training.run_id, training.file, training.Repetition,
+        training.iteration, training.reg,
+        -- the lr of each candidate of a halving search, else the run lr
+        COALESCE(training.lr, runs.lr) AS lr,
+        training.error, training.penalty
+    FROM training JOIN runs USING (run_id);
+"""
+
+
+def connect(db_path):
+    """Open (and create if needed) a results store"""
+    con = sqlite3.connect(db_path)
+    con.executescript(_TABLES)
+    # stores created before some config columns existed; their runs are
+    # filled in when they are ingested again
+    run_columns = {row[1] for row in con.execute("PRAGMA table_info(runs)")}
+    for column in CONFIG_COLUMNS:
+        if column not in run_columns:
+            con.execute(f"ALTER TABLE runs ADD COLUMN {_typed([column])}")
+    con.executescript(_VIEWS)
+    return con
+
+
+def _number(value):
+    """Parse a query value as an int, a float or a string"""
+    if value is None or value == "":
+        return None
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except ValueError:
+            pass
+    return value
+
+
+def _file_time(path):
+    """Timestamp in an irm_<kind>_<time>.<ext> name"""
+    return path.stem.split("_", maxsplit=2)[-1]
+
+
+def _read_config(path):
+    with open(path, "r", encoding="utf-8") as _c_f:
+        return toml.load(_c_f)
+
+
+def _run_directory(directory, names):
+    """Runs written in a directory by irm from_params/from_file"""
+    files = {
+        kind: sorted(
+            (directory / n for n in names if n.startswith(f"irm_{kind}_")),
+            key=_file_time,
+        )
+        for kind in ["config", "results", "training", "curves"]
+    }
+    training = list(files["training"])
+    for results_file in files["results"]:
+        results_time = _file_time(results_file)
+        configs = [c for c in files["config"] if _file_time(c) <= results_time]
+        run_training = [t for t in training if _file_time(t) <= results_time]
+        training = training[len(run_training) :]
+        yield {
+            "source": str(results_file),
+            "timestamp": results_time,
+            "config": _read_config(configs[-1]) if configs else {},
+            "results": [(results_file, None)],
+            "training": [(t, rep_i) for rep_i, t in enumerate(run_training)]
+            + [(c, None) for c in files["curves"] if _file_time(c) == results_time],
+        }
+
+
+def _sweep_directory(directory):
+    """Runs (one per cell) of an irm sweep or queue directory"""
+    cells = _read_config(directory / "cells.toml")
+    timestamp = dt.datetime.fromtimestamp(
+        (directory / "cells.toml").stat().st_mtime
+    ).isoformat()
+    for cell_key, config in sorted(cells.items()):
+        cell_dir = directory / cell_key
+        if not cell_dir.is_dir():
+            continue
+        yield {
+            "source": str(cell_dir),
+            "timestamp": timestamp,
+            "config": config,
+            "results": [
+                (path, int(path.stem.split("=")[-1]))
+                for path in sorted(cell_dir.glob("rep=*.csv"))
+            ],
+            "training": [
+                (path, int(path.stem.split("=")[-1]))
+                for path in sorted(cell_dir.glob("irm_training_rep=*.csv"))
+                # npz curves not consolidated yet
+                + sorted(cell_dir.glob("irm_curves_rep=*.npz"))
+            ]
+            + [
+                (path, None) for path in [directory / "irm_curves.npz"] if path.exists()
+            ],
+            "cell": int(cell_key.split("=")[-1]),
+        }
+
+
+def discover_runs(paths):
+    """Yield the runs found under the given directories"""
+    for path in paths:
+        for dir_path, dir_names, file_names in os.walk(Path(path).resolve()):
+            directory = Path(dir_path)
+            if "cells.toml" in file_names:
+                yield from _sweep_directory(directory)
+                # the cells were read with the sweep
+                dir_names[:] = [d for d in dir_names if not d.startswith("cell=")]
+            else:
+                yield from _run_directory(directory, file_names)
+
+
+def _upsert_run(con, run):
+    config = run["config"]
+    env_list = config.get("env_list")
+    values = {
+        "source": run["source"],
+        "timestamp": run["timestamp"],
+        "config": json.dumps(config, sort_keys=True),
+        "n_envs": len(env_list.split(",")) if env_list else None,
+        **{c: config.get(c, _CONFIG_DEFAULTS.get(c)) for c in CONFIG_COLUMNS},
+    }
+    con.execute(
+        f"INSERT INTO runs ({', '.join(values)}) "
+        f"VALUES ({', '.join('?' * len(values))}) "
+        f"ON CONFLICT(source) DO UPDATE SET "
+        + ", ".join(f"{c}=excluded.{c}" for c in values if c != "source"),
+        list(values.values()),
+    )
+    return con.execute(
+        "SELECT run_id FROM runs WHERE source = ?", (run["source"],)
+    ).fetchone()[0]
+
+
+def _results_rows(reader, header, select, rep_i):
+    x_index = [i for i, c in enumerate(header) if c[:1] == "X" and c[1:].isdigit()]
+    method = header.index("Method")
+    # a from_file run holds every repetition, each starting with the SEM
+    repetition = -1 if rep_i is None else rep_i
+    for row in reader:
+        if rep_i is None and row[method] == "SEM":
+            repetition += 1
+        yield (
+            repetition,
+            # pandas writes NaN (e.g. the costs of the SEM) as empty fields
+            *[value or None for value in select(row)],
+            "[" + ",".join(row[i] for i in x_index) + "]",
+        )
+
+
+def _curve_rows(path, cell):
+    """Training rows of an npz curve file (of a cell of a sweep)"""
+    from .curves import load_curves
+
+    df = load_curves([path])
+    if cell is not None and "cell" in df:
+        df = df[df.cell == cell]
+    columns = ["repetition", *TRAINING_COLUMNS]
+    return TRAINING_COLUMNS, df[columns].itertuples(index=False, name=None)
+
+
+def _ingest_file(con, run_id, kind, path, rep_i, cell=None):
+    """Load a file unless it did not change since it was ingested.
+    The rows of the merged curves of a sweep are ingested per cell.
+    Return whether it was loaded."""
+    stat = path.stat()
+    # the file (or the part of the merged curves) the rows come from
+    key = str(path) if cell is None else f"{path}#cell={cell:04d}"
+    known = con.execute(
+        "SELECT mtime, size FROM files WHERE path = ?", (key,)
+    ).fetchone()
+    if known == (stat.st_mtime, stat.st_size):
+        return False
+
+    con.execute(f"DELETE FROM {kind} WHERE file = ?", (key,))
+    with contextlib.ExitStack() as stack:
+        if path.suffix == ".npz":
+            columns, rows = _curve_rows(path, cell)
+        else:
+            reader = csv.reader(
+                stack.enter_context(open(path, "r", encoding="utf-8", newline=""))
+            )
+            header = next(reader)
+            known_columns = RESULT_COLUMNS if kind == "results" else TRAINING_COLUMNS
+            columns = [c for c in known_columns if c in header]
+            # every file has several of the known columns, so select returns tuples
+            select = itemgetter(*[header.index(c) for c in columns])
+            if kind == "results":
+                columns.append("Solution")
+                rows = _results_rows(reader, header, select, rep_i)
+            else:
+                # the declared column types convert the strings
+                rows = ((rep_i, *select(row)) for row in reader)
+        con.executemany(
+            f"INSERT INTO {kind} (run_id, file, Repetition, {', '.join(columns)}) "
+            f"VALUES ({run_id}, ?, ?, {', '.join('?' * len(columns))})",
+            ((key, *row) for row in rows),
+        )
+    con.execute(
+        "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+        (key, stat.st_mtime, stat.st_size, run_id, kind),
+    )
+    return True
+
+
+def ingest(db_path, paths):
+    """Ingest the runs found under paths. Return the number of files
+    loaded and skipped (unchanged)."""
+    counts = {"loaded": 0, "skipped": 0}
+    con = connect(db_path)
+    try:
+        for run in discover_runs(paths):
+            # one transaction per run
+            with con:
+                run_id = _upsert_run(con, run)
+                for kind in ["results", "training"]:
+                    for path, rep_i in run[kind]:
+                        # only the merged curves of a sweep hold several cells
+                        cell = (
+                            run.get("cell") if path.name == "irm_curves.npz" else None
+                        )
+                        loaded = _ingest_file(con, run_id, kind, path, rep_i, cell)
+                        counts["loaded" if loaded else "skipped"] += 1
+    finally:
+        con.close()
+    return counts
+
+
+def query(db_path, table="results", filters=None, columns=None, limit=None):
+    """Rows of results_view or training_view matching every column=value
+    of filters. Return the column names and the rows."""
+    view = f"{table}_view"
+    con = connect(db_path)
+    try:
+        known = [row[1] for row in con.execute(f"PRAGMA table_info({view})")]
+        filters = filters or {}
+        for column in [*filters, *(columns or [])]:
+            if column not in known:
+                raise ValueError(f"Unknown column {column}, choose from {known}")
+
+        sql = f"SELECT {', '.join(columns) if columns else '*'} FROM {view}"
+        if filters:
+            sql += " WHERE " + " AND ".join(f"{c} = ?" for c in filters)
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        cursor = con.execute(sql, [_number(v) for v in filters.values()])
+        return [d[0] for d in cursor.description], cursor.fetchall()
+    finally:
+        con.close()
@@ -5,6 +5,9 @@
 # LICENSE file in the root directory of this source tree.
 #
 
+import functools
+import math
+
 import torch
 
 # Try and set tensors to operate on the GPU by default
@@ -12,51 +15,146 @@ import torch
 #    torch.set_default_tensor_type("torch.cuda.FloatTensor")
 
 
+# largest Hadamard block multiplied as a dense matrix by fwht
+_FWHT_BLOCK = 128
+
+
+@functools.lru_cache(maxsize=None)
+def _hadamard_matrix(size):
+    """Sylvester Hadamard matrix of +-1 entries, size a power of two"""
+    h = torch.ones(1, 1)
+    while h.shape[0] < size:
+        h = torch.cat((torch.cat((h, h), 1), torch.cat((h, -h), 1)), 0)
+    return h
+
+
+def fwht(x):
+    """Orthonormal fast Walsh-Hadamard transform of the rows of x.
+    dim must be a power of two.
+
+    H_dim is the Kronecker product of Hadamard blocks of at most
+    _FWHT_BLOCK rows: each block is multiplied along one axis of x
+    reshaped to (n, block, ..., block), in O(n dim log dim) flops."""
+    n, dim = x.shape
+    sizes = []
+    while dim > 1:
+        sizes.append(min(dim, _FWHT_BLOCK))
+        dim //= sizes[-1]
+    x = x.reshape(n, *sizes)
+    for size in reversed(sizes):
+        # multiply the last axis, then rotate it to the front
+        x = (x @ _hadamard_matrix(size).to(x)).movedim(-1, 1)
+    return x.reshape(n, -1) / math.sqrt(x[0].numel())
+
+
+class HadamardScramble(object):
+    """Randomized Hadamard transform D_1 H D_2 H D_3 H, with D_i random
+    sign flips and H the orthonormal Walsh-Hadamard matrix, applied in
+    O(n dim log dim) and stored as 3 x dim signs. dim must be a power of two.
+
+    Supports x @ scramble (rows of x) and scramble @ w (columns of w)
+    like the dense scramble."""
+
+    kind = "hadamard"
+
+    def __init__(self, dim, signs=None, dtype=torch.float32):
+        if dim & (dim - 1):
+            raise ValueError(
+                f"The hadamard scramble needs a power of two dim, not {dim}"
+            )
+        if signs is None:
+            signs = torch.randint(0, 2, (3, dim)).to(dtype) * 2 - 1
+        self.signs = signs
+
+    def __rmatmul__(self, x):
+        for d in self.signs:
+            x = fwht(x * d)
+        return x
+
+    def __matmul__(self, w):
+        # (S w)^T = w^T S^T with S^T = H D_3 H D_2 H D_1
+        x = w.t()
+        for d in self.signs.flip(0):
+            x = fwht(x) * d
+        return x.t()
+
+    def state(self):
+        """Tensors the scramble is rebuilt from"""
+        return {"signs": self.signs}
+
+
+STRUCTURED_SCRAMBLES = {cls.kind: cls for cls in [HadamardScramble]}
+
+
 class ChainEquationModel(object):
     """Create Chain Equation Model
-    
+
+    scramble_kind selects how the scramble is stored and applied:
+    "dense" (a dim x dim orthogonal matrix) or "hadamard", a structured
+    scramble which scales to large (power of two) dims.
+    The weights and the generated data have the given dtype.
     """
 
-    def __init__(self, dim, ones=True, scramble=False, hetero=True, hidden=False):
+    def __init__(
+        self,
+        dim,
+        ones=True,
+        scramble=False,
+        hetero=True,
+        hidden=False,
+        scramble_kind="dense",
+        dtype=torch.float32,
+    ):
         self.hetero = hetero
+        self.dtype = dtype
         self.hidden = hidden
         self.dim = dim // 2
 
         if ones:
-            self.wxy = torch.eye(self.dim)
-            self.wyz = torch.eye(self.dim)
+            self.wxy = torch.eye(self.dim, dtype=dtype)
+            self.wyz = torch.eye(self.dim, dtype=dtype)
         else:
-            self.wxy = torch.randn(self.dim, self.dim) / dim
-            self.wyz = torch.randn(self.dim, self.dim) / dim
+            self.wxy = torch.randn(self.dim, self.dim, dtype=dtype) / dim
+            self.wyz = torch.randn(self.dim, self.dim, dtype=dtype) / dim
 
-        if scramble:
-            self.scramble, _ = torch.qr(torch.randn(dim, dim))
+        if scramble_kind != "dense" and scramble_kind not in STRUCTURED_SCRAMBLES:
+            raise ValueError(
+                f"Unknown scramble kind {scramble_kind}, choose dense or "
+                f"{', '.join(STRUCTURED_SCRAMBLES)}"
+            )
+        if scramble and scramble_kind != "dense":
+            self.scramble = STRUCTURED_SCRAMBLES[scramble_kind](dim, dtype=dtype)
+        elif scramble:
+            self.scramble, _ = torch.linalg.qr(torch.randn(dim, dim, dtype=dtype))
         else:
-            self.scramble = torch.eye(dim)
+            self.scramble = torch.eye(dim, dtype=dtype)
 
         if hidden:
-            self.whx = torch.randn(self.dim, self.dim) / dim
-            self.why = torch.randn(self.dim, self.dim) / dim
-            self.whz = torch.randn(self.dim, self.dim) / dim
+            self.whx = torch.randn(self.dim, self.dim, dtype=dtype) / dim
+            self.why = torch.randn(self.dim, self.dim, dtype=dtype) / dim
+            self.whz = torch.randn(self.dim, self.dim, dtype=dtype) / dim
         else:
-            self.whx = torch.eye(self.dim, self.dim)
-            self.why = torch.zeros(self.dim, self.dim)
-            self.whz = torch.zeros(self.dim, self.dim)
+            self.whx = torch.eye(self.dim, self.dim, dtype=dtype)
+            self.why = torch.zeros(self.dim, self.dim, dtype=dtype)
+            self.whz = torch.zeros(self.dim, self.dim, dtype=dtype)
 
     def solution(self):
         """Return the actual solution"""
-        w = torch.cat((self.wxy.sum(1), torch.zeros(self.dim))).view(-1, 1)
-        return w, self.scramble
+        w = torch.cat((self.wxy.sum(1), torch.zeros(self.dim, dtype=self.dtype)))
+        return w.view(-1, 1), self.scramble
+
+    def _noise(self, n):
+        return torch.randn(n, self.dim, dtype=self.dtype)
 
     def __call__(self, n, env):
-        h = torch.randn(n, self.dim) * env
-        x = h @ self.whx + torch.randn(n, self.dim) * env
+        h = self._noise(n) * env
+        x = h @ self.whx + self._noise(n) * env
 
         if self.hetero:
-            y = x @ self.wxy + h @ self.why + torch.randn(n, self.dim) * env
-            z = y @ self.wyz + h @ self.whz + torch.randn(n, self.dim)
+            y = x @ self.wxy + h @ self.why + self._noise(n) * env
+            z = y @ self.wyz + h @ self.whz + self._noise(n)
         else:
-            y = x @ self.wxy + h @ self.why + torch.randn(n, self.dim)
-            z = y @ self.wyz + h @ self.whz + torch.randn(n, self.dim) * env
+            y = x @ self.wxy + h @ self.why + self._noise(n)
+            z = y @ self.wyz + h @ self.whz + self._noise(n) * env
 
         return torch.cat((x, z), 1) @ self.scramble, y.sum(1, keepdim=True)
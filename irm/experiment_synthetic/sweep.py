@@ -0,0 +1,280 @@
+""" Run grids of synthetic experiments on a shared pool of worker processes
+
+A grid file is a toml file with three tables:
+
+    [params]    fixed parameters, same keys as `irm from_params`
+    [grid]      parameter name -> list of values, the cartesian product is run
+    [sweep]     (optional) n_workers and output directory
+
+Every (cell, repetition) pair is an independent work item. Items are
+submitted longest first so that the expensive cells do not end up
+running alone at the end of the sweep.
+
+The result store is a directory holding:
+
+    cells.toml                  parameters of every cell
+    cell=<id>/rep=<i>.csv       results of one repetition of one cell
+    cell=<id>/irm_training_rep=<i>.csv
+                                IRM training curves, or with
+                                irm_curve_format = "npz"
+                                irm_curves_rep=<i>.npz until consolidated
+    results.csv                 all partitions, tagged with the cell,
+                                the repetition and the grid values
+    irm_curves.npz              the npz curves of every partition, with
+                                their cell (see curves.py)
+    environments/               generated data shared by the cells that
+                                only differ in method settings, unless
+                                env_store is set (see envstore.py)
+"""
+
+import datetime as dt
+import itertools
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import toml
+
+from tqdm import tqdm
+
+from . import events
+from .halving import halving_iterations
+
+# torch, pandas and the experiment modules are imported by the functions
+# that run or gather work items, so that reading and expanding a grid
+# (e.g. by `irm queue init` or `irm queue status`) stays cheap.
+
+# Number of regularisation values tried by InvariantRiskMinimization
+_IRM_N_REGS = 6
+
+
+def load_grid(grid_file, defaults):
+    """Read a grid file, filling the missing parameters with the defaults"""
+    with open(grid_file, "r", encoding="utf-8") as _g_f:
+        raw = toml.load(_g_f)
+
+    unknown_tables = set(raw) - {"params", "grid", "sweep"}
+    if unknown_tables:
+        raise ValueError(f"Unknown tables in grid file: {sorted(unknown_tables)}")
+
+    for key, values in raw.get("grid", {}).items():
+        if key not in defaults:
+            raise KeyError(f"Unknown parameter in [grid]: {key}")
+        if not isinstance(values, list) or not values:
+            raise TypeError(f"[grid] {key} should be a non-empty list of values")
+
+    params = {**defaults, **raw.get("params", {})}
+    if "n_threads" not in raw.get("params", {}) and "n_threads" not in raw.get(
+        "grid", {}
+    ):
+        # resolved once the number of workers is known
+        params["n_threads"] = None
+
+    sweep = {
+        "n_workers": mp.cpu_count(),
+        "output": f"sweep_{str(dt.datetime.now()).split('.', maxsplit=1)[0].replace(' ', '_')}",
+        **raw.get("sweep", {}),
+    }
+
+    return {"params": params, "grid": raw.get("grid", {}), "sweep": sweep}
+
+
+def expand_grid(grid):
+    """List the parameters of every cell of the grid"""
+    keys = list(grid["grid"])
+    return [
+        {**grid["params"], **dict(zip(keys, values))}
+        for values in itertools.product(*(grid["grid"][k] for k in keys))
+    ]
+
+
+def irm_iterations(params):
+    """Training iterations of the IRM search of a repetition: every reg of
+    the grid, or the rungs of the halving search over the regs and lrs"""
+    if params.get("irm_search", "grid") != "halving":
+        return _IRM_N_REGS * params["n_iterations"]
+    n_lrs = len(str(params.get("irm_lrs") or params["lr"]).split(","))
+    return halving_iterations(
+        _IRM_N_REGS * n_lrs, params.get("irm_halving_eta", 2), params["n_iterations"]
+    )
+
+
+def relative_cost(params):
+    """Rough cost of a single repetition, only meaningful relative to
+    the cost of other configurations. Used to schedule long jobs first."""
+    if params["methods"] == "all":
+        method_names = ["ERM", "ICP", "IRM"]
+    else:
+        method_names = params["methods"].split(",")
+
+    n_envs = len(params["env_list"].split(","))
+    n_total = params["n_samples"] * n_envs
+    dim = params["dim"]
+
+    cost = n_total * dim  # data generation
+    if "ERM" in method_names:
+        cost += n_total * dim**2
+    if "ICP" in method_names:
+        cost += 2**dim * n_total * dim
+    if "IRM" in method_names:
+        # an iteration reads a minibatch of each environment if irm_batch_size
+        n_rows = params.get("irm_batch_size") or params["n_samples"]
+        cost += irm_iterations(params) * (n_envs - 1) * n_rows * dim**2
+
+    return cost
+
+
+def _partition(output, cell_id):
+    return Path(output) / f"cell={cell_id:04d}"
+
+
+def _run_cell_repetition(params, cell_id, rep_i, output):
+    """Work item: run one repetition of one cell and save its partition"""
+    import torch
+    import pandas as pd
+
+    from .main import make_repetition, run_repetition, select_methods, results_columns
+    from .curves import save_curves
+
+    partition = _partition(output, cell_id)
+    params = {
+        **params,
+        "irm_training_file": str(partition / f"irm_training_rep={rep_i}.csv"),
+    }
+    torch.set_num_threads(params["n_threads"])
+    events.open_stream(params.get("events"))
+    events.set_context(cell=cell_id, rep=rep_i)
+    events.emit("rep_start")
+
+    try:
+        sem, environments = make_repetition(params, rep_i)
+        curves = []
+        rows = list(
+            run_repetition(
+                sem,
+                environments,
+                select_methods(params),
+                params,
+                progress=False,
+                curves=curves,
+            )
+        )
+        pd.DataFrame(rows, columns=results_columns(params)).to_csv(
+            partition / f"rep={rep_i}.csv", index=False
+        )
+        if curves:
+            save_curves(
+                partition / f"irm_curves_rep={rep_i}.npz",
+                [(rep_i, recorder) for recorder in curves],
+                tolerance=params.get("irm_curve_tolerance", 0.0),
+            )
+        events.emit("rep_end")
+    finally:
+        events.set_context(cell=None, rep=None)
+        events.close_stream()
+
+    return cell_id, rep_i
+
+
+def consolidate(output, cells, grid_keys):
+    """Gather every partition of the store in a single results table, and
+    the npz curves in a single file"""
+    import pandas as pd
+
+    from .curves import merge_curve_files
+
+    curve_parts = {
+        cell_id: sorted(_partition(output, cell_id).glob("irm_curves_rep=*.npz"))
+        for cell_id in range(len(cells))
+    }
+    if any(curve_parts.values()):
+        merge_curve_files(Path(output) / "irm_curves.npz", curve_parts)
+
+    dfs = []
+    for cell_id, params in enumerate(cells):
+        for rep_file in sorted(_partition(output, cell_id).glob("rep=*.csv")):
+            _df = pd.read_csv(rep_file)
+            _df.insert(0, "Repetition", int(rep_file.stem.split("=")[-1]))
+            _df.insert(0, "Cell", cell_id)
+            for key in reversed(grid_keys):
+                _df.insert(2, key, params[key])
+            dfs.append(_df)
+
+    results_df = pd.concat(dfs, axis="rows", ignore_index=True) if dfs else None
+    if results_df is not None:
+        results_df.to_csv(Path(output) / "results.csv", index=False)
+
+    return results_df
+
+
+def run_sweep(grid):
+    """Run all the cells x repetitions of a grid.
+    Return the consolidated results."""
+    n_workers = grid["sweep"]["n_workers"]
+    output = Path(grid["sweep"]["output"]).resolve()
+    cells = expand_grid(grid)
+    for params in cells:
+        if params["n_threads"] is None:
+            params["n_threads"] = max(1, mp.cpu_count() // n_workers)
+        if params.get("events") is None:
+            params["events"] = str(output / "events.jsonl")
+        if params.get("env_store") is None:
+            # cells differing only in method settings share their data
+            params["env_store"] = str(output / "environments")
+
+    output.mkdir(parents=True, exist_ok=False)
+    with open(output / "cells.toml", "w", encoding="utf-8") as _c_f:
+        toml.dump({f"cell={i:04d}": params for i, params in enumerate(cells)}, _c_f)
+    for cell_id in range(len(cells)):
+        _partition(output, cell_id).mkdir()
+
+    # longest job first
+    work_items = sorted(
+        (
+            (cell_id, rep_i)
+            for cell_id, params in enumerate(cells)
+            for rep_i in range(params["n_reps"])
+        ),
+        key=lambda item: relative_cost(cells[item[0]]),
+        reverse=True,
+    )
+    print(
+        f"Sweep of {len(cells)} cells, {len(work_items)} work items "
+        f"on {n_workers} workers, writing to {output}"
+    )
+
+    events.open_stream(cells[0]["events"] if cells else None)
+    events.emit(
+        "run_start",
+        info={"n_reps": len(work_items), "n_cells": len(cells), "n_workers": n_workers},
+    )
+
+    failures = []
+    # spawn: do not fork a parent that has already initialised torch
+    with ProcessPoolExecutor(
+        max_workers=n_workers, mp_context=mp.get_context("spawn")
+    ) as pool:
+        futures = {
+            pool.submit(_run_cell_repetition, cells[cell_id], cell_id, rep_i, output): (
+                cell_id,
+                rep_i,
+            )
+            for cell_id, rep_i in work_items
+        }
+        for future in tqdm(
+            as_completed(futures), total=len(futures), desc="Sweep", unit="rep"
+        ):
+            try:
+                future.result()
+            except Exception as _e:  # keep the rest of the sweep going
+                cell_id, rep_i = futures[future]
+                print(f"cell={cell_id:04d} rep={rep_i} failed: {_e!r}")
+                failures.append(futures[future])
+
+    results_df = consolidate(output, cells, list(grid["grid"]))
+    events.emit("run_end", failures=len(failures))
+    events.close_stream()
+    if failures:
+        raise RuntimeError(f"{len(failures)} work items failed: {sorted(failures)}")
+
+    return results_df
@@ -0,0 +1,275 @@
+""" Directory based work queue to spread a sweep over several machines
+
+The queue only relies on a shared filesystem. `irm queue init` expands a
+grid file (see sweep.py) into one item per (cell, repetition):
+
+    cells.toml                  parameters of every cell
+    items/<rank>_<cell>_<rep>   one empty file per work item, the rank
+                                orders items longest job first
+    claims/<item>.lock          created atomically by the worker that
+                                runs the item, holds its identity; the
+                                worker touches it every heartbeat seconds
+                                while the item runs
+    done/<item>                 the item finished, its results are in
+    failed/<item>               the item raised, holds the traceback
+    cell=<id>/rep=<i>.csv       same partitions as an `irm sweep` store
+    environments/               shared generated data, as in a sweep
+
+Any number of `irm queue work` processes, on any machine, can be pointed
+at the same directory. With stale_after, a worker takes over the items
+whose lock has not been touched for that long, i.e. whose worker died.
+`irm queue status` reports the progress and `irm queue merge` writes the
+consolidated results.csv.
+"""
+
+import contextlib
+import datetime as dt
+import os
+import socket
+import threading
+import time
+import traceback
+from pathlib import Path
+
+import toml
+
+from .sweep import expand_grid, relative_cost, consolidate, _partition
+
+# seconds between two touches of the lock of a running item
+HEARTBEAT = 60.0
+
+
+def _item_name(rank, cell_id, rep_i):
+    return f"{rank:06d}_cell={cell_id:04d}_rep={rep_i}"
+
+
+def _parse_item(name):
+    """Return the cell id and the repetition of an item"""
+    _, cell, rep = name.split("_")
+    return int(cell.split("=")[-1]), int(rep.split("=")[-1])
+
+
+def load_cells(queue_dir):
+    """Read back the parameters of every cell of the queue"""
+    with open(Path(queue_dir) / "cells.toml", "r", encoding="utf-8") as _c_f:
+        cells = toml.load(_c_f)
+    return [cells[key] for key in sorted(cells)]
+
+
+def init_queue(grid, queue_dir):
+    """Write the work items of a grid in a new queue directory"""
+    queue_dir = Path(queue_dir)
+    if (queue_dir / "cells.toml").exists():
+        raise FileExistsError(f"{queue_dir} already holds a queue, aborting")
+
+    cells = expand_grid(grid)
+    for params in cells:
+        if params["n_threads"] is None:
+            # one worker per machine is the expected setup
+            params["n_threads"] = os.cpu_count()
+        if params.get("events") is None:
+            params["events"] = str(queue_dir.resolve() / "events.jsonl")
+        if params.get("env_store") is None:
+            params["env_store"] = str(queue_dir.resolve() / "environments")
+
+    for sub_dir in ["items", "claims", "done", "failed"]:
+        (queue_dir / sub_dir).mkdir(parents=True, exist_ok=True)
+    for cell_id in range(len(cells)):
+        _partition(queue_dir, cell_id).mkdir(exist_ok=True)
+    with open(queue_dir / "cells.toml", "w", encoding="utf-8") as _c_f:
+        toml.dump({f"cell={i:04d}": params for i, params in enumerate(cells)}, _c_f)
+    with open(queue_dir / "grid.toml", "w", encoding="utf-8") as _g_f:
+        toml.dump({"grid": grid["grid"]}, _g_f)
+
+    work_items = sorted(
+        (
+            (cell_id, rep_i)
+            for cell_id, params in enumerate(cells)
+            for rep_i in range(params["n_reps"])
+        ),
+        key=lambda item: relative_cost(cells[item[0]]),
+        reverse=True,
+    )
+    for rank, (cell_id, rep_i) in enumerate(work_items):
+        (queue_dir / "items" / _item_name(rank, cell_id, rep_i)).touch()
+
+    return len(work_items)
+
+
+def _take_over_stale(queue_dir, lock, item, worker_id, stale_after):
+    """Move the lock of an item away if it has not been touched for
+    stale_after seconds and the item is neither done nor failed"""
+    try:
+        seen = lock.stat()
+    except FileNotFoundError:
+        return
+    if time.time() - seen.st_mtime <= stale_after or _finished(queue_dir, item):
+        return
+
+    moved = lock.with_name(f"{lock.name}.stale.{worker_id}")
+    try:
+        # rename is atomic: only one worker moves a given lock away
+        lock.rename(moved)
+    except FileNotFoundError:
+        return
+    moved_stat = moved.stat()
+    if (moved_stat.st_ino, moved_stat.st_mtime_ns) != (seen.st_ino, seen.st_mtime_ns):
+        # between the stat and the rename, the lock was touched by its
+        # worker or taken over and claimed by another one: put it back
+        try:
+            os.link(moved, lock)
+        except FileExistsError:
+            pass
+    moved.unlink()
+
+
+def claim(queue_dir, item, worker_id, stale_after=None):
+    """Try to claim an item. Return True if this worker now owns it.
+
+    The claim is an O_CREAT | O_EXCL open of the lock file, which is atomic
+    on local and NFS filesystems: exactly one worker succeeds.
+    If stale_after (seconds) is given, a claim whose lock was last touched
+    longer ago than that, and whose item is neither done nor failed, is
+    considered abandoned and taken over."""
+    lock = Path(queue_dir) / "claims" / f"{item}.lock"
+    if stale_after is not None:
+        _take_over_stale(queue_dir, lock, item, worker_id, stale_after)
+
+    try:
+        _fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    with os.fdopen(_fd, "w", encoding="utf-8") as _lock:
+        _lock.write(f"{worker_id} {dt.datetime.now().isoformat()}\n")
+    return True
+
+
+@contextlib.contextmanager
+def heartbeat(queue_dir, item, interval=HEARTBEAT):
+    """Touch the lock of a claimed item every interval seconds while the
+    block runs, so that other workers do not consider it stale"""
+    lock = Path(queue_dir) / "claims" / f"{item}.lock"
+    inode = lock.stat().st_ino
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(interval):
+            try:
+                if lock.stat().st_ino != inode:
+                    return  # taken over, the lock is someone else's
+                os.utime(lock)
+            except FileNotFoundError:
+                # moved away by a worker checking whether it is stale, which
+                # links it back if it was fresh: try again at the next beat
+                continue
+
+    thread = threading.Thread(target=beat, name=f"heartbeat {item}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _finished(queue_dir, item):
+    queue_dir = Path(queue_dir)
+    return (queue_dir / "done" / item).exists() or (
+        queue_dir / "failed" / item
+    ).exists()
+
+
+def work(
+    queue_dir,
+    max_items=None,
+    stale_after=None,
+    run_item=None,
+    heartbeat_every=HEARTBEAT,
+):
+    """Claim and run items until the queue is empty (or max_items ran).
+    run_item(params, cell_id, rep_i, queue_dir) defaults to running the
+    repetition as `irm sweep` does. The lock of the running item is
+    touched every heartbeat_every seconds, stale_after should be a few
+    times longer.
+    Return the number of items run by this worker."""
+    if stale_after is not None and stale_after <= heartbeat_every:
+        raise ValueError(
+            f"stale_after ({stale_after}s) should be longer than the heartbeat "
+            f"({heartbeat_every}s), or live claims are taken over"
+        )
+    if run_item is None:
+        from .sweep import _run_cell_repetition as run_item
+
+    queue_dir = Path(queue_dir).resolve()
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    cells = load_cells(queue_dir)
+
+    n_run = 0
+    for item in sorted(os.listdir(queue_dir / "items")):
+        if max_items is not None and n_run >= max_items:
+            break
+        if _finished(queue_dir, item) or not claim(
+            queue_dir, item, worker_id, stale_after
+        ):
+            continue
+
+        cell_id, rep_i = _parse_item(item)
+        print(f"[{worker_id}] running cell={cell_id:04d} rep={rep_i}")
+        try:
+            with heartbeat(queue_dir, item, heartbeat_every):
+                run_item(cells[cell_id], cell_id, rep_i, queue_dir)
+        except Exception:  # record it and let the worker move on
+            (queue_dir / "failed" / item).write_text(
+                traceback.format_exc(), encoding="utf-8"
+            )
+        else:
+            (queue_dir / "done" / item).touch()
+        n_run += 1
+
+    return n_run
+
+
+def status(queue_dir, stale_after=None):
+    """Count the items of the queue in each state"""
+    queue_dir = Path(queue_dir)
+    items = set(os.listdir(queue_dir / "items"))
+    done = items & set(os.listdir(queue_dir / "done"))
+    failed = items & set(os.listdir(queue_dir / "failed"))
+    claimed = {
+        lock[: -len(".lock")]
+        for lock in os.listdir(queue_dir / "claims")
+        if lock.endswith(".lock")
+    }
+    running = claimed - done - failed
+
+    now = time.time()
+    workers = {}
+    stale = []
+    for item in running:
+        lock = queue_dir / "claims" / f"{item}.lock"
+        try:
+            worker_id = lock.read_text(encoding="utf-8").split(" ", maxsplit=1)[0]
+            age = now - lock.stat().st_mtime
+        except FileNotFoundError:
+            continue
+        workers[worker_id] = workers.get(worker_id, 0) + 1
+        if stale_after is not None and age > stale_after:
+            stale.append(item)
+
+    return {
+        "total": len(items),
+        "pending": len(items - claimed - done - failed),
+        "running": len(running),
+        "done": len(done),
+        "failed": sorted(failed),
+        "stale": sorted(stale),
+        "workers": workers,
+    }
+
+
+def merge(queue_dir):
+    """Write the consolidated results.csv of the queue"""
+    queue_dir = Path(queue_dir)
+    with open(queue_dir / "grid.toml", "r", encoding="utf-8") as _g_f:
+        grid_keys = list(toml.load(_g_f)["grid"])
+    return consolidate(queue_dir, load_cells(queue_dir), grid_keys)
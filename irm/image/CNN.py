@@ -23,6 +23,9 @@ from torchvision import transforms
 from torchvision import datasets
 import torchvision.datasets.utils as dataset_utils
 
+from irm.experiment_mnist.cnn_data import (
+  ColoredMNISTTensors, make_environments_loader, make_loader, normalize_batch)
+
 
 
 """## Prepare the colored MNIST dataset
@@ -165,6 +168,12 @@ class ColoredMNIST(datasets.VisionDataset):
     torch.save(train2_set, os.path.join(colored_mnist_dir, 'train2.pt'))
     torch.save(test_set, os.path.join(colored_mnist_dir, 'test.pt'))
 
+"""The environments are rather used as uint8 tensors (see
+irm/experiment_mnist/cnn_data.py): built in one vectorized pass from a fixed
+seed, memory-mapped, served without a per-image decode and normalized per
+batch with `normalize_batch`.
+"""
+
 """### Plot the data"""
 
 def plot_dataset_digits(dataset):
@@ -178,15 +187,15 @@ def plot_dataset_digits(dataset):
     img, label = dataset[i]
     # create subplot and append to ax
     ax.append(fig.add_subplot(rows, columns, i + 1))
-    ax[-1].set_title("Label: " + str(label))  # set title
-    plt.imshow(img)
+    ax[-1].set_title("Label: " + str(int(label)))  # set title
+    plt.imshow(img.permute(1, 2, 0))
 
   plt.show()  # finally, render the plot
 
-train1_set = ColoredMNIST(root='./data', env='train1')
+train1_set = ColoredMNISTTensors(root='./data', env='train1')
 plot_dataset_digits(train1_set)
 
-test_set = ColoredMNIST(root='./data', env='test')
+test_set = ColoredMNISTTensors(root='./data', env='test')
 plot_dataset_digits(test_set)
 
 """## Define neural network
@@ -223,7 +232,7 @@ def test_model(model, device, test_loader, set_name="test set"):
   correct = 0
   with torch.no_grad():
     for data, target in test_loader:
-      data, target = data.to(device), target.to(device).float()
+      data, target = normalize_batch(data, device), target.to(device).float()
       output = model(data)
       test_loss += F.binary_cross_entropy_with_logits(output, target, reduction='sum').item()  # sum up batch loss
       pred = torch.where(torch.gt(output, torch.Tensor([0.0]).to(device)),
@@ -243,7 +252,7 @@ def test_model(model, device, test_loader, set_name="test set"):
 def erm_train(model, device, train_loader, optimizer, epoch):
   model.train()
   for batch_idx, (data, target) in enumerate(train_loader):
-    data, target = data.to(device), target.to(device).float()
+    data, target = normalize_batch(data, device), target.to(device).float()
     optimizer.zero_grad()
     output = model(data)
     loss = F.binary_cross_entropy_with_logits(output, target)
@@ -255,24 +264,21 @@ def erm_train(model, device, train_loader, optimizer, epoch):
                100. * batch_idx / len(train_loader), loss.item()))
 
 
-def train_and_test_erm():
+def train_and_test_erm(**loader_kwargs):
   use_cuda = torch.cuda.is_available()
   device = torch.device("cuda" if use_cuda else "cpu")
 
-  kwargs = {'num_workers': 1, 'pin_memory': True} if use_cuda else {}
-  all_train_loader = torch.utils.data.DataLoader(
-    ColoredMNIST(root='./data', env='all_train',
-                 transform=transforms.Compose([
-                     transforms.ToTensor(),
-                     transforms.Normalize((0.1307, 0.1307, 0.), (0.3081, 0.3081, 0.3081))
-                   ])),
+  # whole batches are gathered at once: on CPU, loading in the main process is
+  # cheapest
+  kwargs = {'num_workers': 1, 'pin_memory': True, 'persistent_workers': True,
+            'prefetch_factor': 2} if use_cuda else {}
+  kwargs.update(loader_kwargs)  # e.g. num_workers=2, persistent_workers=True
+  all_train_loader = make_loader(
+    ColoredMNISTTensors(root='./data', env='all_train'),
     batch_size=64, shuffle=True, **kwargs)
 
-  test_loader = torch.utils.data.DataLoader(
-    ColoredMNIST(root='./data', env='test', transform=transforms.Compose([
-      transforms.ToTensor(),
-      transforms.Normalize((0.1307, 0.1307, 0.), (0.3081, 0.3081, 0.3081))
-    ])),
+  test_loader = make_loader(
+    ColoredMNISTTensors(root='./data', env='test'),
     batch_size=1000, shuffle=True, **kwargs)
 
   model = ConvNet().to(device)
@@ -297,70 +303,59 @@ def compute_irm_penalty(losses, dummy):
   return (g1 * g2).sum()
 
 
-def irm_train(model, device, train_loaders, optimizer, epoch):
+def irm_train(model, device, train_loader, optimizer, epoch):
+  """One epoch on the fused batches of the train environments (see
+  make_environments_loader): a single forward per step, the logits being
+  split per environment for the losses and penalties"""
   model.train()
 
-  train_loaders = [iter(x) for x in train_loaders]
-
   dummy_w = torch.nn.Parameter(torch.Tensor([1.0])).to(device)
 
-  batch_idx = 0
   penalty_multiplier = epoch ** 1.6
   print(f'Using penalty multiplier {penalty_multiplier}')
-  while True:
+  for batch_idx, (data, target, offsets) in enumerate(train_loader):
     optimizer.zero_grad()
+    data, target = normalize_batch(data, device), target.to(device).float()
+    output = model(data)
+    loss_erm = F.binary_cross_entropy_with_logits(output * dummy_w, target, reduction='none')
     error = 0
     penalty = 0
-    for loader in train_loaders:
-      data, target = next(loader, (None, None))
-      if data is None:
-        return
-      data, target = data.to(device), target.to(device).float()
-      output = model(data)
-      loss_erm = F.binary_cross_entropy_with_logits(output * dummy_w, target, reduction='none')
-      penalty += compute_irm_penalty(loss_erm, dummy_w)
-      error += loss_erm.mean()
+    for env_loss in loss_erm.split(offsets.diff().tolist()):
+      penalty += compute_irm_penalty(env_loss, dummy_w)
+      error += env_loss.mean()
     (error + penalty_multiplier * penalty).backward()
     #(error + penalty).backward()
     optimizer.step()
     if batch_idx % 2 == 0:
       print('Train Epoch: {} [{}/{} ({:.0f}%)]\tERM loss: {:.6f}\tGrad penalty: {:.6f}'.format(
-        epoch, batch_idx * len(data), len(train_loaders[0]),
-               100. * batch_idx / len(train_loaders[0]), error.item(), penalty.item()))
+        epoch, batch_idx * len(data), len(train_loader.dataset),
+               100. * batch_idx / len(train_loader), error.item(), penalty.item()))
       print('First 20 logits', output.data.cpu().numpy()[:20])
 
-    batch_idx += 1
-
 
-def train_and_test_irm():
+def train_and_test_irm(**loader_kwargs):
   l_train1_acc=[]
   l_train2_acc=[]
   l_test_acc=[]
   use_cuda = torch.cuda.is_available()
   device = torch.device("cuda" if use_cuda else "cpu")
 
-  kwargs = {'num_workers': 1, 'pin_memory': True} if use_cuda else {}
-  train1_loader = torch.utils.data.DataLoader(
-    ColoredMNIST(root='./data', env='train1',
-                 transform=transforms.Compose([
-                     transforms.ToTensor(),
-                     transforms.Normalize((0.1307, 0.1307, 0.), (0.3081, 0.3081, 0.3081))
-                   ])),
-    batch_size=2000, shuffle=True, **kwargs)
-
-  train2_loader = torch.utils.data.DataLoader(
-    ColoredMNIST(root='./data', env='train2',
-                 transform=transforms.Compose([
-                     transforms.ToTensor(),
-                     transforms.Normalize((0.1307, 0.1307, 0.), (0.3081, 0.3081, 0.3081))
-                   ])),
-    batch_size=2000, shuffle=True, **kwargs)
-
-  test_loader = torch.utils.data.DataLoader(
-    ColoredMNIST(root='./data', env='test', transform=transforms.Compose([
-      transforms.ToTensor(),
-      transforms.Normalize((0.1307, 0.1307, 0.), (0.3081, 0.3081, 0.3081))
-    ])),
+  # whole batches are gathered at once: on CPU, loading in the main process is
+  # cheapest
+  kwargs = {'num_workers': 1, 'pin_memory': True, 'persistent_workers': True,
+            'prefetch_factor': 2} if use_cuda else {}
+  kwargs.update(loader_kwargs)  # e.g. num_workers=2, persistent_workers=True
+  train1_set = ColoredMNISTTensors(root='./data', env='train1')
+  train2_set = ColoredMNISTTensors(root='./data', env='train2')
+  # 2000 images of each environment per step, in one batch
+  train_loader = make_environments_loader(
+    [train1_set, train2_set], batch_size=2000, mode='balanced', **kwargs)
+
+  train1_loader = make_loader(train1_set, batch_size=2000, shuffle=True, **kwargs)
+  train2_loader = make_loader(train2_set, batch_size=2000, shuffle=True, **kwargs)
+
+  test_loader = make_loader(
+    ColoredMNISTTensors(root='./data', env='test'),
     batch_size=1000, shuffle=True, **kwargs)
 
   model = ConvNet().to(device)
@@ -368,7 +363,7 @@ def train_and_test_irm():
   optimizer = optim.Adam(model.parameters(), lr=0.001)
 
   for epoch in range(1, 31):
-    irm_train(model, device, [train1_loader, train2_loader], optimizer, epoch)
+    irm_train(model, device, train_loader, optimizer, epoch)
     train1_acc = test_model(model, device, train1_loader, set_name='train1 set')
     l_train1_acc += [train1_acc]
     train2_acc = test_model(model, device, train2_loader, set_name='train2 set')
@@ -0,0 +1,32 @@
+import pandas as pd
+import pytest
+
+from irm.experiment_synthetic.aggregate import load_results, summarize
+
+
+def _results(err_irm):
+    setup = {"Coefficients": 1, "GraphObservation": 1, "Dispersion": 0, "Scramble": 1}
+    return pd.DataFrame(
+        [
+            {**setup, "Method": "SEM", "ErrCausal": 0.0, "ErrNonCausal": 0.0},
+            {**setup, "Method": "IRM", "ErrCausal": err_irm, "ErrNonCausal": 1.0},
+            {**setup, "Method": "ERM", "ErrCausal": 2.0, "ErrNonCausal": 3.0},
+        ]
+    ).assign(X1=1.0, X2=0.0)
+
+
+def test_summary_of_several_runs(tmp_path):
+    for run, err_irm in enumerate([0.1, 0.3]):
+        (tmp_path / f"run={run}").mkdir()
+        _results(err_irm).to_csv(
+            tmp_path / f"run={run}" / "irm_results_2022-02-21_23:08:46.csv", index=False
+        )
+
+    results_df = load_results([tmp_path])
+    assert "X1" not in results_df
+    summary = summarize(results_df)
+
+    assert list(summary.index) == [("POS", "ERM"), ("POS", "IRM")]
+    assert summary.loc[("POS", "IRM"), ("ErrCausal", "mean")] == pytest.approx(0.2)
+    assert summary.loc[("POS", "IRM"), ("ErrCausal", "std")] == pytest.approx(0.1)
+    assert summary.loc[("POS", "IRM"), ("ErrCausal", "count")] == 2
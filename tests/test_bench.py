@@ -0,0 +1,51 @@
+import pytest
+
+from irm.experiment_synthetic import bench
+
+
+def _results(**cases):
+    return {
+        "meta": {},
+        "results": {
+            name: {"metric": metric, "best": best}
+            for name, (metric, best) in cases.items()
+        },
+    }
+
+
+def test_compare(tmp_path):
+    bench.save(
+        _results(
+            sem=("seconds", 1.0),
+            erm=("seconds", 1.0),
+            irm=("iterations_per_second", 100.0),
+            icp=("seconds", 1.0),
+        ),
+        tmp_path / "baseline.json",
+    )
+    bench.save(
+        _results(
+            sem=("seconds", 1.05),
+            erm=("seconds", 1.5),
+            irm=("iterations_per_second", 80.0),
+            new_case=("seconds", 9.0),
+        ),
+        tmp_path / "current.json",
+    )
+
+    regressions = bench.compare(
+        bench.load(tmp_path / "current.json"), bench.load(tmp_path / "baseline.json")
+    )
+    # fewer iterations per second is worse, cases missing from either
+    # file are ignored
+    assert [name for name, *_ in regressions] == ["erm", "irm"]
+    assert regressions[0][1:] == (1.0, 1.5, pytest.approx(0.5))
+    assert regressions[1][1:] == (100.0, 80.0, pytest.approx(0.2))
+    assert (
+        bench.compare(
+            bench.load(tmp_path / "current.json"),
+            bench.load(tmp_path / "baseline.json"),
+            tolerance=0.6,
+        )
+        == []
+    )
@@ -0,0 +1,19 @@
+"""Hot path benchmarks, run with pytest-benchmark installed:
+
+    pytest tests/test_benchmarks.py --benchmark-only
+"""
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from irm.experiment_synthetic import bench
+
+
+@pytest.mark.parametrize(
+    "name,case,kwargs",
+    [(name, case, kwargs) for name, _, case, kwargs in bench.bench_cases(quick=True)],
+    ids=[name for name, *_ in bench.bench_cases(quick=True)],
+)
+def test_hot_path(benchmark, name, case, kwargs):
+    benchmark(case(**kwargs))
@@ -0,0 +1,67 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+HEAVY_MODULES = {"torch", "pandas", "numpy", "sklearn", "scipy", "matplotlib"}
+
+
+def _modules_loaded_by(argv):
+    """Top-level modules imported by `irm <argv>` before it exits"""
+    code = f"""
+import json, sys
+sys.argv = ["irm", *{argv!r}]
+from irm.__main__ import main
+try:
+    main()
+except SystemExit:
+    pass
+print(json.dumps(sorted({{m.split(".")[0] for m in sys.modules}})))
+"""
+    env = {**os.environ, "PYTHONPATH": str(REPO_ROOT)}
+    out = subprocess.run(
+        [sys.executable, "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=REPO_ROOT,
+        env=env,
+    )
+    return set(json.loads(out.stdout.strip().splitlines()[-1]))
+
+
+ARGVS = [
+    ["--help"],
+    ["not_a_command"],
+    ["from_params", "--help"],
+    ["results", "--help"],
+    ["render", "--help"],
+    ["mnist", "--help"],
+    ["boosting", "--help"],
+    ["results", "query", "--help"],
+    ["results", "ingest", "--help"],
+    ["from_params", "--not_an_option"],
+    ["from_file", "--help"],
+    ["sweep", "--help"],
+    ["queue", "--help"],
+    *[["queue", action, "--help"] for action in ["init", "work", "status", "merge"]],
+    ["status", "--help"],
+    ["bench", "--help"],
+    ["estimate", "--help"],
+]
+
+
+@pytest.mark.parametrize("argv", ARGVS)
+def test_cli_does_not_import_heavy_modules(argv):
+    assert not _modules_loaded_by(argv) & HEAVY_MODULES
+
+
+def test_every_subcommand_is_checked():
+    from irm.experiment_synthetic.cli import IRMRunner
+
+    subcommands = {name for name in vars(IRMRunner) if not name.startswith("_")}
+    assert subcommands <= {argv[0] for argv in ARGVS}
@@ -0,0 +1,262 @@
+import numpy as np
+import pytest
+import torch
+from torch.nn import functional as F
+
+from irm.experiment_mnist import cnn_data
+from irm.experiment_mnist.boosting import _fit_shared, _share, fit_repetition
+from irm.experiment_mnist.cnn_data import (
+    ColoredMNISTTensors,
+    MultiEnvironmentSampler,
+    TensorBatchSampler,
+    color_images,
+    make_environments_loader,
+    make_loader,
+    normalize_batch,
+    tensors_dir,
+)
+from irm.experiment_mnist.data import (
+    _CACHE_NAME,
+    as_environment,
+    color_environments,
+    load_mnist,
+)
+from irm.experiment_mnist.main import run_experiment
+from irm.experiment_mnist.engine import evaluate, fuse_environments, train_metrics
+from irm.experiment_mnist.models import (
+    MLP,
+    BatchedLinear,
+    BatchedMLP,
+    mean_nll,
+    penalty,
+)
+from irm.experiment_mnist.trainer import Trainer, anneal_schedule
+
+
+def test_color_environments():
+    images = torch.randint(0, 256, (100, 28, 28), dtype=torch.uint8)
+    digits = torch.randint(0, 10, (100,))
+    colored, labels = color_environments(images, digits, [0.0, 1.0], label_noise=0.0)
+
+    assert colored.shape == (2, 100, 2, 14, 14) and colored.dtype == torch.uint8
+    assert torch.equal(labels[0, :, 0], (digits < 5).float())
+    small = images[:, ::2, ::2]
+    for env, color in [(0, labels[0, :, 0].long()), (1, 1 - labels[1, :, 0].long())]:
+        rows = torch.arange(100)
+        assert torch.equal(colored[env, rows, color], small)
+        assert not colored[env, rows, 1 - color].any()
+
+    env = as_environment(colored[0], labels[0])
+    assert torch.allclose(env["images"], colored[0].float() / 255.0)
+
+
+def test_cnn_color_images():
+    rng = np.random.default_rng(0)
+    images = rng.integers(0, 256, (100, 28, 28), dtype=np.uint8)
+    digits = rng.integers(0, 10, 100)
+    colored, labels = color_images(images, digits, np.zeros(100), rng, label_noise=0.0)
+
+    assert colored.shape == (100, 3, 28, 28) and colored.dtype == np.uint8
+    assert np.array_equal(labels, digits >= 5)
+    red = labels == 0
+    assert np.array_equal(colored[red, 0], images[red])
+    assert np.array_equal(colored[~red, 1], images[~red])
+    assert not colored[red, 1:].any() and not colored[~red][:, [0, 2]].any()
+
+    # as ToTensor and Normalize on the images
+    batch = torch.from_numpy(colored[:10])
+    mean = torch.tensor([0.1307, 0.1307, 0.0])[:, None, None]
+    expected = (batch.float() / 255.0 - mean) / 0.3081
+    assert torch.allclose(normalize_batch(batch), expected, atol=1e-6)
+
+
+def _colored_tensors(root, n_images=100):
+    rng = np.random.default_rng(0)
+    images = rng.integers(0, 256, (n_images, 28, 28), dtype=np.uint8)
+    colored, labels = color_images(
+        images, rng.integers(0, 10, n_images), np.full(n_images, 0.2), rng
+    )
+    directory = tensors_dir(root)
+    directory.mkdir(parents=True)
+    np.save(directory / "images.npy", colored)
+    np.save(directory / "labels.npy", labels)
+    return colored, labels
+
+
+def test_cnn_batch_loader(tmp_path):
+    colored, labels = _colored_tensors(tmp_path)
+    dataset = ColoredMNISTTensors(tmp_path, "train1")
+    assert len(dataset) == 100
+    assert torch.equal(dataset[3][0], torch.from_numpy(colored[3]))
+
+    for kwargs in [{}, {"num_workers": 1, "persistent_workers": True}]:
+        loader = make_loader(dataset, 32, shuffle=True, **kwargs)
+        assert len(loader) == 4
+        seen = []
+        for images, targets in loader:
+            assert images.shape[1:] == (3, 28, 28) and len(images) <= 32
+            seen += [(image.sum().item(), int(y)) for image, y in zip(images, targets)]
+        expected = [(int(x.sum()), int(y)) for x, y in zip(colored, labels)]
+        assert sorted(seen) == sorted(expected)
+
+
+def test_loader_only_passes_a_given_prefetch_factor(monkeypatch):
+    passed = []
+    monkeypatch.setattr(
+        cnn_data, "DataLoader", lambda dataset, **kwargs: passed.append(kwargs)
+    )
+    sampler = TensorBatchSampler(10, 4)
+    # torch 1.x raises on prefetch_factor=None, and on any value without
+    # workers
+    cnn_data._batch_loader(None, sampler, prefetch_factor=4)
+    cnn_data._batch_loader(None, sampler, num_workers=2)
+    cnn_data._batch_loader(None, sampler, num_workers=2, prefetch_factor=4)
+    assert ["prefetch_factor" in kwargs for kwargs in passed] == [False, False, True]
+    assert passed[-1]["prefetch_factor"] == 4
+
+
+def test_multi_environment_sampler():
+    sizes = [50, 120, 30]
+    balanced = list(MultiEnvironmentSampler(sizes, 16))
+    assert len(balanced) == 8
+    for env, size in enumerate(sizes):
+        seen = torch.cat([batch[env] for batch in balanced])
+        assert len(seen) == 8 * 16 and set(seen.tolist()) == set(range(size))
+
+    weighted = list(MultiEnvironmentSampler(sizes, 16, mode="weighted"))
+    assert len(weighted) == 5
+    for env, size in enumerate(sizes):
+        seen = torch.cat([batch[env] for batch in weighted])
+        assert sorted(seen.tolist()) == list(range(size))
+
+
+def test_cnn_environments_loader():
+    # TensorDataset is indexed by tensors as ColoredMNISTTensors
+    environments = [
+        torch.utils.data.TensorDataset(
+            torch.arange(size)[:, None].repeat(1, 3) + 1000 * env,
+            torch.full((size,), env),
+        )
+        for env, size in enumerate([50, 120])
+    ]
+    loader = make_environments_loader(environments, 16, mode="weighted")
+    seen = []
+    for images, targets, offsets in loader:
+        assert offsets[0] == 0 and offsets[-1] == len(images) == len(targets)
+        for env, (start, end) in enumerate(zip(offsets[:-1], offsets[1:])):
+            assert (targets[start:end] == env).all()
+        seen += images[:, 0].tolist()
+    assert sorted(seen) == list(range(50)) + list(range(1000, 1120))
+
+
+def test_batched_mlp_matches_independent_models():
+    mlp = BatchedMLP(3, hidden_dim=16)
+    images, labels = torch.rand(50, 2, 14, 14), (torch.rand(50, 1) < 0.5).float()
+    logits = mlp(images)
+    nll = mean_nll(logits, labels)
+    penalties = penalty(logits, labels)
+    layers = [m for m in mlp.modules() if isinstance(m, BatchedLinear)]
+
+    for model in range(3):
+        out = images.view(50, -1)
+        for i, layer in enumerate(layers):
+            out = out @ layer.weight[model] + layer.bias[model]
+            out = out.relu() if i < len(layers) - 1 else out
+        scale = torch.tensor(1.0, requires_grad=True)
+        model_nll = F.binary_cross_entropy_with_logits(out * scale, labels)
+        grad = torch.autograd.grad(model_nll, [scale])[0]
+        assert torch.allclose(logits[model], out, atol=1e-6)
+        assert torch.allclose(nll[model], model_nll)
+        assert torch.allclose(penalties[model], grad**2)
+        assert torch.allclose(penalty(out, labels), grad**2)
+
+
+def test_fused_train_metrics_match_per_environment():
+    mlp = BatchedMLP(2, hidden_dim=8)
+    envs = [
+        {"images": torch.rand(n, 2, 14, 14), "labels": (torch.rand(n, 1) < 0.5).float()}
+        for n in [30, 20]
+    ]
+    metrics = train_metrics(mlp, fuse_environments(envs))
+
+    logits = [mlp(env["images"]) for env in envs]
+    nll = torch.stack([mean_nll(l, env["labels"]) for l, env in zip(logits, envs)])
+    penalties = [penalty(l, env["labels"]) for l, env in zip(logits, envs)]
+    assert torch.allclose(metrics["nll"], nll.mean(dim=0))
+    assert torch.allclose(metrics["penalty"], torch.stack(penalties).mean(dim=0))
+    assert not evaluate(mlp, envs[:1])[0].requires_grad
+
+
+@pytest.mark.parametrize("before_1_13", [False, True])
+def test_trainer_resumes_from_checkpoint(tmp_path, monkeypatch, before_1_13):
+    if before_1_13:
+        _torch_load_before_1_13(monkeypatch)
+    envs = [
+        {"images": torch.rand(n, 2, 14, 14), "labels": (torch.rand(n, 1) < 0.5).float()}
+        for n in [30, 20, 10]
+    ]
+
+    def fit(n_steps, checkpoint):
+        torch.manual_seed(0)
+        model = MLP(hidden_dim=8)
+        trainer = Trainer(
+            model,
+            torch.optim.Adam(model.parameters(), lr=1e-2),
+            schedule=anneal_schedule(100.0, anneal_iters=3),
+            eval_every=2,
+        )
+        return model, trainer.fit(envs[:2], envs[2:], n_steps, checkpoint=checkpoint)
+
+    model, history = fit(6, None)
+    fit(4, tmp_path / "checkpoint.pt")
+    resumed, resumed_history = fit(6, tmp_path / "checkpoint.pt")
+
+    assert [r["step"] for r in history] == [0, 2, 4, 5]
+    assert [r["step"] for r in resumed_history] == [0, 2, 3, 4, 5]
+    for p, p_resumed in zip(model.parameters(), resumed.parameters()):
+        assert torch.allclose(p, p_resumed)
+
+
+def test_boosting_on_shared_arrays():
+    rng = np.random.default_rng(0)
+    y = rng.integers(0, 2, (2, 200), dtype=np.uint8)
+    x = (rng.integers(0, 100, (2, 200, 392)) + 100 * y[..., None]).astype(np.uint8)
+    arrays = {"x_train": x, "y_train": y, "x_test": x[:, :50], "y_test": y[:, :50]}
+
+    blocks, specs = _share(arrays)
+    try:
+        row = _fit_shared(specs, 1, "histgb", 0, 1)
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+    assert fit_repetition(arrays, 1, "histgb", 0, 1)[:4] == row[:4]
+    assert row[:2] == (1, "histgb") and row[3] == 1.0
+
+
+def _torch_load_before_1_13(monkeypatch):
+    """Replace torch.load with one of the signature of torch 1.10 to 1.12,
+    which has no weights_only and always unpickles everything"""
+    load = torch.load
+    monkeypatch.setattr(
+        torch,
+        "load",
+        lambda f, map_location=None, pickle_module=None, **pickle_load_args: load(
+            f, map_location, weights_only=False, **pickle_load_args
+        ),
+    )
+
+
+def test_load_mnist_cache_on_torch_without_weights_only(tmp_path, monkeypatch):
+    images = torch.randint(0, 256, (10, 28, 28), dtype=torch.uint8)
+    targets = torch.arange(10)
+    torch.save({"images": images, "targets": targets}, tmp_path / _CACHE_NAME)
+    _torch_load_before_1_13(monkeypatch)
+
+    loaded_images, loaded_targets = load_mnist(tmp_path)
+    assert torch.equal(loaded_images, images) and torch.equal(loaded_targets, targets)
+
+
+def test_checkpoints_need_a_seed(tmp_path):
+    with pytest.raises(ValueError, match="seed"):
+        run_experiment({"checkpoint_dir": str(tmp_path), "seed": -1})
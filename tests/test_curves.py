@@ -0,0 +1,64 @@
+import numpy as np
+
+from irm.experiment_synthetic.curves import (
+    CurveRecorder,
+    load_curves,
+    merge_curve_files,
+    save_curves,
+)
+
+
+def _recorder(n_points=200):
+    recorder = CurveRecorder(lr=0.001)
+    recorder.writerow(["iteration", "reg", "error", "penalty"])
+    for reg in [0, 0.1]:
+        for iteration in range(0, 10 * n_points, 10):
+            # a fast decrease, then a flat tail
+            error = 1 + 100 * np.exp(-iteration / 100)
+            recorder.writerow([iteration, reg, error, 2 * error])
+    return recorder
+
+
+def test_curves_round_trip(tmp_path):
+    save_curves(tmp_path / "irm_curves_a.npz", [(0, _recorder()), (1, _recorder())])
+    save_curves(tmp_path / "irm_curves_b.npz", [(0, _recorder())], tolerance=0.01)
+
+    df = load_curves([tmp_path])
+    full = df[df.Source.str.endswith("irm_curves_a.npz")]
+    assert len(full) == 2 * 2 * 200
+    assert set(full.lr) == {0.001}
+
+    downsampled = df[df.Source.str.endswith("irm_curves_b.npz")]
+    for reg, curve in downsampled.groupby("reg"):
+        assert 2 < len(curve) < 50
+        # the kept points draw the curve within the tolerance, on the
+        # normalized log scale
+        log_full = np.log(full[(full.repetition == 0) & (full.reg == reg)].error)
+        log_kept = np.interp(range(0, 2000, 10), curve.iteration, np.log(curve.error))
+        span = log_full.max() - log_full.min()
+        assert np.abs(log_kept - log_full.values).max() / span <= 0.01 + 1e-6
+
+
+def test_merge_curve_files(tmp_path):
+    parts = {}
+    for cell_id in range(2):
+        cell_dir = tmp_path / f"cell={cell_id:04d}"
+        cell_dir.mkdir()
+        parts[cell_id] = [cell_dir / f"irm_curves_rep={i}.npz" for i in range(2)]
+        for rep_i, part in enumerate(parts[cell_id]):
+            save_curves(part, [(rep_i, _recorder(10))])
+    merged = tmp_path / "irm_curves.npz"
+    merge_curve_files(merged, parts)
+
+    df = load_curves([merged])
+    assert len(df) == 2 * 2 * 2 * 10
+    assert df.groupby(["cell", "repetition"]).size().to_dict() == {
+        (c, r): 20 for c in range(2) for r in range(2)
+    }
+    assert not any(p.exists() for part_paths in parts.values() for p in part_paths)
+
+    # a repetition run again replaces its rows, the others are kept
+    save_curves(parts[1][0], [(0, _recorder(5))])
+    merge_curve_files(merged, {1: [parts[1][0]]})
+    sizes = load_curves([merged]).groupby(["cell", "repetition"]).size()
+    assert sizes.to_dict() == {(0, 0): 20, (0, 1): 20, (1, 0): 10, (1, 1): 20}
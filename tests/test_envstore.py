@@ -0,0 +1,21 @@
+import torch
+
+from irm.experiment_synthetic.cli import params_parser
+from irm.experiment_synthetic.main import make_repetition
+
+
+def test_stored_repetition_matches_generated(tmp_path):
+    args = dict(vars(params_parser().parse_args([])), dim=6, n_samples=50)
+    args["env_store"] = str(tmp_path)
+
+    sem, environments = make_repetition(args, 3)
+    after_generation = torch.randn(4)
+    stored_sem, stored_environments = make_repetition(args, 3)
+    after_load = torch.randn(4)
+
+    assert len(list(tmp_path.iterdir())) == 1
+    for (x, y), (x_s, y_s) in zip(environments, stored_environments):
+        assert torch.equal(x, x_s) and torch.equal(y, y_s)
+    assert all(map(torch.equal, sem.solution(), stored_sem.solution()))
+    # the methods draw the same random numbers in both cases
+    assert torch.equal(after_generation, after_load)
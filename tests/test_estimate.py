@@ -0,0 +1,49 @@
+from irm.experiment_synthetic import estimate
+from irm.experiment_synthetic.cli import params_parser
+
+
+def _params(**kwargs):
+    params = dict(vars(params_parser().parse_args([])), dim=4, n_samples=100)
+    return {**params, "n_reps": 3, "n_iterations": 100, **kwargs}
+
+
+def _calibration(rep_seconds, peak_rss_mb=100.0):
+    return {
+        "seconds": {"data": rep_seconds},
+        "rep_seconds": rep_seconds,
+        "peak_rss_mb": peak_rss_mb,
+        "environments_mb": 10.0,
+    }
+
+
+def test_estimate_run():
+    calibration = estimate.calibrate(_params(), irm_iterations=10)
+    assert set(calibration["seconds"]) == {"data", "ERM", "ICP", "IRM"}
+    assert calibration["rep_seconds"] > 0 and calibration["environments_mb"] > 0
+
+    # the repetitions run in sequence, their environments all kept
+    run = estimate.estimate_run(_params(), calibration=_calibration(2.0))
+    assert run["total_seconds"] == 3 * 2.0
+    assert run["total_peak_mb"] == 100.0 + 2 * 10.0
+
+
+def test_estimate_sweep(monkeypatch):
+    calibrated = []
+
+    def calibrate(params, irm_iterations):
+        calibrated.append(params)
+        return _calibration(params["dim"], peak_rss_mb=10.0 * params["dim"])
+
+    monkeypatch.setattr(estimate, "calibrate", calibrate)
+    # the first two cells only differ in the number of repetitions
+    cells = [_params(dim=4), _params(dim=4, n_reps=1), _params(dim=8)]
+    sweep = estimate.estimate_sweep(cells, n_workers=2)
+
+    assert [p["dim"] for p in calibrated] == [4, 8]
+    assert [c["total_seconds"] for c in sweep["cells"]] == [12.0, 4.0, 24.0]
+    assert sweep["total_seconds"] == 40.0
+    assert sweep["wall_seconds"] == 20.0
+    assert sweep["peak_mb"] == 2 * 80.0
+    # a single long repetition bounds the wall time
+    sweep = estimate.estimate_sweep([_params(dim=8, n_reps=1)], n_workers=4)
+    assert sweep["wall_seconds"] == 8.0
@@ -0,0 +1,58 @@
+import json
+import sys
+
+from irm.experiment_synthetic import events
+from irm.experiment_synthetic.cli import IRMRunner
+
+
+def _events():
+    def event(time, name, **fields):
+        return {"time": time, "event": name, "host": "node", "pid": 1, **fields}
+
+    return [
+        event(0.0, "run_start", info={"n_reps": 2}),
+        event(1.0, "method_start", rep=0, method="IRM"),
+        event(11.0, "method_end", rep=0, method="IRM"),
+        event(11.0, "rep_end", rep=0),
+        event(12.0, "method_start", rep=1, method="ERM"),
+        event(14.0, "method_end", rep=1, method="ERM"),
+        event(14.0, "method_start", rep=1, method="IRM"),
+        event(
+            20.0,
+            "irm_progress",
+            rep=1,
+            reg=0.1,
+            iteration=50,
+            n_iterations=100,
+            iterations_per_second=10.0,
+        ),
+    ]
+
+
+def test_summarize():
+    summary = events.summarize(_events(), now=34.0)
+
+    assert summary["runs"] == {("node", 1): {"start": 0.0, "end": None, "n_reps": 2}}
+    assert summary["reps_done"] == 1
+    assert summary["mean_durations"] == {"IRM": 10.0, "ERM": 2.0}
+    assert summary["last_event"] == 20.0
+    (job,) = summary["in_flight"]
+    assert (job["rep"], job["method"], job["elapsed"]) == (1, "IRM", 20.0)
+    assert job["mean_duration"] == 10.0
+    assert job["progress"]["iteration"] == 50
+
+
+def test_status(tmp_path, monkeypatch, capsys):
+    with open(tmp_path / "events.jsonl", "w", encoding="utf-8") as _e_f:
+        for event in _events():
+            _e_f.write(json.dumps(event) + "\n")
+        # a line cut by a writer that is still running
+        _e_f.write('{"time": 21.0, "event": "rep_')
+    monkeypatch.setattr(sys, "argv", ["irm", "status", str(tmp_path)])
+    IRMRunner()
+
+    out = capsys.readouterr().out
+    assert "1 repetitions done" in out
+    assert "IRM: 10.0s per fit on average" in out
+    assert "1 methods running" in out
+    assert "rep=1 IRM" in out and "reg=0.1 50/100 at 10 it/s" in out
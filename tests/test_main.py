@@ -0,0 +1,46 @@
+import os
+
+import torch
+
+from irm.experiment_synthetic.cli import params_parser
+from irm.experiment_synthetic.main import (
+    make_repetition,
+    run_repetition,
+    select_methods,
+)
+
+
+def _args(**kwargs):
+    args = dict(vars(params_parser().parse_args([])), dim=4, n_samples=100)
+    args.update({"n_iterations": 50, "verbose": 0, "irm_training_file": os.devnull})
+    return {**args, **kwargs}
+
+
+def _solutions(args):
+    sem, environments = make_repetition(args, 0)
+    methods = select_methods(args)
+    rows = list(run_repetition(sem, environments, methods, args, progress=False))
+    return [(row[4], row[-args["dim"] :]) for row in rows]
+
+
+def test_concurrent_methods_find_the_same_solutions():
+    # the slowest method first
+    sequential = _solutions(_args(methods="IRM,ICP,ERM"))
+    concurrent = _solutions(_args(methods="IRM,ICP,ERM", method_workers=3))
+
+    # rows in the order of the methods, whichever finished first
+    assert [method for method, _ in concurrent] == ["SEM", "IRM", "ICP", "ERM"]
+    for (_, solution), (_, concurrent_solution) in zip(sequential, concurrent):
+        assert torch.allclose(
+            torch.tensor(solution), torch.tensor(concurrent_solution), atol=1e-6
+        )
+
+
+def test_repetitions_of_nearby_seeds_differ():
+    # with seed + rep_i, seed 0 rep 1 was seed 1 rep 0
+    _, environments = make_repetition(_args(seed=0), 1)
+    _, shifted = make_repetition(_args(seed=1), 0)
+    _, again = make_repetition(_args(seed=0), 1)
+
+    assert not torch.equal(environments[0][0], shifted[0][0])
+    assert torch.equal(environments[0][0], again[0][0])
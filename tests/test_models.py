@@ -0,0 +1,120 @@
+import os
+
+import numpy as np
+import pytest
+import torch
+
+from irm.experiment_synthetic import events
+from irm.experiment_synthetic.halving import halving_iterations, halving_schedule
+from irm.experiment_synthetic.models import (
+    EmpiricalRiskMinimizer,
+    InvariantCausalPrediction,
+    InvariantRiskMinimization,
+)
+from irm.experiment_synthetic.sem import ChainEquationModel
+
+
+def _irm_args(**kwargs):
+    args = {"irm_cuda": False, "verbose": 0, "lr": 1e-3, "n_iterations": 81}
+    args.update({"irm_epoch_size": 1000, "irm_training_file": os.devnull})
+    return {**args, **kwargs}
+
+
+def _environments(n_samples=200, dtype=torch.float32):
+    torch.manual_seed(0)
+    sem = ChainEquationModel(4, dtype=dtype)
+    return sem, [sem(n_samples, e) for e in [0.2, 2.0, 5.0]]
+
+
+def test_halving_schedule():
+    assert halving_schedule(12, 3, 81) == [(12, 3), (4, 9), (2, 27), (1, 81)]
+    assert halving_iterations(12, 3, 81) == 12 * 3 + 4 * 6 + 2 * 18 + 81 - 27
+    # a single candidate is trained as long as by the grid search
+    assert halving_schedule(1, 2, 100) == [(1, 100)]
+
+
+def test_successive_halving_keeps_the_best_candidates(monkeypatch):
+    ends = []
+    monkeypatch.setattr(
+        events,
+        "emit",
+        lambda kind, **fields: ends.append(fields) if kind == "irm_reg_end" else None,
+    )
+    _, environments = _environments()
+    args = _irm_args(irm_search="halving", irm_lrs="1e-2,1e-3", irm_halving_eta=3)
+    model = InvariantRiskMinimization(environments, args)
+
+    # 6 regs x 2 lrs
+    schedule = halving_schedule(12, 3, 81)
+    assert model.n_iterations_run == halving_iterations(12, 3, 81)
+    rungs = [[e for e in ends if e["iteration"] == stop] for _, stop in schedule]
+    assert [len(rung) for rung in rungs] == [n for n, _ in schedule]
+
+    for rung, next_rung in zip(rungs, rungs[1:]):
+        best = sorted(rung, key=lambda e: e["validation_error"])[: len(next_rung)]
+        assert {(e["reg"], e["lr"]) for e in best} == {
+            (e["reg"], e["lr"]) for e in next_rung
+        }
+    (winner,) = rungs[-1]
+    assert (model.best_reg, model.best_lr) == (winner["reg"], winner["lr"])
+
+    x_val, y_val = environments[-1]
+    error = (x_val @ model.solution() - y_val).pow(2).mean().item()
+    assert abs(error - winner["validation_error"]) < 1e-5
+
+
+def _memmap_environments(environments, directory):
+    memmaps = []
+    for i, env in enumerate(environments):
+        arrays = []
+        for name, tensor in zip("xy", env):
+            path = directory / f"{name}{i}.npy"
+            np.save(path, tensor.numpy())
+            arrays.append(np.load(path, mmap_mode="r"))
+        memmaps.append(tuple(arrays))
+    return memmaps
+
+
+def test_minibatch_irm_on_memmaps_converges_near_full_batch(tmp_path):
+    _, environments = _environments(n_samples=500)
+    memmaps = _memmap_environments(environments, tmp_path)
+    args = _irm_args(lr=1e-2, n_iterations=400)
+
+    full = InvariantRiskMinimization(environments, args)
+    torch.manual_seed(1)
+    minibatch = InvariantRiskMinimization(memmaps, {**args, "irm_batch_size": 256})
+
+    assert isinstance(memmaps[0][0], np.memmap)
+    difference = (minibatch.solution() - full.solution()).abs().max().item()
+    assert difference < 0.05
+
+
+def test_memmap_environments_need_a_batch_size(tmp_path):
+    _, environments = _environments(n_samples=20)
+    memmaps = _memmap_environments(environments, tmp_path)
+
+    with pytest.raises(TypeError, match="irm_batch_size"):
+        InvariantRiskMinimization(memmaps, _irm_args(irm_batch_size=0))
+
+
+def test_float64_path():
+    sem, environments = _environments(dtype=torch.float64)
+    solution, scramble = sem.solution()
+    assert solution.dtype == scramble.dtype == torch.float64
+    assert all(x.dtype == y.dtype == torch.float64 for x, y in environments)
+
+    environments_32 = [(x.float(), y.float()) for x, y in environments]
+    args = _irm_args(alpha=0.05)
+    for method in [
+        EmpiricalRiskMinimizer,
+        InvariantCausalPrediction,
+        InvariantRiskMinimization,
+    ]:
+        torch.manual_seed(1)
+        solution = method(environments, args).solution()
+        assert solution.dtype == torch.float64, method.__name__
+        # the same data, up to the float32 rounding
+        torch.manual_seed(1)
+        solution_32 = method(environments_32, args).solution()
+        assert solution_32.dtype == torch.float32, method.__name__
+        assert torch.allclose(solution.float(), solution_32, atol=1e-3)
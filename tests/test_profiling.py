@@ -0,0 +1,59 @@
+import math
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from irm.experiment_synthetic.profiling import (
+    COST_COLUMNS,
+    Measurement,
+    reset_peak_rss,
+)
+
+
+def test_measurement_values():
+    with Measurement() as cost:
+        sum(range(10000))
+
+    values = dict(zip(COST_COLUMNS, cost.values(n_iterations=10)))
+    assert values["WallTime"] > 0 and values["CPUTime"] >= 0
+    assert values["Iterations"] == 10
+    assert values["IterationsPerSecond"] == pytest.approx(10 / values["WallTime"])
+    assert math.isnan(cost.values()[COST_COLUMNS.index("Iterations")])
+
+
+@pytest.mark.skipif(not reset_peak_rss(), reason="the RSS peak cannot be reset")
+def test_peak_rss_is_per_measurement():
+    with Measurement() as large:
+        array = np.ones(50 * 1024**2 // 8)  # 50 MB, touched
+        del array
+    with Measurement() as small:
+        sum(range(10000))
+
+    assert large.peak_rss - small.peak_rss > 40
+
+
+def test_concurrent_measurements_have_no_peak_rss():
+    with Measurement(per_thread=True) as cost:
+        sum(range(10000))
+
+    assert math.isnan(cost.peak_rss)
+
+
+@pytest.mark.parametrize("has_reset_peak", [True, False])
+def test_tracemalloc_peak_is_per_measurement(monkeypatch, has_reset_peak):
+    if not has_reset_peak:
+        # Python 3.8
+        monkeypatch.delattr(tracemalloc, "reset_peak", raising=False)
+    tracemalloc.start()
+    try:
+        with Measurement(trace_memory=True) as large:
+            array = np.ones(20 * 1024**2 // 8)
+            del array
+        with Measurement(trace_memory=True) as small:
+            sum(range(10000))
+    finally:
+        tracemalloc.stop()
+
+    assert large.tracemalloc_peak > 19
+    assert small.tracemalloc_peak < 1
@@ -0,0 +1,41 @@
+import os
+
+from irm.experiment_synthetic import render
+from irm.experiment_synthetic.aggregate import load_results
+
+from .test_aggregate import _results
+
+
+def _jobs(tmp_path, err_irm_by_run):
+    for run, err_irm in err_irm_by_run.items():
+        run_dir = tmp_path / "runs" / f"run={run}"
+        run_dir.mkdir(parents=True, exist_ok=True)
+        _results(err_irm).to_csv(
+            run_dir / "irm_results_2022-02-21_23:08:46.csv", index=False
+        )
+    results_df = load_results([tmp_path / "runs"])
+    return render.figure_jobs(results_df, tmp_path / "figures", by=["Source"])
+
+
+def test_render_skips_unchanged_figures(tmp_path):
+    jobs = _jobs(tmp_path, {0: 0.1, 1: 0.3})
+    # the results only have partially observed setups
+    assert [job["category"] for job in jobs] == ["P", "P"]
+    rendered, skipped = render.render(jobs, tmp_path / "figures", n_workers=1)
+    assert len(rendered) == 2 and not skipped
+    assert all(os.path.exists(fname) for fname in rendered)
+
+    # only the figure of the modified run is drawn again
+    jobs = _jobs(tmp_path, {1: 0.5})
+    rendered, skipped = render.render(jobs, tmp_path / "figures", n_workers=1)
+    assert len(rendered) == 1 and len(skipped) == 1
+    assert "run=1" in rendered[0] and "run=0" in skipped[0]
+
+    # a deleted figure is drawn again, force draws every one
+    os.remove(skipped[0])
+    rendered, skipped = render.render(jobs, tmp_path / "figures", n_workers=1)
+    assert len(rendered) == 1 and len(skipped) == 1
+    rendered, skipped = render.render(
+        jobs, tmp_path / "figures", n_workers=1, force=True
+    )
+    assert len(rendered) == 2 and not skipped
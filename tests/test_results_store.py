@@ -0,0 +1,137 @@
+import os
+import sqlite3
+
+from irm.experiment_synthetic import results_store
+from irm.experiment_synthetic.curves import (
+    CurveRecorder,
+    merge_curve_files,
+    save_curves,
+)
+
+_HEADER = "Coefficients,GraphObservation,Dispersion,Scramble,Method,ErrCausal,ErrNonCausal,X1,X2\n"
+
+
+def _write_run(run_dir, err_irm):
+    run_dir.mkdir()
+    (run_dir / "irm_config_2022-02-21_22:53:54.toml").write_text(
+        'dim = 2\nenv_list = ".2,2.,5."\nsetup_hidden = 1\nmethods = "IRM"\n'
+    )
+    for rep_i in range(2):
+        (run_dir / f"irm_training_2022-02-21_22:5{5 + rep_i}:00.csv").write_text(
+            "iteration,reg,error,penalty\n0,0,142.4,549.6\n50,0,77.3,177.9\n"
+        )
+    (run_dir / "irm_results_2022-02-21_23:08:46.csv").write_text(
+        _HEADER
+        + "1,1,1,0,SEM,0.0,0.0,1.0,0.0\n"
+        + f"1,1,1,0,IRM,{err_irm},0.5,0.9,0.1\n"
+        + "1,1,1,0,SEM,0.0,0.0,1.0,0.0\n"
+        + f"1,1,1,0,IRM,{err_irm},0.5,0.8,0.2\n"
+    )
+
+
+def test_ingest_and_query(tmp_path):
+    db = tmp_path / "store.sqlite"
+    _write_run(tmp_path / "run", 0.25)
+
+    assert results_store.ingest(db, [tmp_path]) == {"loaded": 3, "skipped": 0}
+    header, rows = results_store.query(
+        db,
+        filters={"Method": "IRM", "setup_hidden": "1", "n_envs": "3"},
+        columns=["Repetition", "ErrCausal", "Solution"],
+    )
+    assert header == ["Repetition", "ErrCausal", "Solution"]
+    assert rows == [(0, 0.25, "[0.9,0.1]"), (1, 0.25, "[0.8,0.2]")]
+    _, rows = results_store.query(db, "training", {"Repetition": "1"})
+    assert len(rows) == 2
+
+    # only modified files are loaded again, replacing their rows
+    assert results_store.ingest(db, [tmp_path]) == {"loaded": 0, "skipped": 3}
+    results_file = next((tmp_path / "run").glob("irm_results_*"))
+    results_file.write_text(results_file.read_text().replace("0.25", "0.125"))
+    os.utime(results_file, (0, 0))
+    assert results_store.ingest(db, [tmp_path]) == {"loaded": 1, "skipped": 2}
+    _, rows = results_store.query(db, filters={"Method": "IRM"}, columns=["ErrCausal"])
+    assert rows == [(0.125,), (0.125,)]
+
+
+def _recorder(reg, errors):
+    recorder = CurveRecorder(lr=0.01)
+    recorder.writerow(["iteration", "reg", "error", "penalty"])
+    for iteration, error in enumerate(errors):
+        recorder.writerow([iteration, reg, error, 0.0])
+    return recorder
+
+
+def test_ingest_npz_curves(tmp_path):
+    db = tmp_path / "store.sqlite"
+    run_dir = tmp_path / "run"
+    _write_run(run_dir, 0.25)
+    for training_file in run_dir.glob("irm_training_*"):
+        training_file.unlink()
+    save_curves(
+        run_dir / "irm_curves_2022-02-21_23:08:46.npz",
+        [(0, _recorder(0, [3.0, 2.0])), (1, _recorder(0, [3.0, 1.0, 0.5]))],
+    )
+
+    sweep_dir = tmp_path / "sweep"
+    sweep_dir.mkdir()
+    (sweep_dir / "cells.toml").write_text(
+        '["cell=0000"]\ndim = 3\nsetup_hidden = 0\n\n'
+        '["cell=0001"]\ndim = 3\nsetup_hidden = 1\n'
+    )
+    parts = {}
+    for cell_id in range(2):
+        cell_dir = sweep_dir / f"cell={cell_id:04d}"
+        cell_dir.mkdir()
+        (cell_dir / "rep=0.csv").write_text(_HEADER + "1,1,1,0,IRM,0.5,0.5,1.0,0.0\n")
+        parts[cell_id] = [cell_dir / "irm_curves_rep=0.npz"]
+        save_curves(parts[cell_id][0], [(0, _recorder(cell_id, [1.0] * (cell_id + 1)))])
+    merge_curve_files(sweep_dir / "irm_curves.npz", parts)
+
+    # the merged curves are loaded once per cell
+    assert results_store.ingest(db, [tmp_path]) == {"loaded": 6, "skipped": 0}
+    _, rows = results_store.query(
+        db, "training", {"Repetition": "1"}, ["iteration", "lr", "error"]
+    )
+    assert rows == [(0, 0.01, 3.0), (1, 0.01, 1.0), (2, 0.01, 0.5)]
+    for hidden, n_rows in [("0", 1), ("1", 2)]:
+        _, rows = results_store.query(
+            db, "training", {"setup_hidden": hidden, "dim": "3"}, ["reg"]
+        )
+        assert rows == [(int(hidden),)] * n_rows
+    assert results_store.ingest(db, [tmp_path]) == {"loaded": 0, "skipped": 6}
+
+
+def test_runs_differing_in_method_settings(tmp_path):
+    db = tmp_path / "store.sqlite"
+    # a store created before the scramble kind, dtype and search columns
+    new_columns = ["setup_scramble_kind", "dtype", "irm_search"]
+    old_columns = [c for c in results_store.CONFIG_COLUMNS if c not in new_columns]
+    with sqlite3.connect(db) as con:
+        con.execute(
+            "CREATE TABLE runs (run_id INTEGER PRIMARY KEY, source TEXT UNIQUE, "
+            f"timestamp TEXT, config TEXT, n_envs INTEGER, {', '.join(old_columns)})"
+        )
+    _write_run(tmp_path / "grid", 0.25)
+    _write_run(tmp_path / "halving", 0.5)
+    config = next((tmp_path / "halving").glob("irm_config_*"))
+    config.write_text(
+        config.read_text()
+        + 'irm_search = "halving"\ndtype = "float64"\nsetup_scramble_kind = "hadamard"\n'
+    )
+
+    results_store.ingest(db, [tmp_path])
+    columns = ["irm_search", "dtype", "setup_scramble_kind", "ErrCausal"]
+    # the runs written before these settings existed used the defaults
+    _, rows = results_store.query(
+        db, filters={"irm_search": "grid", "Method": "IRM"}, columns=columns
+    )
+    assert set(rows) == {("grid", "float32", "dense", 0.25)}
+    _, rows = results_store.query(
+        db, filters={"dtype": "float64", "Method": "IRM"}, columns=columns
+    )
+    assert set(rows) == {("halving", "float64", "hadamard", 0.5)}
+    _, rows = results_store.query(
+        db, "training", {"setup_scramble_kind": "hadamard"}, ["Repetition"]
+    )
+    assert len(rows) == 4
@@ -0,0 +1,32 @@
+import pytest
+import torch
+
+from irm.experiment_synthetic.sem import ChainEquationModel, HadamardScramble
+
+
+def test_structured_scramble_is_orthogonal():
+    scramble = HadamardScramble(256)
+    dense = torch.eye(256) @ scramble
+    x, w = torch.randn(10, 256), torch.randn(256, 1)
+
+    assert torch.allclose(dense @ dense.t(), torch.eye(256), atol=1e-5)
+    assert torch.allclose(x @ scramble, x @ dense, atol=1e-4)
+    assert torch.allclose(scramble @ w, dense @ w, atol=1e-4)
+
+
+@pytest.mark.parametrize("kind", ["dense", "hadamard"])
+def test_scramble_mixes_coordinates(kind):
+    torch.manual_seed(0)
+    dim = 1024
+    sem = ChainEquationModel(dim, scramble=True, scramble_kind=kind)
+    dense = torch.eye(dim) @ sem.scramble
+
+    # far from the identity: no coordinate is kept, every one is spread
+    assert dense.diag().abs().max() < 0.2
+    assert dense.diag().abs().mean() < 0.05
+    assert dense.abs().max() < 0.3
+
+
+def test_unknown_scramble_kind():
+    with pytest.raises(ValueError, match="householder"):
+        ChainEquationModel(8, scramble=True, scramble_kind="householder")
@@ -0,0 +1,79 @@
+import pytest
+
+from irm.experiment_synthetic import sweep
+from irm.experiment_synthetic.cli import params_parser
+from irm.experiment_synthetic.estimate import _calibration_key
+
+
+def _params(**kwargs):
+    params = {"dim": 4, "n_reps": 2, "n_threads": 1, "methods": "IRM", "seed": 0}
+    params.update({"n_samples": 100, "n_iterations": 81, "env_list": ".2,2.,5."})
+    params.update({"lr": 1e-3, "setup_ones": 1, "setup_hidden": 0})
+    params.update({"setup_scramble": 0, "setup_hetero": 0})
+    return {**params, **kwargs}
+
+
+def test_relative_cost_follows_the_irm_search():
+    grid = _params()
+    halving = _params(irm_search="halving", irm_halving_eta=3)
+    halving_lrs = _params(irm_search="halving", irm_halving_eta=3, irm_lrs="1e-2,1e-3")
+
+    # every reg for 81 iterations, against 6 candidates for 9 iterations, 2
+    # up to 27 and the winner up to 81
+    assert sweep.irm_iterations(grid) == 6 * 81
+    assert sweep.irm_iterations(halving) == 6 * 9 + 2 * 18 + 81 - 27
+    assert (
+        sweep.relative_cost(grid)
+        > sweep.relative_cost(halving_lrs)
+        > sweep.relative_cost(halving)
+    )
+    keys = {_calibration_key(p) for p in [grid, halving, halving_lrs]}
+    assert len(keys) == 3
+
+
+def test_relative_cost_follows_the_irm_batch_size():
+    full_batch, minibatch = _params(), _params(irm_batch_size=10)
+
+    assert sweep.relative_cost(full_batch) > sweep.relative_cost(minibatch)
+    assert _calibration_key(full_batch) != _calibration_key(minibatch)
+
+
+@pytest.mark.parametrize(
+    "grid_toml,error",
+    [
+        ("[cells]\n", ValueError),
+        ("[grid]\nnot_a_parameter = [1, 2]\n", KeyError),
+        ("[grid]\ndim = []\n", TypeError),
+    ],
+)
+def test_load_grid_rejects_invalid_grids(tmp_path, grid_toml, error):
+    (tmp_path / "grid.toml").write_text(grid_toml)
+    with pytest.raises(error):
+        sweep.load_grid(tmp_path / "grid.toml", vars(params_parser().parse_args([])))
+
+
+def test_sweep_of_two_cells(tmp_path):
+    (tmp_path / "grid.toml").write_text(
+        '[params]\nn_reps = 2\nn_samples = 50\nn_iterations = 10\nmethods = "ERM,IRM"\n'
+        "[grid]\ndim = [2, 4]\n"
+        f'[sweep]\nn_workers = 1\noutput = "{tmp_path / "sweep"}"\n'
+    )
+    grid = sweep.load_grid(tmp_path / "grid.toml", vars(params_parser().parse_args([])))
+    cells = sweep.expand_grid(grid)
+
+    assert [(c["dim"], c["n_reps"], c["methods"]) for c in cells] == [
+        (2, 2, "ERM,IRM"),
+        (4, 2, "ERM,IRM"),
+    ]
+    # the larger cell is run first
+    assert sweep.relative_cost(cells[1]) > sweep.relative_cost(cells[0])
+
+    results_df = sweep.run_sweep(grid)
+    # SEM, ERM and IRM rows of every (cell, repetition)
+    assert len(results_df) == 2 * 2 * 3
+    assert list(results_df.columns[:3]) == ["Cell", "Repetition", "dim"]
+    for (cell_id, rep_i), rows in results_df.groupby(["Cell", "Repetition"]):
+        assert list(rows.Method) == ["SEM", "ERM", "IRM"]
+        assert set(rows.dim) == {cells[cell_id]["dim"]}
+        assert rows[f"X{cells[cell_id]['dim']}"].notna().all()
+    assert (tmp_path / "sweep" / "results.csv").exists()
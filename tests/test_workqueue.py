@@ -0,0 +1,121 @@
+import multiprocessing as mp
+import os
+import time
+
+import pytest
+
+from irm.experiment_synthetic import workqueue
+
+
+def _fake_run_item(params, cell_id, rep_i, queue_dir):
+    """Record which process ran the item instead of running an experiment"""
+    record = workqueue._partition(queue_dir, cell_id) / f"rep={rep_i}.pid"
+    with open(record, "a", encoding="utf-8") as _r:
+        _r.write(f"{os.getpid()}\n")
+    if params["dim"] == 3 and rep_i == 1:
+        raise ValueError("this item always fails")
+
+
+def _worker(queue_dir):
+    workqueue.work(queue_dir, run_item=_fake_run_item)
+
+
+def _grid():
+    params = {"dim": 2, "n_reps": 5, "n_threads": 1, "methods": "ERM"}
+    params.update({"n_samples": 10, "n_iterations": 1, "env_list": ".2,2."})
+    return {"params": params, "grid": {"dim": [2, 3, 4]}, "sweep": {}}
+
+
+def test_each_item_runs_once(tmp_path):
+    assert workqueue.init_queue(_grid(), tmp_path) == 15
+
+    ctx = mp.get_context("fork")
+    workers = [ctx.Process(target=_worker, args=(tmp_path,)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    records = sorted(tmp_path.glob("cell=*/rep=*.pid"))
+    assert len(records) == 15
+    for record in records:
+        assert len(record.read_text(encoding="utf-8").split()) == 1
+
+    report = workqueue.status(tmp_path)
+    assert report["done"] == 14
+    assert [item.split("_", 1)[1] for item in report["failed"]] == ["cell=0001_rep=1"]
+    assert report["pending"] == report["running"] == 0
+
+
+def test_stale_claims_are_taken_over(tmp_path):
+    workqueue.init_queue(_grid(), tmp_path)
+    item = sorted(os.listdir(tmp_path / "items"))[0]
+
+    assert workqueue.claim(tmp_path, item, "dead-worker")
+    assert not workqueue.claim(tmp_path, item, "other-worker")
+    assert workqueue.status(tmp_path, stale_after=-1)["stale"] == [item]
+    assert workqueue.claim(tmp_path, item, "other-worker", stale_after=-1)
+    # the moved lock is not left behind
+    assert os.listdir(tmp_path / "claims") == [f"{item}.lock"]
+
+
+def _age(path, seconds):
+    old = time.time() - seconds
+    os.utime(path, (old, old))
+
+
+def test_running_claims_are_kept_fresh(tmp_path):
+    workqueue.init_queue(_grid(), tmp_path)
+    item = sorted(os.listdir(tmp_path / "items"))[0]
+    lock = tmp_path / "claims" / f"{item}.lock"
+
+    assert workqueue.claim(tmp_path, item, "live-worker")
+    _age(lock, 1000)
+    with workqueue.heartbeat(tmp_path, item, interval=0.05):
+        time.sleep(0.3)
+    assert workqueue.status(tmp_path, stale_after=100)["stale"] == []
+    assert not workqueue.claim(tmp_path, item, "other-worker", stale_after=100)
+    assert lock.read_text(encoding="utf-8").startswith("live-worker")
+
+
+def test_heartbeat_survives_a_lock_moved_back(tmp_path):
+    workqueue.init_queue(_grid(), tmp_path)
+    item = sorted(os.listdir(tmp_path / "items"))[0]
+    lock = tmp_path / "claims" / f"{item}.lock"
+    moved = lock.with_name(f"{lock.name}.stale.other-worker")
+
+    assert workqueue.claim(tmp_path, item, "live-worker")
+    with workqueue.heartbeat(tmp_path, item, interval=0.02):
+        # what a worker does when the lock was touched while it checked it
+        lock.rename(moved)
+        time.sleep(0.1)
+        os.link(moved, lock)
+        moved.unlink()
+        _age(lock, 1000)
+        time.sleep(0.2)
+    assert workqueue.status(tmp_path, stale_after=100)["stale"] == []
+
+
+def test_take_over_checks_the_lock_it_moved(tmp_path, monkeypatch):
+    workqueue.init_queue(_grid(), tmp_path)
+    item = sorted(os.listdir(tmp_path / "items"))[0]
+    lock = tmp_path / "claims" / f"{item}.lock"
+    assert workqueue.claim(tmp_path, item, "dead-worker")
+    _age(lock, 1000)
+
+    def _other_worker_takes_over(queue_dir, name):
+        # after our stat of the stale lock, before our rename
+        lock.unlink()
+        assert workqueue.claim(queue_dir, name, "other-worker")
+        return False
+
+    monkeypatch.setattr(workqueue, "_finished", _other_worker_takes_over)
+    assert not workqueue.claim(tmp_path, item, "late-worker", stale_after=100)
+    assert lock.read_text(encoding="utf-8").startswith("other-worker")
+    assert os.listdir(tmp_path / "claims") == [f"{item}.lock"]
+
+
+def test_stale_after_must_exceed_the_heartbeat(tmp_path):
+    workqueue.init_queue(_grid(), tmp_path)
+    with pytest.raises(ValueError, match="heartbeat"):
+        workqueue.work(tmp_path, stale_after=10, heartbeat_every=60)